@@ -4,6 +4,7 @@ from argparse import ArgumentParser
 import codecs
 import logging
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import os
 from random import random
 import signal
@@ -11,6 +12,7 @@ from subprocess import check_output
 import sys
 import tagme
 
+import expertfinding
 from expertfinding import ExpertFinding as EF
 
 
@@ -29,18 +31,27 @@ SCORING_FUNCTIONS = {foo.func_name: foo
                          ]
                     }
 
-def initialize_ef_processor(storage_db, scoring_f, rel_dict_file):
-    global exf, scoring_foo
+def initialize_ef_processor(storage_db, scoring_fs, rel_dict_file, in_memory_index, snapshot_path):
+    global exf, scoring_foos
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    exf = EF(storage_db, relatedness_dict_file=rel_dict_file)
-    scoring_foo = scoring_f
+    exf = EF(storage_db, relatedness_dict_file=rel_dict_file, in_memory_index=in_memory_index, read_only=True, snapshot_path=snapshot_path)
+    scoring_foos = scoring_fs
 
 
 def ef_processor(data):
-    global exf, scoring_foo
+    """
+    Annotates a topic once and ranks the authors with all scoring functions. The runtime of each
+    function includes the annotation and the retrieval of the candidates, as if it ran alone.
+    """
+    global exf, scoring_foos
     query_id, query = data
-    hits, runtime, query_entities = exf.find_expert(query, scoring_foo)
-    return query_id, (hits, runtime, query_entities)
+    rankings, timings, query_entities = exf.find_expert_multi(query, scoring_foos)
+    runtimes = [timings["annotation"] + timings["candidates"] + timings[scoring_foo.func_name] for scoring_foo in scoring_foos]
+    return query_id, rankings, runtimes, query_entities
+
+
+def trec_eval(qrels_filename, results_filename):
+    return check_output(["trec_eval", "-c", "-q", "-M", "1000", "-m", "all_trec", qrels_filename, results_filename])
 
 
 def topics_generator(filename):
@@ -65,36 +76,49 @@ def main():
     parser.add_argument("-t", "--topics", required=True, action="store", help="Topic id-description mapping file")
     parser.add_argument("-q", "--qrels", required=True, action="store", help="Qrel file")
     parser.add_argument("-f", "--scoring", required=True, action="store", nargs="+", help="Name of scoring functions tu test", choices=SCORING_FUNCTIONS.keys())
+    parser.add_argument("-c", "--cache_dir", action="store", help="Annotation cache directory (shared with create_db.py)")
+    parser.add_argument("-m", "--in_memory_index", action="store_true", help="Answer queries with an in-memory index instead of the DB")
+    parser.add_argument("--snapshot", action="store", help="Load the in-memory index from this snapshot (see expertfinding/preprocessing/create_snapshot.py)")
+    parser.add_argument("-w", "--workers", action="store", type=int, help="Number of worker processes (default: number of CPUs)")
     args = parser.parse_args()
 
     tagme.GCUBE_TOKEN = args.gcube_token
+    if args.cache_dir:
+        expertfinding.set_cache(args.cache_dir)
 
     topics = dict((topic_id, t_desc) for topic_id, t_desc in topics_generator(args.topics))
 
-    queries = sorted((topic_id, topics[topic_id]) for topic_id, _, _ in qrels_generator(args.qrels))
+    queries = sorted(set((topic_id, topics[topic_id]) for topic_id, _, _ in qrels_generator(args.qrels)))
 
-    for scoring_foo in [SCORING_FUNCTIONS[scoring_f_name] for scoring_f_name in args.scoring]:
-        pool = Pool(initializer=initialize_ef_processor, initargs=(args.storage_db, scoring_foo, args.relatedness_dict))
-        try:
-            results = dict(pool.map(ef_processor, queries))
-        except KeyboardInterrupt:
-            pool.terminate()
-            pool.join()
+    scoring_foos = [SCORING_FUNCTIONS[scoring_f_name] for scoring_f_name in args.scoring]
+    results_filename_bases = ["{}_{}".format(scoring_foo.func_name, os.path.split(args.qrels)[-1].replace(".qrel", "")) for scoring_foo in scoring_foos]
+    results_fs = [open(base + ".results", "w") for base in results_filename_bases]
+    runtime_fs = [open(base + ".runtime", "w") for base in results_filename_bases]
+    query_entities_fs = [open(base + ".queryentities", "w") for base in results_filename_bases]
 
-        results_filename_base = "{}_{}".format(scoring_foo.func_name, os.path.split(args.qrels)[-1].replace(".qrel", ""))
-        results_filename = results_filename_base + ".results"
-        runtime_filename = results_filename_base + ".runtime"
-        query_entities_filename = results_filename_base + ".queryentities"
-
-        with open(results_filename, "w") as results_f, open(runtime_filename, "w") as runtime_f, open(query_entities_filename, "w") as query_entities_f:
-            for q_id in results:
-                hits, runtime, query_entities = results[q_id]
+    pool = Pool(args.workers, initializer=initialize_ef_processor, initargs=(args.storage_db, scoring_foos, args.relatedness_dict, args.in_memory_index, args.snapshot))
+    try:
+        for done, (q_id, rankings, runtimes, query_entities) in enumerate(pool.imap_unordered(ef_processor, queries), 1):
+            for scoring_foo, hits, runtime, results_f, runtime_f, query_entities_f in zip(scoring_foos, rankings, runtimes, results_fs, runtime_fs, query_entities_fs):
                 for hit in hits:
                     results_f.write("{} 0 {} 0 {} {}\n".format(q_id, hit["author_id"], hit["score"], scoring_foo.func_name))
                 runtime_f.write("{} {}\n".format(q_id, runtime))
                 query_entities_f.write(u"{} {}\n".format(q_id, u"; ".join(query_entities)).encode("utf-8"))
-
-        evaluation = check_output(["trec_eval", "-c", "-q", "-M", "1000", "-m", "all_trec", args.qrels, results_filename])
+            logging.info("%d/%d topics done" % (done, len(queries)))
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+        return 1
+    finally:
+        for f in results_fs + runtime_fs + query_entities_fs:
+            f.close()
+    pool.close()
+    pool.join()
+
+    eval_pool = ThreadPool(len(scoring_foos))
+    evaluations = eval_pool.map(lambda base: trec_eval(args.qrels, base + ".results"), results_filename_bases)
+    eval_pool.close()
+    for results_filename_base, evaluation in zip(results_filename_bases, evaluations):
         print evaluation
         with open(results_filename_base + ".eval", "w") as eval_f:
             eval_f.write(evaluation)
@@ -0,0 +1,71 @@
+# encoding: utf-8
+
+'''
+Compares the time spent scoring the candidates of each topic by the per-author implementation of
+the scoring functions and by their batch implementation, and checks that their scores match.
+Relatedness is fetched before timing, so that both implementations read it from the cache.
+'''
+
+from argparse import ArgumentParser
+import logging
+import sys
+import tagme
+
+import expertfinding
+from expertfinding import ExpertFinding as EF
+from benchmark import SCORING_FUNCTIONS, topics_generator
+
+
+def time_scoring(exf, query, scoring_foo, batch, repetitions):
+    """
+    Returns the scores of the authors for the query and the best time spent scoring them.
+    """
+    best_time = None
+    for _ in range(repetitions):
+        (results,), timings, _ = exf.find_expert_multi(query, [scoring_foo], batch=batch)
+        scoring_time = timings[scoring_foo.func_name]
+        best_time = scoring_time if best_time is None else min(best_time, scoring_time)
+    return dict((hit["author_id"], hit["score"]) for hit in results), best_time
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
+    parser.add_argument("-r", "--relatedness_dict", required=True, action="store", help="Relatedness persistent dictionary file")
+    parser.add_argument("-g", "--gcube_token", required=True, action="store", help="Tagme authentication gcube token")
+    parser.add_argument("-t", "--topics", required=True, action="store", help="Topic id-description mapping file")
+    parser.add_argument("-f", "--scoring", action="store", nargs="+", default=["relatedness_geom"], help="Name of scoring functions to test", choices=SCORING_FUNCTIONS.keys())
+    parser.add_argument("-n", "--repetitions", action="store", type=int, default=3, help="Runs per topic and implementation (the best one is reported)")
+    parser.add_argument("-c", "--cache_dir", action="store", help="Annotation cache directory (shared with create_db.py)")
+    parser.add_argument("-m", "--in_memory_index", action="store_true", help="Answer queries with an in-memory index instead of the DB")
+    args = parser.parse_args()
+
+    tagme.GCUBE_TOKEN = args.gcube_token
+    if args.cache_dir:
+        expertfinding.set_cache(args.cache_dir)
+
+    exf = EF(args.storage_db, relatedness_dict_file=args.relatedness_dict, in_memory_index=args.in_memory_index)
+    topics = sorted(topics_generator(args.topics))
+
+    for scoring_foo in [SCORING_FUNCTIONS[scoring_f_name] for scoring_f_name in args.scoring]:
+        total_per_author, total_batch, max_error = 0.0, 0.0, 0.0
+        for topic_id, query in topics:
+            exf.find_expert_multi(query, [scoring_foo])
+            scores, per_author_time = time_scoring(exf, query, scoring_foo, False, args.repetitions)
+            batch_scores, batch_time = time_scoring(exf, query, scoring_foo, True, args.repetitions)
+            error = max([abs(scores[a] - batch_scores[a]) for a in scores] + [0.0])
+            if set(scores) != set(batch_scores):
+                error = float("inf")
+            print "{} {} authors={} per_author={:.4f}s batch={:.4f}s max_error={:.2e}".format(
+                scoring_foo.func_name, topic_id, len(scores), per_author_time, batch_time, error)
+            total_per_author += per_author_time
+            total_batch += batch_time
+            max_error = max(max_error, error)
+        print "{} total per_author={:.3f}s batch={:.3f}s speedup={:.1f}x max_error={:.2e}".format(
+            scoring_foo.func_name, total_per_author, total_batch, total_per_author / max(total_batch, 1e-9), max_error)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,38 +1,88 @@
 from astroid.__pkginfo__ import author
 import cgi
-from collections import Counter
+import hashlib
+from collections import Counter, deque
+from contextlib import contextmanager
+import heapq
 import logging
 from math import log, exp
 import math
+from multiprocessing.pool import ThreadPool
+import numpy
 from numpy import clip, mean
 import os
 import pyfscache
 import re
 from scipy import stats
 import sqlite3
-from sqlitedict import SqliteDict
 import string
 import tagme
+import threading
 import time
 
 import expertfinding
+from expertfinding import scoring as batch_scoring
+from expertfinding.annotation_cache import DEFAULT_MAX_ENTRIES, SqliteAnnotationCache
+from expertfinding.annotators import annotate_with_retry
+from expertfinding.completion import AuthorCompletionIndex
+from expertfinding import profiles
+from expertfinding import relatedness
+from expertfinding import schema
+from expertfinding import sharding
+from expertfinding import snapshot
+from expertfinding import statistics
+from expertfinding.index import InvertedIndex
+from expertfinding import metrics
+from expertfinding.relatedness import RelatednessStore
+from expertfinding.statistics import CorpusStatistics
 
 
 __all__ = []
 
 DEFAULT_MIN_SCORE = 0.20
 
+TAG_API = tagme.DEFAULT_TAG_API
+
 def legit_document(doc_body):
     return doc_body is not None and len(doc_body) > 10
 
 
 def entities(text):
-    return tagme.annotate(text).annotations if text else []
+    if not text:
+        return []
+    start_time = time.time()
+    response = tagme.annotate(text, api=TAG_API)
+    metrics.TAGME_SECONDS.observe(time.time() - start_time, ("tag",))
+    if response is None:
+        metrics.TAGME_ERRORS.inc(labels=("tag",))
+        raise IOError("TagMe could not annotate the text")
+    return response.annotations
+
+
+def set_tagme_api(base_url):
+    """
+    Sends the annotation and relatedness requests to the TagMe instance at base_url (e.g. the one
+    started by fake_tagme.py) instead of the public one.
+    """
+    global TAG_API
+    TAG_API = base_url.rstrip("/") + "/tag"
+    relatedness.REL_API = base_url.rstrip("/") + "/rel"
 
 
-def set_cache(cache_dir):
-    cache = pyfscache.FSCache(cache_dir)
+def set_cache(cache_dir, max_entries=DEFAULT_MAX_ENTRIES, backend="sqlite"):
+    """
+    Caches the annotations returned by entities in cache_dir. The sqlite backend keeps them in a
+    single file holding at most max_entries texts, the fs backend (pyfscache) in a file per text.
+    Returns the cache.
+    """
+    if backend == "fs":
+        cache = pyfscache.FSCache(cache_dir)
+    else:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        cache = SqliteAnnotationCache(os.path.join(cache_dir, "annotations.db"), max_entries)
     expertfinding.entities = cache(expertfinding.entities)
+    return cache
 
 
 def _annotated_text_generator(text, annotations):
@@ -44,6 +94,13 @@ def _annotated_text_generator(text, annotations):
     yield text[prev:]
 
 
+def paper_key(paper):
+    """
+    Returns a key identifying a paper by its author, year and abstract.
+    """
+    return hashlib.sha1(u"{}\x00{}\x00{}".format(paper.author_id, paper.year, paper.abstract).encode("utf-8")).hexdigest()
+
+
 def annotated_text(text, annotations):
     return "".join(_annotated_text_generator(text, annotations))
 
@@ -51,22 +108,49 @@ def annotated_text(text, annotations):
 def join_entities_sql(entities):
     return u", ".join(u"'{}'".format(t.replace("'", "''")) for t in entities)
 
+
+def entity_ids_sql(entities):
+    """
+    Returns the SQL subquery selecting the ids of entities in the entity dictionary.
+    """
+    return u"SELECT entity_id FROM entity_dictionary WHERE entity IN ({})".format(join_entities_sql(entities))
+
 def weighted_geom_mean(vals_weights):
     return exp(sum(w * log(v) for v, w in vals_weights) / sum(w for _, w in vals_weights))
 
-def _str_titles(t1, t2):
-    return unicode(sorted([t1, t2])).encode("utf-8")
-
 class ExpertFindingBuilder(object):
 
-    def __init__(self, ef):
+    def __init__(self, ef, annotator=None, annotation_workers=1, annotation_retries=3, annotation_backoff=1.0, bulk=False,
+                 incremental=False, shard=None):
+        """
+        Documents are annotated with annotator (expertfinding.entities if None), up to
+        annotation_workers at a time while the previous ones are written to the database.
+        Failed annotations are retried annotation_retries times with exponential backoff.
+        In bulk mode, entity and institution counters are accumulated in memory and written once
+        per batch, indexes are built after the documents are added, and the database is not synced
+        to disk while adding them (a crash may corrupt it).
+        In incremental mode, papers already in the database (see paper_key) are skipped, so that
+        new papers can be appended to an existing database and an interrupted build can be resumed
+        from the last committed batch.
+        With shard = (i, n), only the papers of the authors of the i-th of n shards are added, and
+        documents are numbered i, i + n, i + 2n, ... (see expertfinding.sharding).
+        """
         self.ef = ef
+        self.annotator = annotator
+        self.annotation_workers = annotation_workers
+        self.annotation_retries = annotation_retries
+        self.annotation_backoff = annotation_backoff
+        self.bulk = bulk
+        self.incremental = incremental
+        self.shard = shard
+        self._entity_frequency = Counter()
+        self._institution_documents = Counter()
+        self._entity_ids = None
+        self._started = False
         self.ef.db.execute('''CREATE TABLE IF NOT EXISTS authors
              (author_id PRIMARY KEY, name, institution)
              ''')
-        self.ef.db.execute('''CREATE TABLE IF NOT EXISTS entity_occurrences
-             (entity, author_id, document_id, year, rho,
-             FOREIGN KEY(author_id) REFERENCES authors(author_id))''')
+        schema.create_tables(self.ef.db)
         self.ef.db.execute('''CREATE TABLE IF NOT EXISTS documents
              (author_id, document_id, year, body,
              FOREIGN KEY(author_id) REFERENCES authors(author_id))''')
@@ -74,38 +158,183 @@ class ExpertFindingBuilder(object):
              (institution PRIMARY KEY, document_count)''')
         self.ef.db.execute('''CREATE TABLE IF NOT EXISTS entities
              (entity, institution, frequency, PRIMARY KEY (entity, institution))''')
-        self.ef.db.execute('''CREATE INDEX IF NOT EXISTS entities_author_id_index ON entity_occurrences (author_id)''')
+        self.ef.db.execute('''CREATE TABLE IF NOT EXISTS ingested_papers
+             (paper_key PRIMARY KEY, document_id)''')
+        statistics.create_tables(self.ef.db)
+        profiles.create_tables(self.ef.db)
+        if incremental and self.ef.db.execute('''SELECT COUNT(*) FROM ingested_papers''').fetchone()[0] == 0 \
+                and self.ef.db.execute('''SELECT COUNT(*) FROM documents''').fetchone()[0] > 0:
+            logging.warning("This database does not record which papers it contains, they will be added again.")
+        if not bulk:
+            self._create_indexes()
+
+    def _create_indexes(self):
         self.ef.db.execute('''CREATE INDEX IF NOT EXISTS entities_entity_index ON entities (entity)''')
-        self.ef.db.execute('''CREATE INDEX IF NOT EXISTS entity_occurrences_entity_index ON entity_occurrences (entity)''')
+        schema.create_indexes(self.ef.db)
+        self.ef.db.execute('''CREATE INDEX IF NOT EXISTS documents_document_id_index ON documents (document_id)''')
 
-    def add_documents(self, input_f, papers_generator, min_year=None, max_year=None):
-        papers = list(papers_generator)
-        logging.info("%s: Number of papers (total): %d" % (os.path.basename(input_f), len(papers)))
+    def _drop_indexes(self):
+        self.ef.db.execute('''DROP INDEX IF EXISTS entities_entity_index''')
+        self.ef.db.execute('''DROP INDEX IF EXISTS entity_occurrences_entity_index''')
+        self.ef.db.execute('''DROP INDEX IF EXISTS documents_document_id_index''')
 
-        papers = [p for p in papers if
-                  (min_year is None or p.year >= min_year) and (max_year is None or p.year <= max_year)]
+    def add_documents(self, input_f, papers_generator, min_year=None, max_year=None, batch_size=1000):
+        """
+        Adds the papers published between min_year and max_year. Papers are read from
+        papers_generator as they are needed and committed every batch_size documents, so memory
+        does not grow with the size of the input. The corpus statistics and the author profiles
+        are computed by finish, once all documents are added.
+        """
+        counts = Counter()
 
-        logging.info("%s: Number of papers (filtered) %d" % (os.path.basename(input_f), len(papers)))
-        if papers:
-            logging.info("%s: Number of papers (filtered) with abstract: %d" % (os.path.basename(input_f), sum(1 for p in papers if legit_document(p.abstract))))
-            logging.info("%s: Number of papers (filtered) with DOI but no abstract %d" % (os.path.basename(input_f), sum(1 for p in papers if not legit_document(p.abstract) and p.doi)))
+        def filtered_papers():
+            for p in papers_generator:
+                counts["total"] += 1
+                if self.shard is not None and sharding.shard_of(p.author_id, self.shard[1]) != self.shard[0]:
+                    counts["other_shards"] += 1
+                    continue
+                if (min_year is None or p.year >= min_year) and (max_year is None or p.year <= max_year):
+                    counts["filtered"] += 1
+                    if legit_document(p.abstract):
+                        counts["abstract"] += 1
+                        if self.incremental and self._ingested(paper_key(p)):
+                            counts["ingested"] += 1
+                            continue
+                    elif p.doi:
+                        counts["doi"] += 1
+                    yield p
 
+        self._start()
         document_id = self._next_paper_id()
-        for p in papers:
-            self._add_author(p.author_id, p.name, p.institution)
-            if (legit_document(p.abstract)):
-                ent = entities(p.abstract)
-                self._add_entities(p.author_id, document_id, p.year, p.institution, ent)
-                self._add_document_body(p.author_id, document_id, p.year, p.abstract, ent)
-                document_id += 1
+        document_id_step = self.shard[1] if self.shard is not None else 1
+        added = 0
+        if self.bulk:
+            self._drop_indexes()
+            self.ef.db.execute('''PRAGMA journal_mode=MEMORY''')
+            self.ef.db.execute('''PRAGMA synchronous=OFF''')
+        try:
+            for p, ent in self._annotated_papers(filtered_papers()):
+                self._add_author(p.author_id, p.name, p.institution)
+                if (legit_document(p.abstract)):
+                    if not self._add_paper_key(paper_key(p), document_id):
+                        continue
+                    self._add_entities(p.author_id, document_id, p.year, p.institution, ent)
+                    self._add_document_body(p.author_id, document_id, p.year, p.abstract, ent)
+                    document_id += document_id_step
+                    added += 1
+                    if added % batch_size == 0:
+                        self._flush_counters()
+                        self.ef.db_connection.commit()
+                        logging.debug("%s: %d documents added" % (os.path.basename(input_f), added))
+            self._flush_counters()
+            self.ef.db_connection.commit()
+        except BaseException:
+            # Leave the database as of the last committed batch, so that the build can be resumed.
+            self.ef.db_connection.rollback()
+            self._entity_ids = None
+            self._entity_frequency.clear()
+            self._institution_documents.clear()
+            raise
+        finally:
+            if self.bulk:
+                # Dropping the indexes was committed, so they are built again even if adding failed.
+                self._create_indexes()
+                self.ef.db.execute('''PRAGMA synchronous=FULL''')
+                self.ef.db.execute('''PRAGMA journal_mode=DELETE''')
+
+        logging.info("%s: Number of papers (total): %d" % (os.path.basename(input_f), counts["total"]))
+        if self.shard is not None:
+            logging.info("%s: Number of papers of other shards: %d" % (os.path.basename(input_f), counts["other_shards"]))
+        logging.info("%s: Number of papers (filtered) %d" % (os.path.basename(input_f), counts["filtered"]))
+        if counts["filtered"]:
+            logging.info("%s: Number of papers (filtered) with abstract: %d" % (os.path.basename(input_f), counts["abstract"]))
+            logging.info("%s: Number of papers (filtered) with DOI but no abstract %d" % (os.path.basename(input_f), counts["doi"]))
+        if self.incremental:
+            logging.info("%s: Number of papers (filtered) with abstract already in the database: %d" % (os.path.basename(input_f), counts["ingested"]))
+
+    def _start(self):
+        """
+        Marks the statistics and the profiles as stale and changes the version of the database, once
+        per build, before the first documents are added.
+        """
+        if self._started:
+            return
+        statistics.invalidate(self.ef.db)
+        statistics.bump_version(self.ef.db)
+        profiles.invalidate(self.ef.db)
         self.ef.db_connection.commit()
+        self.ef.invalidate_statistics()
+        self._started = True
+
+    def finish(self):
+        """
+        Computes the corpus statistics and the author profiles of the documents added, once for
+        all calls to add_documents, and changes the version of the database so that readers load
+        them. Nothing is done if add_documents was not called since the last call.
+        """
+        if not self._started:
+            return
+        start_time = time.time()
+        statistics.update(self.ef.db)
+        statistics.bump_version(self.ef.db)
+        self.ef.invalidate_statistics()
+        profiles.update(self.ef.db, self.ef.statistics, DEFAULT_MIN_SCORE)
+        self.ef.invalidate_statistics()
+        self.ef.db_connection.commit()
+        self._started = False
+        logging.info("Statistics and profiles computed in %.1f sec" % (time.time() - start_time))
+
+    def _annotate(self, text):
+        return annotate_with_retry(self.annotator or entities, text, self.annotation_retries, self.annotation_backoff)
+
+    def _annotated_papers(self, papers):
+        """
+        Yields each paper with the annotations of its abstract (None if it has no legit abstract),
+        in the same order as papers, annotating up to annotation_workers abstracts concurrently.
+        """
+        if self.annotation_workers <= 1:
+            for p in papers:
+                yield p, self._annotate(p.abstract) if legit_document(p.abstract) else None
+            return
+        pool = ThreadPool(self.annotation_workers)
+        pending = deque()
+        try:
+            for p in papers:
+                pending.append((p, pool.apply_async(self._annotate, (p.abstract,)) if legit_document(p.abstract) else None))
+                if len(pending) >= 2 * self.annotation_workers:
+                    p, annotations = pending.popleft()
+                    yield p, annotations.get() if annotations else None
+            while pending:
+                p, annotations = pending.popleft()
+                yield p, annotations.get() if annotations else None
+        finally:
+            pool.terminate()
+            pool.join()
 
     def entities(self, author_id):
-        return self.ef.db.execute('''SELECT year, entity, rho FROM entity_occurrences WHERE author_id=?''', (author_id,)).fetchall()
+        return self.ef.db.execute('''SELECT o.year, d.entity, o.rho
+            FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+            WHERE o.author_id=?''', (author_id,)).fetchall()
+
+    def _entity_id(self, entity):
+        """
+        Returns the id of an entity in the entity dictionary, adding it if needed.
+        """
+        if self._entity_ids is None:
+            self._entity_ids = dict(self.ef.db.execute('''SELECT entity, entity_id FROM entity_dictionary''').fetchall())
+        entity_id = self._entity_ids.get(entity)
+        if entity_id is None:
+            entity_id = self._entity_ids[entity] = self.ef.db.execute('''INSERT INTO entity_dictionary (entity) VALUES (?)''', (entity,)).lastrowid
+        return entity_id
 
     def _add_entities(self, author_id, document_id, year, institution, annotations):
-        self.ef.db.executemany('INSERT INTO entity_occurrences VALUES (?,?,?,?,?)', ((a.entity_title, author_id, document_id, year, a.score) for a in annotations))
+        rows = [(author_id, self._entity_id(a.entity_title), document_id, mention, year, a.score) for mention, a in enumerate(annotations)]
+        self.ef.db.executemany('INSERT INTO entity_occurrences VALUES (?,?,?,?,?,?)', rows)
         unique_entities = set(a.entity_title for a in annotations)
+        if self.bulk:
+            self._entity_frequency.update((e, institution) for e in unique_entities)
+            self._institution_documents[institution] += 1
+            return
         self.ef.db.executemany('''INSERT OR IGNORE INTO entities VALUES (?,?,0)''', ((e, institution) for e in unique_entities))
         self.ef.db.executemany('''UPDATE entities
                                   SET frequency = frequency + 1
@@ -115,65 +344,361 @@ class ExpertFindingBuilder(object):
                               SET document_count = document_count + 1
                               WHERE institution=?''', (institution,))
 
+    def _flush_counters(self):
+        """
+        Writes the entity and institution counters accumulated in bulk mode.
+        """
+        if sqlite3.sqlite_version_info >= (3, 24, 0):
+            self.ef.db.executemany('''INSERT INTO entities VALUES (?,?,?)
+                                      ON CONFLICT(entity, institution) DO UPDATE SET frequency = frequency + excluded.frequency''',
+                                   ((e, i, f) for (e, i), f in self._entity_frequency.iteritems()))
+            self.ef.db.executemany('''INSERT INTO institutions VALUES (?,?)
+                                      ON CONFLICT(institution) DO UPDATE SET document_count = document_count + excluded.document_count''',
+                                   self._institution_documents.iteritems())
+        else:
+            self.ef.db.executemany('''INSERT OR IGNORE INTO entities VALUES (?,?,0)''', self._entity_frequency.iterkeys())
+            self.ef.db.executemany('''UPDATE entities
+                                      SET frequency = frequency + ?
+                                      WHERE entity=? AND institution=?''', ((f, e, i) for (e, i), f in self._entity_frequency.iteritems()))
+            self.ef.db.executemany('''INSERT OR IGNORE INTO institutions VALUES (?,0)''', ((i,) for i in self._institution_documents))
+            self.ef.db.executemany('''UPDATE institutions
+                                      SET document_count = document_count + ?
+                                      WHERE institution=?''', ((c, i) for i, c in self._institution_documents.iteritems()))
+        self._entity_frequency.clear()
+        self._institution_documents.clear()
+
     def _add_document_body(self, author_id, document_id, year, body, annotations):
         annotated_t = annotated_text(body, annotations)
         self.ef.db.execute('INSERT INTO documents VALUES (?,?,?,?)', (author_id, document_id, year, annotated_t))
 
+    def _ingested(self, key):
+        return self.ef.db.execute('''SELECT 1 FROM ingested_papers WHERE paper_key=?''', (key,)).fetchone() is not None
+
+    def _add_paper_key(self, key, document_id):
+        """
+        Records that a paper has been added as document_id. In incremental mode, returns False if
+        the paper was already added (e.g. when it appears twice in the input).
+        """
+        if self.incremental:
+            return self.ef.db.execute('''INSERT OR IGNORE INTO ingested_papers VALUES (?,?)''', (key, document_id)).rowcount > 0
+        self.ef.db.execute('''INSERT OR IGNORE INTO ingested_papers VALUES (?,?)''', (key, document_id))
+        return True
+
     def _next_paper_id(self):
-        return self.ef.db.execute('SELECT IFNULL(MAX(document_id), -1) FROM entity_occurrences').fetchall()[0][0] + 1
+        # Documents with no entities have no occurrences, so look at the documents table.
+        last = self.ef.db.execute('SELECT MAX(document_id) FROM documents').fetchall()[0][0]
+        if self.shard is not None:
+            return self.shard[0] if last is None else last + self.shard[1]
+        return 0 if last is None else last + 1
 
     def _add_author(self, author_id, name, institution):
         self.ef.db.execute('INSERT OR IGNORE INTO authors VALUES (?,?,?)', (author_id, name, institution))
 
 
+class QueryCandidates(object):
+    """
+    The candidate authors of a query, retrieved once by ExpertFinding.find_candidates and ranked
+    with each scoring function by ExpertFinding.score_candidates, possibly from several threads.
+    The entity profiles fetched while scoring are shared by all scoring functions. The candidates are
+    None if all scoring functions rank the authors from the in-memory index alone (see find_expert).
+    """
+
+    def __init__(self, query_entities, candidates, elapsed):
+        self.query_entities = query_entities
+        self.authors, self.names, self.entities, self.ec, self.papers, self.iaf = candidates if candidates is not None else (None,) * 6
+        self.elapsed = elapsed
+        self.profiles = {}
+        self.sql_statements = 0
+        self.sql_rows = 0
+        self._lock = threading.Lock()
+
+    def add_sql(self, statements, rows):
+        with self._lock:
+            self.sql_statements += statements
+            self.sql_rows += rows
+        metrics.SQL_STATEMENTS.inc(statements)
+        metrics.SQL_ROWS.inc(rows)
+
+    def observe_sql(self):
+        """
+        Records the SQL statements executed and the rows fetched for the query so far.
+        """
+        with self._lock:
+            metrics.QUERY_SQL_STATEMENTS.observe(self.sql_statements)
+            metrics.QUERY_SQL_ROWS.observe(self.sql_rows)
+
+
 class ExpertFinding(object):
 
-    def __init__(self, storage_db, erase=False, relatedness_dict_file=None):
+    def __init__(self, storage_db, erase=False, relatedness_dict_file=None, in_memory_index=False, read_only=False, snapshot_path=None):
+        """
+        Each thread (and each process, after a fork) uses its own connection to storage_db. In
+        read_only mode, the connections refuse to change the database, which must already exist.
+        The in-memory index is loaded from snapshot_path if it holds a snapshot of the current version
+        of the database (see expertfinding.snapshot), and built otherwise.
+        The corpus statistics, the in-memory index and the completion index are loaded again whenever
+        the version of the database changes (see refresh), also when another process adds documents.
+        """
         if erase and os.path.isfile(storage_db):
             os.remove(storage_db)
-        self.db_connection = sqlite3.connect(storage_db)
-        self.db = self.db_connection.cursor()
-        self.rel_dict = SqliteDict(relatedness_dict_file) if relatedness_dict_file else dict()
+        if read_only and not os.path.isfile(storage_db):
+            raise IOError("Database {} not found".format(storage_db))
+        if os.path.isfile(storage_db):
+            connection = sqlite3.connect(storage_db)
+            legacy = schema.is_legacy(connection)
+            connection.close()
+            if legacy:
+                raise IOError("Database {} has an old schema, convert it with expertfinding/preprocessing/migrate_db.py".format(storage_db))
+        self.storage_db = storage_db
+        self.read_only = read_only
+        self._local = threading.local()
+        self.relatedness_store = RelatednessStore(relatedness_dict_file)
+        self.snapshot_path = snapshot_path
+        self._statistics = None
+        self._has_profiles = None
+        self._completion_index = None
+        self._version = None
+        self._refresh_lock = threading.RLock()
+        self.index = None
+        if snapshot_path is not None:
+            self.load_snapshot(snapshot_path)
+        if (in_memory_index or snapshot_path is not None) and self.index is None:
+            self.load_index()
+
+    def _connection(self):
+        """
+        Returns the connection and cursor of the current thread, opening them if needed (also after
+        a fork).
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.storage_db, timeout=60)
+            if self.read_only:
+                connection.execute('''PRAGMA query_only=ON''')
+            self._local.connection = connection
+            self._local.cursor = connection.cursor(metrics.CountingCursor)
+            self._local.author_profiles = None
+            self._local.pid = os.getpid()
+        return self._local.connection, self._local.cursor
+
+    @property
+    def db_connection(self):
+        return self._connection()[0]
+
+    @property
+    def db(self):
+        return self._connection()[1]
+
+    @property
+    def _author_profiles(self):
+        self._connection()
+        return self._local.author_profiles
+
+    @_author_profiles.setter
+    def _author_profiles(self, author_profiles):
+        self._connection()
+        self._local.author_profiles = author_profiles
+
+    def builder(self, **kwargs):
+        return ExpertFindingBuilder(self, **kwargs)
+
+    @property
+    def statistics(self):
+        """
+        Corpus statistics, loaded from the database on first access and again once its version
+        changes.
+        """
+        self.refresh()
+        return self._statistics
+
+    def invalidate_statistics(self):
+        """
+        Makes the next access to the corpus statistics load them again, with the in-memory index and
+        the completion index, even if the version of the database did not change.
+        """
+        self._version = None
+
+    def refresh(self):
+        """
+        Loads again the corpus statistics if the version of the database changed since they were
+        loaded, rebuilding the in-memory index (or loading it again from the snapshot, if it has been
+        exported again) and dropping the completion index and whether there are profiles, which are
+        computed again on next access. Returns whether they were loaded again.
+        """
+        if getattr(self._local, "fixed_version", False):
+            return False
+        version = self.version()
+        if version == self._version:
+            return False
+        with self._refresh_lock:
+            if version == self._version:
+                return False
+            if self._version is not None:
+                logging.info("Database version changed from %s to %s, loading the corpus statistics again" % (self._version, version))
+            self._statistics = CorpusStatistics.load(self.db)
+            self._has_profiles = None
+            self._completion_index = None
+            if self.index is not None and not (self.snapshot_path is not None and self.load_snapshot(self.snapshot_path)):
+                self._build_index()
+            self._version = version
+        return True
+
+    @property
+    def completion_index(self):
+        """
+        Index of the author names for autocompletion, built on first access and again once the
+        version of the database changes.
+        """
+        self.refresh()
+        completion_index = self._completion_index
+        if completion_index is None:
+            # Built by one thread at a time, and returned even if a refresh drops it meanwhile.
+            with self._refresh_lock:
+                completion_index = self._completion_index
+                if completion_index is None:
+                    start_time = time.time()
+                    completion_index = self._completion_index = AuthorCompletionIndex.build(self.db, self.statistics)
+                    logging.info("Author completion index built in %.3f sec" % (time.time() - start_time))
+        return completion_index
+
+    def version(self):
+        """
+        The version of the database, changed by ExpertFindingBuilder whenever it adds documents.
+        """
+        return statistics.version(self.db)
+
+    def has_profiles(self):
+        """
+        Whether the author profiles have been materialized by the builder (see expertfinding.profiles).
+        """
+        self.refresh()
+        if self._has_profiles is None:
+            self._has_profiles = profiles.has_profiles(self.db)
+        return self._has_profiles
+
+    def load_index(self):
+        """
+        Builds the in-memory inverted index, used from now on for candidate generation and batch
+        scoring instead of the database.
+        """
+        self.refresh()
+        self._build_index()
+
+    def _build_index(self):
+        start_time = time.time()
+        self.index = InvertedIndex.build(self.db, self._statistics, DEFAULT_MIN_SCORE)
+        logging.info("In-memory index built in %.3f sec, using %.1f MB" % (time.time() - start_time, self.index.memory_footprint() / 2.0**20))
+
+    def save_snapshot(self, path):
+        """
+        Exports the in-memory index, the corpus statistics and the completion index to a snapshot in
+        path (see expertfinding.snapshot).
+        """
+        if self.index is None:
+            self.load_index()
+        start_time = time.time()
+        snapshot.save(path, self.index, self.completion_index, self.version(), DEFAULT_MIN_SCORE)
+        logging.info("Snapshot written to %s in %.3f sec" % (path, time.time() - start_time))
 
-    def builder(self):
-        return ExpertFindingBuilder(self)
+    def load_snapshot(self, path):
+        """
+        Memory-maps the snapshot in path, using it from now on as in-memory index, corpus statistics
+        and completion index. Returns False, leaving them as they are, if path holds no snapshot of
+        the current version of the database.
+        """
+        manifest = snapshot.manifest(path)
+        if manifest is None or manifest["version"] != self.version() or manifest["min_score"] != DEFAULT_MIN_SCORE:
+            logging.warning("No up-to-date snapshot found in %s" % path)
+            return False
+        start_time = time.time()
+        self.index, self._statistics, self._completion_index = snapshot.load(path)
+        self._has_profiles = None
+        self._version = manifest["version"]
+        logging.info("Snapshot %s loaded in %.3f sec" % (path, time.time() - start_time))
+        return True
 
     def author_entity_frequency(self, author_id):
         """
-        Returns how many authors's papers have cited the entities cited by a specific author.
+        Returns how many authors's papers have cited the entities cited by a specific author, the
+        histogram of the years they were cited in (as a list of (year, count) pairs) and their
+        maximum rho.
         """
-        return self.db.execute(u'''
-            SELECT entity, COUNT(DISTINCT(document_id)) as author_freq, GROUP_CONCAT(year) as years, MAX(rho) AS max_rho
-            FROM entity_occurrences
-            WHERE author_id == ? AND rho > ?
-            GROUP BY entity
-            ''', (author_id, DEFAULT_MIN_SCORE)).fetchall()
+        if self._author_profiles is not None and author_id in self._author_profiles:
+            return self._author_profiles[author_id]
+        start_time = time.time()
+        if self.has_profiles():
+            result = [(entity, author_freq, profiles.decode_years(years), max_rho) for entity, author_freq, years, max_rho in self.db.execute(u'''
+                SELECT entity, author_freq, years, max_rho
+                FROM author_profiles
+                WHERE author_id == ?
+                ORDER BY entity
+                ''', (author_id,)).fetchall()]
+        else:
+            result = [(entity, author_freq, sorted(Counter(int(y) for y in years.split(",")).items()), max_rho) for entity, author_freq, years, max_rho in self.db.execute(u'''
+                SELECT d.entity, COUNT(DISTINCT(o.document_id)) as author_freq, GROUP_CONCAT(o.year) as years, MAX(o.rho) AS max_rho
+                FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+                WHERE o.author_id == ? AND o.rho > ?
+                GROUP BY o.entity_id
+                ORDER BY d.entity
+                ''', (author_id, DEFAULT_MIN_SCORE)).fetchall()]
+        if self._author_profiles is not None:
+            self._author_profiles[author_id] = result
+            self._local.profiles_time += time.time() - start_time
+        return result
 
-    def author_entity_frequency_and_popularity(self, author_id):
+    def author_entity_frequency_page(self, author_id, limit=None, after=None):
         """
-        Returns how many authors's papers have cited the entities cited by a specific author.
+        Same as author_entity_frequency, but sorted in the database by decreasing number of papers
+        (then by entity), and returning at most limit entities: those following after, the (number
+        of papers, entity) of the last entity of the previous page. Year histograms are taken from
+        the profiles, or computed in the database for the entities of the page only.
         """
-        return self.db.execute(u'''
-            SELECT e.entity, author_freq, SUM(e.frequency) AS entity_popularity,  years, max_rho
-            FROM entities AS e,
-            (
-                SELECT entity, COUNT(DISTINCT(document_id)) as author_freq, GROUP_CONCAT(year) as years, MAX(rho) AS max_rho
+        keyset = u"author_freq < ? OR (author_freq == ? AND {} > ?)"
+        keyset_parameters = [after[0], after[0], after[1]] if after is not None else []
+        limit = -1 if limit is None else limit
+        if self.has_profiles():
+            return [(entity, author_freq, profiles.decode_years(years), max_rho) for entity, author_freq, years, max_rho in self.db.execute(u'''
+                SELECT entity, author_freq, years, max_rho
+                FROM author_profiles
+                WHERE author_id == ? {}
+                ORDER BY author_freq DESC, entity
+                LIMIT ?
+                '''.format(u"AND (" + keyset.format("entity") + u")" if after is not None else u""), [author_id] + keyset_parameters + [limit]).fetchall()]
+        page = self.db.execute(u'''
+            SELECT o.entity_id, d.entity, COUNT(DISTINCT(o.document_id)) AS author_freq, MAX(o.rho)
+            FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+            WHERE o.author_id == ? AND o.rho > ?
+            GROUP BY o.entity_id
+            {}
+            ORDER BY author_freq DESC, d.entity
+            LIMIT ?
+            '''.format(u"HAVING " + keyset.format("d.entity") if after is not None else u""), [author_id, DEFAULT_MIN_SCORE] + keyset_parameters + [limit]).fetchall()
+        if not page:
+            return []
+        years = dict((entity_id, []) for entity_id, _, _, _ in page)
+        for entity_id, year, count in self.db.execute(u'''
+                SELECT entity_id, year, COUNT(*)
                 FROM entity_occurrences
-                WHERE author_id == ? AND rho > ?
-                GROUP BY entity
-            ) as d_e
-            WHERE d_e.entity == e.entity GROUP BY e.entity
-            ''', (author_id, DEFAULT_MIN_SCORE)).fetchall()
+                WHERE author_id == ? AND rho > ? AND entity_id IN ({})
+                GROUP BY entity_id, year
+                ORDER BY entity_id, year'''.format(u", ".join(str(p[0]) for p in page)), (author_id, DEFAULT_MIN_SCORE)):
+            years[entity_id].append((year, count))
+        return [(entity, author_freq, years[entity_id], max_rho) for entity_id, entity, author_freq, max_rho in page]
+
+    def author_entity_frequency_and_popularity(self, author_id):
+        """
+        Returns how many authors's papers have cited the entities cited by a specific author, and
+        how many papers cite each of those entities.
+        """
+        entity_popularity = self.statistics.entity_popularity
+        return [(entity, author_freq, entity_popularity[entity], years, max_rho)
+                for entity, author_freq, years, max_rho in self.author_entity_frequency(author_id)]
 
     def entity_popularity(self, entities):
         """
+        Returns how many papers cite each of the entities (entities never cited are left out).
         """
-        return self.db.execute(u'''
-            SELECT entity, SUM(frequency) AS entity_popularity
-            FROM entities
-            WHERE entity IN ({})
-            GROUP BY entity
-            '''.format(join_entities_sql(entities))).fetchall()
+        entity_popularity = self.statistics.entity_popularity
+        return [(e, entity_popularity[e]) for e in entities if e in entity_popularity]
 
     def get_authors_count(self, institution):
         """
@@ -182,11 +707,12 @@ class ExpertFinding(object):
         return self.db.execute(u'''SELECT COUNT(*) FROM authors WHERE institution==?''', (institution,)).fetchall()[0][0]
 
     def total_papers(self):
-        return self.db.execute(u'''SELECT COUNT(*) FROM documents''').fetchall()[0][0]
+        return self.statistics.total_papers
             
     def ef_iaf_author(self, author_id):
         """
-        Given an author, retrieve the entities cited by him, their EF and IAF.
+        Given an author, retrieve the entities cited by him, their EF and IAF, their EF-IAF, max rho
+        and the histogram of the years they were cited in.
         """
         total_papers = self.total_papers()
         author_entity_frequency = self.author_entity_frequency_and_popularity(author_id)
@@ -197,9 +723,24 @@ class ExpertFinding(object):
                  log(total_papers/float(entity_popularity)),
                  entity_author_freq / float(author_papers) * log(total_papers/float(entity_popularity)),
                  max_rho,
-                 [int(y) for y in years.split(",")],
+                 years,
                 ) for entity, entity_author_freq, entity_popularity,  years, max_rho in author_entity_frequency), key=lambda t: t[3], reverse=True)
 
+    def author_efiaf(self, author_id, entities):
+        """
+        Returns the EF-IAF of the entities cited by an author among the given ones, and the norm of
+        the author's EF-IAF vector as used by cossim_efiaf_score.
+        """
+        if self.has_profiles():
+            author_entity_to_efiaf = dict(self.db.execute(u'''
+                SELECT entity, efiaf
+                FROM author_profiles
+                WHERE author_id == ? AND entity IN ({})'''.format(join_entities_sql(entities)), (author_id,)).fetchall())
+            norm = self.db.execute(u'''SELECT efiaf_norm FROM author_norms WHERE author_id == ?''', (author_id,)).fetchone()[0]
+            return author_entity_to_efiaf, norm
+        author_entity_to_efiaf = dict((e[0], e[3]) for e in self.ef_iaf_author(author_id))
+        return dict((e, author_entity_to_efiaf[e]) for e in entities if e in author_entity_to_efiaf), math.sqrt(sum(author_entity_to_efiaf.values()))
+
     def ef_iaf_entities(self, entities):
         total_papers = self.total_papers()
         query_entity_popularity = dict(self.entity_popularity(entities))
@@ -207,7 +748,7 @@ class ExpertFinding(object):
 
 
     def author_papers_count(self, author_id):
-        return self.db.execute(u'''SELECT COUNT(DISTINCT(document_id)) FROM entity_occurrences WHERE author_id=?''', (author_id,)).fetchall()[0][0]
+        return self.statistics.author_papers.get(author_id, 0)
 
     def institution_papers_count(self, institution):
         return self.db.execute(u'''
@@ -221,12 +762,29 @@ class ExpertFinding(object):
     def document(self, doc_id):
         return self.db.execute(u'''SELECT author_id, document_id, year, body FROM documents WHERE document_id=?''', (doc_id,)).fetchone()
 
-    def documents(self, author_id, entities):
+    def documents(self, author_id, entities, limit=None, after=None):
+        """
+        Returns the (document_id, year, entity, occurrences) of the entities cited in the documents
+        of an author, sorted by document and entity. If limit is set, only the entities of the first
+        limit documents with id greater than after are returned.
+        """
+        entity_ids = entity_ids_sql(entities)
+        page = u""
+        parameters = [author_id]
+        if limit is not None or after is not None:
+            page = u'''AND o.document_id IN (
+                SELECT DISTINCT(document_id)
+                FROM entity_occurrences
+                WHERE author_id=? AND entity_id IN ({}) AND document_id > ?
+                ORDER BY document_id
+                LIMIT ?)'''.format(entity_ids)
+            parameters += [author_id, after if after is not None else -1, limit if limit is not None else -1]
         return self.db.execute(u'''
-            SELECT document_id, year, entity, COUNT(*)
-            FROM entity_occurrences
-            WHERE author_id=? AND entity IN ({})
-            GROUP BY document_id, entity'''.format(join_entities_sql(entities)), (author_id,)).fetchall()
+            SELECT o.document_id, o.year, d.entity, COUNT(*)
+            FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+            WHERE o.author_id=? AND o.entity_id IN ({}) {}
+            GROUP BY o.document_id, o.entity_id
+            ORDER BY o.document_id, d.entity'''.format(entity_ids, page), parameters).fetchall()
 
     def institution(self, author_id):
         return self.db.execute(u'''SELECT institution FROM authors WHERE author_id=?''', (author_id,)).fetchall()[0][0]
@@ -241,10 +799,10 @@ class ExpertFinding(object):
         if min_freq is not None:
             contraints.append('COUNT(*)>=%d' % min_freq)
         having = "HAVING {}".format(" AND ".join(contraints)) if contraints else ""
-        return self.db.execute(u'''SELECT entity, year, AVG(rho), MIN(rho), MAX(rho), GROUP_CONCAT(rho), COUNT(*)
-           FROM entity_occurrences
-           WHERE author_id=?
-           GROUP BY entity, year
+        return self.db.execute(u'''SELECT d.entity, o.year, AVG(o.rho), MIN(o.rho), MAX(o.rho), GROUP_CONCAT(o.rho), COUNT(*)
+           FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+           WHERE o.author_id=?
+           GROUP BY o.entity_id, o.year
            {}
            ORDER BY year, COUNT(*) DESC'''.format(having), author_id).fetchall()
 
@@ -267,35 +825,54 @@ class ExpertFinding(object):
 
     def citing_authors(self, entities):
         """
-        Returns the list of authors citing any of the entities passed by arguments.
+        Returns the list of authors citing any of the entities passed by arguments, sorted by id.
         """
+        if self.index is not None:
+            return self.index.authors(self.index.citing_authors(entities))[0]
         result = self.db.execute(u'''SELECT DISTINCT(author_id)
             FROM "entity_occurrences"
-            WHERE entity IN ({}) AND rho > ?'''.format(join_entities_sql(entities)), (DEFAULT_MIN_SCORE,)).fetchall()
+            WHERE entity_id IN ({}) AND rho > ?
+            ORDER BY author_id'''.format(entity_ids_sql(entities)), (DEFAULT_MIN_SCORE,)).fetchall()
         return [t[0] for t in result]
 
-    def authors_completion(self, terms):
+    def citing_authors_entity_frequency(self, entities):
         """
-        Returns author names autocompletion for terms.
+        Returns, for each author citing any of the entities passed by arguments, how many of their
+        papers cite each of those entities.
         """
-        return self.db.execute(u'''SELECT * FROM "authors" WHERE name LIKE ? LIMIT 50''', (u"%{}%".format(terms),)).fetchall()
+        return self.db.execute(u'''
+            SELECT o.author_id, d.entity, COUNT(DISTINCT(o.document_id))
+            FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+            WHERE o.entity_id IN ({}) AND o.rho > ?
+            GROUP BY o.author_id, o.entity_id'''.format(entity_ids_sql(entities)), (DEFAULT_MIN_SCORE,)).fetchall()
+
+    def citing_authors_names(self, entities):
+        """
+        Returns the name of each author citing any of the entities passed by arguments.
+        """
+        return self.db.execute(u'''
+            SELECT author_id, name
+            FROM authors
+            WHERE author_id IN (
+                SELECT DISTINCT(author_id) FROM entity_occurrences WHERE entity_id IN ({}) AND rho > ?)
+            '''.format(entity_ids_sql(entities)), (DEFAULT_MIN_SCORE,)).fetchall()
+
+    def authors_completion(self, terms, limit=50):
+        """
+        Returns author names autocompletion for terms: the authors whose names have a word starting
+        with each of the words in terms, those with the most papers first.
+        """
+        return self.completion_index.complete(terms, limit)
 
     def _prefetch_relatedness(self, entity_group_1, entity_group_2):
-        pairs = ((e1, e2) for e1 in entity_group_1 for e2 in entity_group_2)
-        pairs_to_retrieve = [p for p in pairs if _str_titles(*p) not in self.rel_dict]
-        if pairs_to_retrieve:
-            for titles, rel in tagme.relatedness_title(pairs_to_retrieve):
-                self.rel_dict[_str_titles(*titles)] = rel
-        for p in pairs:
-            assert _str_titles(*p) in self.rel_dict
-        self.rel_dict.commit()
+        self.relatedness_store.prefetch([(e1, e2) for e1 in entity_group_1 for e2 in entity_group_2])
 
     def cossim_efiaf_score(self, query_entities, author_id):
-        author_entity_to_efiaf = dict((e[0], e[3]) for e in self.ef_iaf_author(author_id))
         query_entity_to_efiaf = self.ef_iaf_entities(query_entities)
+        author_entity_to_efiaf, author_norm = self.author_efiaf(author_id, query_entity_to_efiaf.keys())
         
         return sum(author_entity_to_efiaf[e] * query_entity_to_efiaf[e] for e in set(author_entity_to_efiaf.keys()) & set(query_entity_to_efiaf.keys())) \
-            / (math.sqrt(sum(author_entity_to_efiaf.values())) * math.sqrt(sum(query_entity_to_efiaf.values())))
+            / (author_norm * math.sqrt(sum(query_entity_to_efiaf.values())))
 
     def efiaf_score(self, query_entities, author_id):
         author_papers = self.author_papers_count(author_id)
@@ -325,26 +902,277 @@ class ExpertFinding(object):
         
         relatedness_weights = {}
         for q_entity in query_entities:
-            q_entity_relatedness = [(a_entity, self.rel_dict[_str_titles(q_entity, a_entity)]) for a_entity in author_entity_to_ec.keys()]
+            q_entity_relatedness = [(a_entity, self.relatedness_store.relatedness(q_entity, a_entity)) for a_entity in author_entity_to_ec.keys()]
             val_weights = [(1.0 - r**x + alpha, author_entity_to_ec[a_entity] * author_entity_to_maxrho[a_entity]) for a_entity, r in q_entity_relatedness]
             relatedness_weights[q_entity] = val_weights
 
         return mean([clip(1 - weighted_geom_mean(relatedness_weights[q_entity]) + alpha, 0.0, 1.0) ** (1.0/x) for q_entity in relatedness_weights])
 
+    def relatedness_geom_batch(self, query_entities, authors):
+        """
+        Same as relatedness_geom, for all authors at once. The relatedness between the query
+        entities and the entities cited by any of the authors is looked up only once.
+        """
+        if not authors:
+            return numpy.zeros(0)
+        profiles = [self.author_entity_frequency(author_id) for author_id in authors]
+        author_entities = sorted(set(t[0] for profile in profiles for t in profile))
+        entity_index = dict((e, j) for j, e in enumerate(author_entities))
+        relatedness_matrix = self.relatedness_store.matrix(list(query_entities), author_entities)
+        columns = numpy.array([entity_index[t[0]] for profile in profiles for t in profile], dtype=numpy.int64)
+        weights = numpy.array([t[1] * t[3] for profile in profiles for t in profile], dtype=float)
+        offsets = numpy.cumsum([0] + [len(profile) for profile in profiles[:-1]])
+        return batch_scoring.relatedness_geom_scores(relatedness_matrix[:, columns], weights, offsets)
+
+    def candidates_matrix(self, query_entities):
+        """
+        Returns the authors citing any of the query entities, the query entities, and the matrix of
+        entity counts (how many papers of each author cite each query entity), one row per author.
+        Authors are in the same order as returned by citing_authors.
+        """
+        authors = self.citing_authors(query_entities)
+        entities = list(query_entities)
+        author_index = dict((a, i) for i, a in enumerate(authors))
+        entity_index = dict((e, j) for j, e in enumerate(entities))
+        ec = numpy.zeros((len(authors), len(entities)))
+        for author_id, entity, author_freq in self.citing_authors_entity_frequency(query_entities):
+            ec[author_index[author_id], entity_index[entity]] = author_freq
+        return authors, entities, ec
+
+    BATCH_SCORING_FUNCTIONS = {
+        efiaf_score: batch_scoring.efiaf_contributions,
+        eciaf_score: batch_scoring.eciaf_contributions,
+        log_ec_ef_iaf_score: batch_scoring.log_ec_ef_iaf_contributions,
+    }
+
+    def batch_scoring_function(self, scoring):
+        """
+        Returns the batch implementation of a scoring function (see expertfinding.scoring), or None
+        if it has none.
+        """
+        return self.BATCH_SCORING_FUNCTIONS.get(getattr(scoring, "im_func", scoring))
+
+    BATCH_PROFILE_SCORING_FUNCTIONS = {
+        relatedness_geom: relatedness_geom_batch,
+    }
+
+    def batch_profile_scoring_function(self, scoring):
+        """
+        Returns the function scoring all candidates at once from their entity profiles, for scoring
+        functions that need more than the counts of the query entities, or None if there is none.
+        """
+        return self.BATCH_PROFILE_SCORING_FUNCTIONS.get(getattr(scoring, "im_func", scoring))
 
-    def find_expert(self, query, scoring):
+    def _candidates(self, query_entities):
+        """
+        Returns the candidate authors, their names, the query entities, the matrix of entity counts
+        of the candidates, their number of papers and the IAF of the query entities.
+        """
+        if self.index is not None:
+            author_indexes, entities, ec = self.index.candidates_matrix(query_entities)
+            authors, names = self.index.authors(author_indexes)
+            papers = self.index.author_papers[author_indexes].astype(float)
+            query_entity_to_efiaf = self.index.ef_iaf_entities(query_entities)
+        else:
+            authors, entities, ec = self.candidates_matrix(query_entities)
+            author_names = dict(self.citing_authors_names(query_entities))
+            names = [author_names[a] for a in authors]
+            papers = numpy.array([self.author_papers_count(a) for a in authors], dtype=float)
+            query_entity_to_efiaf = self.ef_iaf_entities(query_entities)
+        iaf = numpy.array([query_entity_to_efiaf.get(e, 0.0) for e in entities])
+        return authors, names, entities, ec, papers, iaf
+
+    def _score_authors_top_k(self, query_entities, contributions, top_k):
+        query_entity_to_efiaf = self.index.ef_iaf_entities(query_entities)
+        authors, entities, ec = self.index.top_k_candidates_matrix(query_entities, query_entity_to_efiaf, contributions, top_k)
+        logging.debug(u"Kept %d authors that may be among the best %d, computing their scores in batch." % (len(authors), top_k))
+        papers = self.index.author_papers[authors].astype(float)
+        iaf = numpy.array([query_entity_to_efiaf.get(e, 0.0) for e in entities])
+        scores = batch_scoring.sum_columns(contributions(ec, papers, iaf))
+        author_ids, names = self.index.authors(authors)
+        return [{"name":name, "author_id":author_id, "score":float(score)} for author_id, name, score in zip(author_ids, names, scores)]
+
+    @contextmanager
+    def _fixed_version(self, refresh=True):
+        """
+        Within this context, the version of the database is checked once (see refresh) and not again
+        by the current thread, so that a query is answered with the same statistics throughout.
+        Threads helping with a query that was already checked pass refresh=False.
+        """
+        if refresh:
+            self.refresh()
+        fixed_version = getattr(self._local, "fixed_version", False)
+        self._local.fixed_version = True
+        try:
+            yield
+        finally:
+            self._local.fixed_version = fixed_version
+
+    @contextmanager
+    def _shared_author_profiles(self, author_profiles):
+        """
+        Within this context, the entity profile of each author is fetched from the database only once
+        and kept in author_profiles, which other threads may share, and the time the current thread
+        spends fetching profiles is added up in profiles_time.
+        """
+        self._author_profiles = author_profiles
+        self._local.profiles_time = 0.0
+        try:
+            yield
+        finally:
+            self._author_profiles = None
+
+    @contextmanager
+    def _counting_sql(self, candidates):
+        """
+        Adds to the candidates the SQL statements executed and the rows fetched by the current thread
+        within this context.
+        """
+        cursor = self.db
+        statements, rows = cursor.statements, cursor.rows
+        try:
+            yield
+        finally:
+            candidates.add_sql(cursor.statements - statements, cursor.rows - rows)
+
+    def _pruned(self, scoring, batch, top_k):
+        """
+        Tells whether the scoring function ranks the authors from the in-memory index, pruning those
+        that cannot make it to the top_k, without retrieving all candidates.
+        """
+        return batch and top_k is not None and self.index is not None and self.batch_scoring_function(scoring) is not None
+
+    def prefetch_relatedness_geom(self, query_entities, authors):
+        """
+        Fetches at once the relatedness between the query entities and the entities of all authors.
+        """
+        author_entities = set(t[0] for author_id in authors for t in self.author_entity_frequency(author_id))
+        self._prefetch_relatedness(query_entities, author_entities)
+
+    PREFETCH_FUNCTIONS = {
+        relatedness_geom: prefetch_relatedness_geom,
+    }
+
+    def prefetch_function(self, scoring):
+        """
+        Returns the function fetching at once the data a scoring function needs for all candidates,
+        or None if it has none.
+        """
+        return self.PREFETCH_FUNCTIONS.get(getattr(scoring, "im_func", scoring))
+
+    def query_entities(self, query):
+        """
+        Returns the set of entities found in the query.
+        """
+        start_time = time.time()
+        query_entities = set(a.entity_title for a in entities(query))
+        metrics.QUERY_STAGE_SECONDS.observe(time.time() - start_time, ("annotation",))
+        return query_entities
+
+    def find_candidates(self, query_entities, scorings, batch=True, top_k=None):
+        """
+        Retrieves the candidate authors for the query entities, to be ranked with each of the scoring
+        functions by score_candidates. Returns a QueryCandidates.
+        """
+        with self._fixed_version():
+            start_time = time.time()
+            cursor = self.db
+            statements, rows = cursor.statements, cursor.rows
+            candidates = None
+            if not all(self._pruned(scoring, batch, top_k) for scoring in scorings):
+                candidates = self._candidates(query_entities)
+                logging.debug(u"Found %d authors that matched the query." % len(candidates[0]))
+                metrics.QUERY_CANDIDATES.observe(len(candidates[0]))
+            elapsed = time.time() - start_time
+            metrics.QUERY_STAGE_SECONDS.observe(elapsed, ("candidates",))
+            result = QueryCandidates(query_entities, candidates, elapsed)
+            result.add_sql(cursor.statements - statements, cursor.rows - rows)
+            return result
+
+    def score_candidates(self, candidates, scoring, batch=True, top_k=None):
+        """
+        Ranks the candidates returned by find_candidates with the scoring function. Can be called from
+        any thread, once the candidates are retrieved. Returns the ranking (as returned by
+        find_expert) and the time spent fetching author profiles, scoring and sorting, keyed as in
+        find_expert_multi.
+        """
+        scoring_name = getattr(scoring, "__name__", str(scoring))
+        timings = {}
+        with self._fixed_version(refresh=False), self._shared_author_profiles(candidates.profiles), self._counting_sql(candidates):
+            query_entities, authors, names = candidates.query_entities, candidates.authors, candidates.names
+            start_time = time.time()
+            contributions = self.batch_scoring_function(scoring) if batch else None
+            if self._pruned(scoring, batch, top_k):
+                results = self._score_authors_top_k(query_entities, contributions, top_k)
+            elif contributions is not None:
+                scores = batch_scoring.sum_columns(contributions(candidates.ec, candidates.papers, candidates.iaf))
+                results = [{"name":name, "author_id":author_id, "score":float(score)} for author_id, name, score in zip(authors, names, scores)]
+            elif batch and self.batch_profile_scoring_function(scoring) is not None:
+                scores = self.batch_profile_scoring_function(scoring)(self, query_entities, authors)
+                results = [{"name":name, "author_id":author_id, "score":float(score)} for author_id, name, score in zip(authors, names, scores)]
+            else:
+                debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+                prefetch = self.prefetch_function(scoring)
+                if prefetch is not None:
+                    prefetch(self, query_entities, authors)
+                results = []
+                for author_id, name in zip(authors, names):
+                    score = scoring(self, query_entities, author_id)
+                    results.append({"name":name, "author_id":author_id, "score":score})
+                    if debug:
+                        logging.debug(u"%s score=%.3f", name, score)
+            sort_start_time = time.time()
+            if top_k is not None:
+                ranking = heapq.nlargest(top_k, results, key=lambda t: t["score"])
+            else:
+                ranking = sorted(results, key=lambda t: t["score"], reverse=True)
+            timings[scoring_name] = time.time() - start_time
+            timings[scoring_name + ".profiles"] = self._local.profiles_time
+            timings[scoring_name + ".scoring"] = sort_start_time - start_time - timings[scoring_name + ".profiles"]
+            timings[scoring_name + ".sort"] = time.time() - sort_start_time
+        metrics.SCORING_SECONDS.observe(timings[scoring_name], (scoring_name,))
+        return ranking, timings
+
+    def find_expert_multi(self, query, scorings, batch=True, top_k=None, query_entities=None):
+        """
+        Ranks the authors for the query with each of the scoring functions, annotating the query,
+        retrieving the candidate authors and fetching their profiles only once.
+        Returns the list of rankings (one for each scoring function, as returned by find_expert), the
+        time spent annotating the query, retrieving the candidates and scoring with each function
+        (keyed by "annotation", "candidates" and the function name), and the query entities.
+        The time spent with each function is also split in fetching author profiles, scoring and
+        sorting (keyed by the function name followed by ".profiles", ".scoring" and ".sort").
+        If query_entities is given, the query is not annotated again.
+        """
         logging.debug(u"Processing query: {}".format(query))
+        timings = {}
         start_time = time.time()
-        query_entities =  set(a.entity_title for a in entities(query))
+        if query_entities is None:
+            query_entities = self.query_entities(query)
+        timings["annotation"] = time.time() - start_time
         logging.debug(u"Found the following entities in the query: {}".format(u",".join(query_entities)))
-        authors = self.citing_authors(query_entities) 
-        logging.debug(u"Found %d authors that matched the query, computing score for each of them." % len(authors))
-        results = []
-        for author_id in authors:
-            score = scoring(self, query_entities, author_id)
-            name = self.name(author_id)
-            results.append({"name":name, "author_id":author_id, "score":score})
-            logging.debug(u"%s score=%.3f", name, score)
+
+        with self._fixed_version():
+            candidates = self.find_candidates(query_entities, scorings, batch, top_k)
+            timings["candidates"] = candidates.elapsed
+            rankings = []
+            for scoring in scorings:
+                ranking, scoring_timings = self.score_candidates(candidates, scoring, batch, top_k)
+                rankings.append(ranking)
+                timings.update(scoring_timings)
+        candidates.observe_sql()
+        return rankings, timings, query_entities
+
+    def find_expert(self, query, scoring, batch=True, top_k=None):
+        """
+        Returns the authors ranked by the scoring function for the query, the time it took and the
+        entities found in the query. Scoring functions having a batch implementation score all
+        candidates at once, unless batch is False, using the in-memory index if loaded.
+        If top_k is set, only the first top_k authors are returned. With the in-memory index, authors
+        that cannot make it to the top_k are not scored at all.
+        """
+        start_time = time.time()
+        (results,), _, query_entities = self.find_expert_multi(query, [scoring], batch, top_k)
         runtime = time.time() - start_time
         logging.info("Query completed in %.3f sec" % (runtime,))
-        return sorted(results, key=lambda t: t["score"], reverse=True), runtime, query_entities
+        return results, runtime, query_entities
@@ -0,0 +1,199 @@
+'''
+Single-file annotation cache.
+
+Annotations are stored in an SQLite database keyed by the SHA-1 of the annotated text, encoded as
+a sequence of (begin, end, score, title) records. The cache holds at most max_entries texts and
+evicts the least recently used ones. It can be used at the same time by several threads and
+processes: each of them opens its own connection, and the database runs in WAL mode.
+
+Recency is a counter kept by each process, starting from the largest one stored. Cache hits do not
+write to the database: their recency is stored in batches of RECENCY_BATCH_SIZE (and before
+evicting), so the hits of the last batch of a process that exits are forgotten.
+'''
+
+import hashlib
+import logging
+import os
+import sqlite3
+import struct
+import threading
+
+from expertfinding.annotators import Annotation
+
+
+DEFAULT_MAX_ENTRIES = 2000000
+
+RECENCY_BATCH_SIZE = 1000
+
+_RECORD_HEADER = struct.Struct("<iidH")
+
+
+def encode_annotations(annotations):
+    records = []
+    for a in annotations:
+        title = a.entity_title.encode("utf-8")
+        records.append(_RECORD_HEADER.pack(a.begin, a.end, a.score, len(title)))
+        records.append(title)
+    return b"".join(records)
+
+
+def decode_annotations(data):
+    data = bytes(data)
+    annotations = []
+    offset = 0
+    while offset < len(data):
+        begin, end, score, title_length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        annotations.append(Annotation(data[offset:offset + title_length].decode("utf-8"), begin, end, score))
+        offset += title_length
+    return annotations
+
+
+def text_key(text):
+    return sqlite3.Binary(hashlib.sha1(text.encode("utf-8") if isinstance(text, unicode) else text).digest())
+
+
+class SqliteAnnotationCache(object):
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        db = self._db()
+        db.execute('''CREATE TABLE IF NOT EXISTS annotations
+            (key BLOB PRIMARY KEY, annotations BLOB, last_used INTEGER)''')
+        db.execute('''CREATE INDEX IF NOT EXISTS annotations_last_used_index ON annotations (last_used)''')
+        self._entries = db.execute('''SELECT COUNT(*) FROM annotations''').fetchone()[0]
+        self._clock = db.execute('''SELECT IFNULL(MAX(last_used), 0) FROM annotations''').fetchone()[0]
+        self._recent = {}
+
+    def _db(self):
+        """
+        Returns the connection of the current thread, opening it if needed (also after a fork).
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._local.db.execute('''PRAGMA journal_mode=WAL''')
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _ticks(self, count=1):
+        """
+        Returns the first of count new values of the recency counter.
+        """
+        with self._lock:
+            self._clock += count
+            return self._clock - count + 1
+
+    def get(self, text):
+        """
+        Returns the cached annotations of text, or None if they are not in the cache.
+        """
+        db = self._db()
+        key = text_key(text)
+        row = db.execute('''SELECT annotations FROM annotations WHERE key=?''', (key,)).fetchone()
+        self._count(row is not None)
+        if row is None:
+            return None
+        with self._lock:
+            self._clock += 1
+            self._recent[bytes(key)] = self._clock
+            flush = len(self._recent) >= RECENCY_BATCH_SIZE
+        if flush:
+            self.flush()
+        return decode_annotations(row[0])
+
+    def flush(self):
+        """
+        Stores the recency of the entries read since the last flush, in a single transaction.
+        """
+        with self._lock:
+            recent, self._recent = self._recent, {}
+        if not recent:
+            return
+        db = self._db()
+        db.execute('''BEGIN''')
+        db.executemany('''UPDATE annotations SET last_used=? WHERE key=?''',
+                       [(last_used, sqlite3.Binary(key)) for key, last_used in recent.iteritems()])
+        last_used = db.execute('''SELECT IFNULL(MAX(last_used), 0) FROM annotations''').fetchone()[0]
+        db.execute('''COMMIT''')
+        with self._lock:
+            # Keep up with the other processes using the cache.
+            self._clock = max(self._clock, last_used)
+
+    def put(self, text, annotations):
+        db = self._db()
+        key = text_key(text)
+        with self._lock:
+            self._recent.pop(bytes(key), None)
+        db.execute('''INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)''',
+                   (key, sqlite3.Binary(encode_annotations(annotations)), self._ticks()))
+        with self._lock:
+            self._entries += 1
+            evict = self._entries > self.max_entries
+        if evict:
+            self._evict()
+
+    def put_many(self, items):
+        """
+        Caches the (text, annotations) pairs of items in a single transaction, e.g. to fill the cache
+        with pre-computed annotations.
+        """
+        db = self._db()
+        items = list(items)
+        first = self._ticks(len(items))
+        rows = [(text_key(text), sqlite3.Binary(encode_annotations(annotations)), first + i) for i, (text, annotations) in enumerate(items)]
+        db.execute('''BEGIN''')
+        db.executemany('''INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)''', rows)
+        db.execute('''COMMIT''')
+        with self._lock:
+            self._entries += len(rows)
+            evict = self._entries > self.max_entries
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        """
+        Evicts the least recently used entries, leaving the cache 10% below its size limit.
+        """
+        self.flush()
+        db = self._db()
+        entries = db.execute('''SELECT COUNT(*) FROM annotations''').fetchone()[0]
+        to_evict = entries - int(self.max_entries * 0.9)
+        if to_evict > 0:
+            db.execute('''DELETE FROM annotations WHERE key IN
+                (SELECT key FROM annotations ORDER BY last_used LIMIT ?)''', (to_evict,))
+            logging.debug("Evicted %d entries from the annotation cache" % to_evict)
+        with self._lock:
+            self._entries = entries - max(to_evict, 0)
+
+    def stats(self):
+        """
+        Returns the hits and misses of this process and the approximate number of entries.
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": self._entries, "max_entries": self.max_entries}
+
+    def __call__(self, annotator):
+        """
+        Wraps an annotator so that its results are cached.
+        """
+        def cached_annotator(text):
+            if not text:
+                return annotator(text)
+            annotations = self.get(text)
+            if annotations is None:
+                annotations = annotator(text)
+                self.put(text, annotations)
+            return annotations
+        cached_annotator.cache = self
+        return cached_annotator
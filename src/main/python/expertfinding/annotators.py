@@ -0,0 +1,80 @@
+'''
+Annotators link a text to entities, returning objects with the same entity_title, begin, end and
+score attributes as tagme.Annotation. The default annotator is expertfinding.entities, which calls
+TagMe; the ones defined here can stand in for it.
+'''
+
+from collections import namedtuple
+import json
+import logging
+import re
+import time
+
+
+Annotation = namedtuple('Annotation', ['entity_title', 'begin', 'end', 'score'])
+
+
+def annotate_with_retry(annotator, text, retries=3, backoff=1.0):
+    """
+    Calls annotator(text), retrying up to retries times with exponential backoff if it fails.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return annotator(text)
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logging.warning("Annotation failed (attempt %d), retrying in %.1f sec" % (attempt + 1, delay), exc_info=True)
+            time.sleep(delay)
+
+
+class DictionaryAnnotator(object):
+    """
+    Annotates the occurrences of known entity titles in a text (case insensitive, whole words),
+    optionally waiting latency seconds per call to simulate a remote service.
+    """
+
+    def __init__(self, entity_scores, latency=0.0):
+        self.entity_scores = dict((title.lower(), (title, score)) for title, score in entity_scores.items())
+        titles = sorted(self.entity_scores, key=len, reverse=True)
+        self.regex = re.compile(u"\\b({})\\b".format(u"|".join(re.escape(t) for t in titles)), re.IGNORECASE | re.UNICODE) if titles else None
+        self.latency = latency
+
+    def __call__(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        if not text or self.regex is None:
+            return []
+        annotations = []
+        for match in self.regex.finditer(text):
+            title, score = self.entity_scores[match.group(0).lower()]
+            annotations.append(Annotation(title, match.start(), match.end(), score))
+        return annotations
+
+
+class RecordedAnnotator(object):
+    """
+    Replays recorded annotations, e.g. to run benchmarks offline. Texts that were not recorded are
+    annotated with annotator and recorded, or raise KeyError if there is no annotator.
+    """
+
+    def __init__(self, annotations=None, annotator=None):
+        self.annotations = annotations if annotations is not None else {}
+        self.annotator = annotator
+
+    @classmethod
+    def load(cls, path, annotator=None):
+        with open(path) as f:
+            return cls(dict((text, [Annotation(*a) for a in annotations]) for text, annotations in json.load(f).items()), annotator)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(dict((text, [tuple(a) for a in annotations]) for text, annotations in self.annotations.items()), f, indent=1, sort_keys=True)
+
+    def __call__(self, text):
+        if text not in self.annotations:
+            if self.annotator is None:
+                raise KeyError(u"No recorded annotations for {}".format(text))
+            self.annotations[text] = [Annotation(a.entity_title, a.begin, a.end, a.score) for a in self.annotator(text)]
+        return self.annotations[text]
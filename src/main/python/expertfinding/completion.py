@@ -0,0 +1,66 @@
+'''
+In-memory index for the autocompletion of author names.
+
+Names are split in lowercase tokens. The distinct tokens are kept sorted, so that the tokens
+starting with a prefix are a contiguous range found by bisection, and the authors whose names
+contain each token are stored in a NumPy array (CSR layout, as in expertfinding.index). Authors are
+numbered by decreasing number of papers, so the best matches of a query are the lowest numbers.
+'''
+
+from bisect import bisect_left
+import re
+
+import numpy
+
+
+MAX_CHAR = u"\uffff"
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower(), re.UNICODE)
+
+
+class AuthorCompletionIndex(object):
+
+    def __init__(self, authors, tokens, token_offsets, token_authors):
+        self.authors = authors
+        self.tokens = tokens
+        self.token_offsets = token_offsets
+        self.token_authors = token_authors
+
+    @classmethod
+    def build(cls, db, statistics):
+        """
+        Builds the index of the names in the authors table, ranking authors by their number of papers.
+        """
+        authors = sorted(db.execute(u'''SELECT author_id, name, institution FROM authors''').fetchall(),
+                         key=lambda a: (-statistics.author_papers.get(a[0], 0), a[1], a[0]))
+        postings = sorted((token, i) for i, (_, name, _) in enumerate(authors) for token in set(tokenize(name or u"")))
+        tokens = []
+        token_offsets = [0]
+        for j, (token, _) in enumerate(postings):
+            if not tokens or tokens[-1] != token:
+                if tokens:
+                    token_offsets.append(j)
+                tokens.append(token)
+        token_offsets.append(len(postings))
+        return cls(authors,
+                   tokens,
+                   numpy.array(token_offsets, dtype=numpy.int64),
+                   numpy.array([i for _, i in postings], dtype=numpy.int32))
+
+    def complete(self, terms, limit=50):
+        """
+        Returns the (author_id, name, institution) of the authors having, for each token of terms, a
+        token of their name starting with it. The authors with the most papers come first.
+        """
+        query_tokens = tokenize(terms)
+        if not query_tokens or not self.tokens:
+            return []
+        matches = numpy.zeros(len(self.authors), dtype=numpy.int32)
+        for token in query_tokens:
+            begin = bisect_left(self.tokens, token)
+            end = bisect_left(self.tokens, token + MAX_CHAR, begin)
+            # Authors with several tokens starting with the prefix are counted once.
+            matches[self.token_authors[self.token_offsets[begin]:self.token_offsets[end]]] += 1
+        return [self.authors[i] for i in numpy.flatnonzero(matches == len(query_tokens))[:limit]]
@@ -0,0 +1,201 @@
+'''
+In-memory inverted index from entities to the authors citing them.
+
+Entities and authors are interned as integers, and the postings of all entities are stored in
+NumPy arrays (CSR layout): the postings of entity i are at positions
+entity_offsets[i]:entity_offsets[i+1] of posting_authors, posting_counts and posting_max_rho.
+'''
+
+from array import array
+from bisect import bisect_left
+from math import log
+import sys
+
+import numpy
+
+from expertfinding.scoring import sum_columns
+
+
+def _to_numpy(a, dtype):
+    return numpy.frombuffer(a, dtype=dtype) if len(a) else numpy.zeros(0, dtype=dtype)
+
+
+def _take(strings, indexes):
+    if hasattr(strings, "take"):
+        return strings.take(indexes)
+    return [strings[i] for i in indexes]
+
+
+class InvertedIndex(object):
+
+    def __init__(self, entities, entity_popularity, entity_offsets, posting_authors, posting_counts, posting_max_rho,
+                 author_ids, author_names, author_papers, total_papers):
+        self.entities = entities
+        self.entity_popularity = entity_popularity
+        self.entity_offsets = entity_offsets
+        self.posting_authors = posting_authors
+        self.posting_counts = posting_counts
+        self.posting_max_rho = posting_max_rho
+        self.author_ids = author_ids
+        self.author_names = author_names
+        self.author_papers = author_papers
+        self.total_papers = total_papers
+        self._max_contributions = {}
+
+    @classmethod
+    def build(cls, db, statistics, min_score):
+        """
+        Builds the index from an EF database. Only entity occurrences with rho > min_score are
+        indexed.
+        """
+        authors = sorted(db.execute(u'''SELECT author_id, name FROM authors''').fetchall())
+        author_ids = [a for a, _ in authors]
+        author_names = [n for _, n in authors]
+        author_index = dict((a, i) for i, a in enumerate(author_ids))
+        entities = sorted(statistics.entity_popularity.keys())
+        entity_index = dict((e, i) for i, e in enumerate(entities))
+
+        posting_entities, posting_authors, posting_counts, posting_max_rho = array("i"), array("i"), array("i"), array("f")
+        for entity, author_id, author_freq, max_rho in db.execute(u'''
+                SELECT d.entity, o.author_id, COUNT(DISTINCT(o.document_id)), MAX(o.rho)
+                FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+                WHERE o.rho > ?
+                GROUP BY o.entity_id, o.author_id''', (min_score,)):
+            posting_entities.append(entity_index[entity])
+            posting_authors.append(author_index[author_id])
+            posting_counts.append(author_freq)
+            posting_max_rho.append(max_rho)
+
+        posting_entities = _to_numpy(posting_entities, numpy.int32)
+        posting_authors = _to_numpy(posting_authors, numpy.int32)
+        order = numpy.lexsort((posting_authors, posting_entities))
+        entity_offsets = numpy.zeros(len(entities) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(posting_entities, minlength=len(entities)), out=entity_offsets[1:])
+
+        return cls(entities,
+                   numpy.array([statistics.entity_popularity[e] for e in entities], dtype=numpy.int64),
+                   entity_offsets,
+                   posting_authors[order],
+                   _to_numpy(posting_counts, numpy.int32)[order],
+                   _to_numpy(posting_max_rho, numpy.float32)[order],
+                   author_ids,
+                   author_names,
+                   numpy.array([statistics.author_papers.get(a, 0) for a in author_ids], dtype=numpy.int32),
+                   statistics.total_papers)
+
+    def entity_index(self, entity):
+        """
+        Returns the index of an entity, or None if it is not indexed. Entities are sorted, so they are
+        looked up by bisection (they may be stored in a snapshot, see expertfinding.snapshot).
+        """
+        i = bisect_left(self.entities, entity)
+        return i if i < len(self.entities) and self.entities[i] == entity else None
+
+    def authors(self, indexes):
+        """
+        Returns the ids and the names of some authors (as a NumPy array of indexes).
+        """
+        return _take(self.author_ids, indexes), _take(self.author_names, indexes)
+
+    def postings(self, entity):
+        """
+        Returns the authors (as indexes) citing an entity and how many of their papers cite it.
+        """
+        i = self.entity_index(entity)
+        if i is None:
+            return numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0, dtype=numpy.int32)
+        begin, end = self.entity_offsets[i], self.entity_offsets[i + 1]
+        return self.posting_authors[begin:end], self.posting_counts[begin:end]
+
+    def citing_authors(self, entities):
+        """
+        Returns the indexes of the authors citing any of the entities, sorted.
+        """
+        return numpy.unique(numpy.concatenate([self.postings(e)[0] for e in entities] + [numpy.zeros(0, dtype=numpy.int32)]))
+
+    def candidates_matrix(self, query_entities):
+        """
+        Returns the authors (as indexes) citing any of the query entities, the query entities, and
+        the matrix of entity counts, one row per author.
+        """
+        entities = list(query_entities)
+        postings = [self.postings(e) for e in entities]
+        authors = self.citing_authors(entities)
+        ec = numpy.zeros((len(authors), len(entities)))
+        for j, (entity_authors, entity_counts) in enumerate(postings):
+            ec[numpy.searchsorted(authors, entity_authors), j] = entity_counts
+        return authors, entities, ec
+
+    def entity_counts(self, authors, entities):
+        """
+        Returns the matrix of entity counts of some authors (as sorted indexes), one row per author.
+        """
+        ec = numpy.zeros((len(authors), len(entities)))
+        for j, entity in enumerate(entities):
+            entity_authors, entity_counts = self.postings(entity)
+            positions = numpy.searchsorted(entity_authors, authors)
+            found = positions < len(entity_authors)
+            found[found] = entity_authors[positions[found]] == authors[found]
+            ec[found, j] = entity_counts[positions[found]]
+        return ec
+
+    def max_contribution(self, contributions, entity):
+        """
+        Returns the maximum contribution of an entity to the score of any author, for an IAF of 1.
+        Contributions are linear in the IAF, so multiplying by the actual IAF gives an upper bound.
+        """
+        key = (contributions, entity)
+        if key not in self._max_contributions:
+            authors, counts = self.postings(entity)
+            self._max_contributions[key] = contributions(counts[:, None].astype(float), self.author_papers[authors].astype(float), numpy.ones(1)).max() if len(authors) else 0.0
+        return self._max_contributions[key]
+
+    def top_k_candidates_matrix(self, query_entities, query_entity_to_efiaf, contributions, k):
+        """
+        Same as candidates_matrix, but leaving out authors that cannot be among the k best.
+
+        This is the MaxScore strategy: the postings of the entities are visited by decreasing upper
+        bound, keeping track of the k-th best score found so far. An author citing none of the
+        entities visited scores at most the sum of the bounds of the entities left, so when that sum
+        falls below the k-th best score, the remaining postings are skipped.
+        """
+        entities = list(query_entities)
+        iaf = numpy.array([query_entity_to_efiaf.get(e, 0.0) for e in entities])
+        bounds = [self.max_contribution(contributions, e) * iaf[j] for j, e in enumerate(entities)]
+        left_bound = sum(bounds)
+        threshold = float("-inf")
+        best_scores = numpy.zeros(0)
+        authors = numpy.zeros(0, dtype=numpy.int32)
+        for j in sorted(range(len(entities)), key=lambda j: bounds[j], reverse=True):
+            # Leave some room for rounding errors in the sum of the bounds.
+            if left_bound * (1 + 1e-9) < threshold:
+                break
+            left_bound -= bounds[j]
+            new_authors = numpy.setdiff1d(self.postings(entities[j])[0], authors, assume_unique=True)
+            scores = sum_columns(contributions(self.entity_counts(new_authors, entities), self.author_papers[new_authors].astype(float), iaf))
+            best_scores = numpy.concatenate((best_scores, scores))
+            if len(best_scores) >= k > 0:
+                best_scores = numpy.partition(best_scores, len(best_scores) - k)[len(best_scores) - k:]
+                threshold = best_scores[0]
+            authors = numpy.union1d(authors, new_authors)
+        return authors, entities, self.entity_counts(authors, entities)
+
+    def ef_iaf_entities(self, entities):
+        """
+        Same as ExpertFinding.ef_iaf_entities.
+        """
+        entity_indexes = [(e, self.entity_index(e)) for e in entities]
+        return dict((e, 1.0/len(entities) * log(self.total_papers/float(self.entity_popularity[i])))
+                    for e, i in entity_indexes if i is not None)
+
+    def memory_footprint(self):
+        """
+        Returns the approximate number of bytes used by the index.
+        """
+        arrays = [self.entity_popularity, self.entity_offsets, self.posting_authors, self.posting_counts,
+                  self.posting_max_rho, self.author_papers]
+        string_lists = [s for s in (self.entities, self.author_ids, self.author_names) if isinstance(s, list)]
+        return sum(a.nbytes for a in arrays) \
+            + sum(s.nbytes for s in (self.entities, self.author_ids, self.author_names) if not isinstance(s, list)) \
+            + sum(sys.getsizeof(o) for o in string_lists) \
+            + sum(sys.getsizeof(s) for strings in string_lists for s in strings)
@@ -0,0 +1,211 @@
+'''
+Lightweight instrumentation of the query engine.
+
+Counters and histograms (optionally labelled) are kept in process memory and rendered in the
+Prometheus text format by Registry.render (see the /metrics endpoint of expertfinding.web.server).
+Recording a value takes a lock and a few dictionary operations, so metrics are recorded once per
+query or per remote call, never per author or per row: SQL statements and rows are counted by the
+cursor of each thread (CountingCursor) and added to the metrics once per query.
+
+Metrics are per process: with several server workers, a scrape reports the worker answering it.
+'''
+
+from bisect import bisect_left
+import math
+import sqlite3
+import threading
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and not math.isnan(value) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return u"{" + u",".join(u'{}="{}"'.format(name, unicode(value).replace(u"\\", u"\\\\").replace(u'"', u'\\"').replace(u"\n", u"\\n"))
+                            for name, value in zip(names, values)) + u"}"
+
+
+class Counter(object):
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        """
+        Returns the (name, label names, label values, value) samples of the metric.
+        """
+        with self._lock:
+            return [(self.name, self.labels, labels, value) for labels, value in sorted(self._values.items())]
+
+
+class Histogram(object):
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            counts[bucket] += 1
+            self._sums[labels] = self._sums.get(labels, 0) + value
+
+    def count(self, labels=()):
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self):
+        """
+        Returns the (name, label names, label values, value) samples of the metric: the cumulative
+        count of each bucket, the sum and the count of the observed values.
+        """
+        samples = []
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    samples.append((self.name + "_bucket", self.labels + ("le",), labels + (_format_value(float(bound)),), cumulative))
+                samples.append((self.name + "_sum", self.labels, labels, self._sums[labels]))
+                samples.append((self.name + "_count", self.labels, labels, cumulative))
+        return samples
+
+
+class Collector(object):
+    """
+    Metric whose values are read when rendered from function, which returns a dictionary from label
+    values to values (e.g. the hits of a cache, kept by the cache itself).
+    """
+
+    def __init__(self, name, kind, help, function, labels=()):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.function = function
+
+    def samples(self):
+        return [(self.name, self.labels, labels, value) for labels, value in sorted(self.function().items())]
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError("Metric {} already registered".format(metric.name))
+            self.metrics.append(metric)
+        return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self.metrics = [m for m in self.metrics if m.name != name]
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, kind, help, function, labels=()):
+        return self.register(Collector(name, kind, help, function, labels))
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            lines.append(u"# HELP {} {}".format(metric.name, metric.help))
+            lines.append(u"# TYPE {} {}".format(metric.name, metric.kind))
+            for name, label_names, label_values, value in metric.samples():
+                lines.append(u"{}{} {}".format(name, _format_labels(label_names, label_values), _format_value(value)))
+        return u"\n".join(lines) + u"\n"
+
+
+class CountingCursor(sqlite3.Cursor):
+    """
+    Cursor counting the statements it executes and the rows returned by fetchone, fetchmany and
+    fetchall (iterating over the cursor is not counted, as it would double its cost). Counts are
+    plain attributes, as each thread has its own cursor.
+    """
+
+    statements = 0
+    rows = 0
+
+    def execute(self, *args):
+        self.statements += 1
+        return sqlite3.Cursor.execute(self, *args)
+
+    def executemany(self, *args):
+        self.statements += 1
+        return sqlite3.Cursor.executemany(self, *args)
+
+    def fetchone(self):
+        row = sqlite3.Cursor.fetchone(self)
+        if row is not None:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = sqlite3.Cursor.fetchmany(self, *args)
+        self.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = sqlite3.Cursor.fetchall(self)
+        self.rows += len(rows)
+        return rows
+
+
+REGISTRY = Registry()
+
+QUERY_STAGE_SECONDS = REGISTRY.histogram("expertfinding_query_stage_seconds", "Time spent annotating queries and retrieving their candidates", ("stage",))
+SCORING_SECONDS = REGISTRY.histogram("expertfinding_scoring_seconds", "Time spent ranking the candidates with each scoring function", ("scoring",))
+QUERY_CANDIDATES = REGISTRY.histogram("expertfinding_query_candidates", "Candidate authors per query", buckets=SIZE_BUCKETS)
+QUERY_SQL_STATEMENTS = REGISTRY.histogram("expertfinding_query_sql_statements", "SQL statements per call of find_expert_multi", buckets=SIZE_BUCKETS)
+QUERY_SQL_ROWS = REGISTRY.histogram("expertfinding_query_sql_rows", "SQL rows fetched per call of find_expert_multi", buckets=SIZE_BUCKETS)
+SQL_STATEMENTS = REGISTRY.counter("expertfinding_sql_statements_total", "SQL statements executed by find_expert_multi")
+SQL_ROWS = REGISTRY.counter("expertfinding_sql_rows_total", "SQL rows fetched by find_expert_multi")
+TAGME_SECONDS = REGISTRY.histogram("expertfinding_tagme_request_seconds", "Latency of the TagMe API calls", ("api",))
+TAGME_ERRORS = REGISTRY.counter("expertfinding_tagme_errors_total", "Failed TagMe API calls", ("api",))
+TIMEOUTS = REGISTRY.counter("expertfinding_timeouts_total", "Query annotations and rankings not ready in time (see expertfinding.pipeline)", ("stage",))
+SCORINGS_SKIPPED = REGISTRY.counter("expertfinding_scorings_skipped_total", "Rankings left out because all scoring threads were busy (see expertfinding.pipeline)", ("scoring",))
@@ -0,0 +1,155 @@
+'''
+Concurrent query pipeline, in front of ExpertFinding.find_expert_multi.
+
+The query is annotated by a worker thread of the annotation pool, waiting for it at most
+annotation_timeout seconds. Once the query entities are known, the candidate authors are retrieved
+once by the calling thread (see ExpertFinding.find_candidates). The scoring functions without a batch
+implementation on the entity counts (such as relatedness_geom, which waits on the relatedness
+service) then rank the candidates in the threads of the scoring pool, each with its own database
+connection and sharing the author profiles, while the calling thread ranks them with the others.
+Rankings that are not ready scoring_timeout seconds later are left out.
+
+Work that timed out is not interrupted: an annotation that completes later is kept for the next
+time the same query is asked, and the relatedness fetched meanwhile is stored as usual. So that
+rankings still running do not pile up, no more than scoring_workers of them are run at once: while
+all scoring threads are busy, the rankings of further queries are left out right away.
+'''
+
+import logging
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+from expertfinding import metrics
+from expertfinding.query_cache import LRUCache
+
+
+DEFAULT_ANNOTATION_WORKERS = 2
+DEFAULT_SCORING_WORKERS = 4
+
+
+class QueryPipeline(object):
+
+    def __init__(self, ef, annotation_workers=DEFAULT_ANNOTATION_WORKERS, scoring_workers=DEFAULT_SCORING_WORKERS,
+                 annotation_timeout=None, scoring_timeout=None):
+        """
+        Timeouts are in seconds; None waits as long as needed.
+        """
+        self.ef = ef
+        self.annotation_workers = annotation_workers
+        self.scoring_workers = scoring_workers
+        self.annotation_timeout = annotation_timeout
+        self.scoring_timeout = scoring_timeout
+        self._annotations = LRUCache(ttl=None)
+        self._lock = threading.Lock()
+        self._pools_pid = None
+        self._scoring_tasks = 0
+
+    def _pools(self):
+        """
+        Returns the pools of annotation and scoring threads, starting them if needed (also after a
+        fork, which does not carry threads over).
+        """
+        with self._lock:
+            if self._pools_pid != os.getpid():
+                self._annotation_pool = ThreadPool(self.annotation_workers)
+                self._scoring_pool = ThreadPool(self.scoring_workers)
+                self._scoring_tasks = 0
+                self._pools_pid = os.getpid()
+            return self._annotation_pool, self._scoring_pool
+
+    def thread_ids(self):
+        """
+        Returns the ids of the worker threads (e.g. to profile them, see expertfinding.profiling).
+        """
+        return set(t.ident for pool in self._pools() for t in pool._pool)
+
+    def version(self):
+        return self.ef.version()
+
+    def refresh(self):
+        return self.ef.refresh()
+
+    def query_entities(self, query):
+        """
+        Returns the entities found in the query, or None if they are not found within
+        annotation_timeout seconds.
+        """
+        annotation = self._annotations.get(query)
+        if annotation is None:
+            annotation = self._pools()[0].apply_async(self.ef.query_entities, (query,))
+            self._annotations.put(query, annotation)
+        try:
+            return annotation.get(self.annotation_timeout)
+        except TimeoutError:
+            logging.warning(u"Annotation of query {} timed out".format(query))
+            metrics.TIMEOUTS.inc(labels=("annotation",))
+            return None
+        finally:
+            if annotation.ready():
+                self._annotations.discard(query)
+
+    def _score_candidates(self, candidates, scoring, batch, top_k):
+        try:
+            return self.ef.score_candidates(candidates, scoring, batch, top_k)
+        finally:
+            with self._lock:
+                self._scoring_tasks -= 1
+
+    def _submit_scoring(self, candidates, scoring, batch, top_k):
+        """
+        Ranks the candidates with the scoring function in the scoring pool. Returns the pending
+        result, or None if all scoring threads are busy.
+        """
+        scoring_pool = self._pools()[1]
+        with self._lock:
+            if self._scoring_tasks >= self.scoring_workers:
+                return None
+            self._scoring_tasks += 1
+        return scoring_pool.apply_async(self._score_candidates, (candidates, scoring, batch, top_k))
+
+    def find_expert_multi(self, query, scorings, batch=True, top_k=None, query_entities=None):
+        """
+        Same as ExpertFinding.find_expert_multi, with the timeouts of the pipeline. Rankings that
+        timed out or were not started are None, and so are all rankings and the query entities if
+        the annotation timed out.
+        """
+        timings = {}
+        start_time = time.time()
+        if query_entities is None:
+            query_entities = self.query_entities(query)
+        timings["annotation"] = time.time() - start_time
+        if query_entities is None:
+            return [None] * len(scorings), timings, None
+
+        candidates = self.ef.find_candidates(query_entities, scorings, batch, top_k)
+        timings["candidates"] = candidates.elapsed
+        start_time = time.time()
+        pending = [self._submit_scoring(candidates, scoring, batch, top_k) if batch and self.ef.batch_scoring_function(scoring) is None else False
+                   for scoring in scorings]
+        rankings = [None] * len(scorings)
+        for i, scoring in enumerate(scorings):
+            if pending[i] is False:
+                rankings[i], scoring_timings = self.ef.score_candidates(candidates, scoring, batch, top_k)
+                timings.update(scoring_timings)
+        for i, scoring in enumerate(scorings):
+            name = getattr(scoring, "__name__", str(scoring))
+            if pending[i] is False:
+                continue
+            if pending[i] is None:
+                logging.warning(u"Scoring of query {} with {} skipped, all scoring threads are busy".format(query, name))
+                metrics.SCORINGS_SKIPPED.inc(labels=(name,))
+                timings[name] = 0.0
+                continue
+            timeout = None if self.scoring_timeout is None else max(0.0, start_time + self.scoring_timeout - time.time())
+            try:
+                rankings[i], scoring_timings = pending[i].get(timeout)
+                timings.update(scoring_timings)
+            except TimeoutError:
+                logging.warning(u"Scoring of query {} with {} timed out".format(query, name))
+                metrics.TIMEOUTS.inc(labels=(name,))
+                timings[name] = time.time() - start_time
+        candidates.observe_sql()
+        return rankings, timings, query_entities
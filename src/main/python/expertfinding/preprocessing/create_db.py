@@ -17,17 +17,37 @@ from __future__ import division
 from argparse import ArgumentParser
 from glob import glob
 import logging
+from multiprocessing import Pool
 import sys
 import tagme
 
-from expertfinding import ExpertFinding
+from expertfinding import DEFAULT_MIN_SCORE, ExpertFinding
 import expertfinding
+from expertfinding import sharding
+from expertfinding.annotators import RecordedAnnotator
 from expertfinding.preprocessing import datasetreader
 
 
 MIN_YEAR, MAX_YEAR = 2006, 2017
 
 
+def build(storage_db, args, shard=None):
+    ef = ExpertFinding(storage_db, erase=not args.incremental)
+    ef_builder = ef.builder(annotation_workers=args.annotation_workers, annotation_retries=3 if args.gcube_token else 0, bulk=args.bulk,
+                            incremental=args.incremental, shard=shard)
+
+    for input_f in glob(args.input):
+        ef_builder.add_documents(input_f, datasetreader.paper_generator(input_f, args.input_format), MIN_YEAR, MAX_YEAR, args.batch_size)
+    if shard is None:
+        # The statistics of shards are computed when they are merged.
+        ef_builder.finish()
+
+
+def build_shard(data):
+    storage_db, args, shard = data
+    build(storage_db, args, shard)
+
+
 def main():
     '''Command line options.'''
     parser = ArgumentParser()
@@ -35,18 +55,37 @@ def main():
     parser.add_argument("-f", "--input_format", required=True, action="store", help="Format of input file(s)", choices=datasetreader.SUPPORTED_FORMATS)
     parser.add_argument("-c", "--cache_dir", required=True, action="store", help="Cache directory")
     parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
-    parser.add_argument("-g", "--gcube_token", required=True, action="store", help="Tagme authentication gcube token")
+    parser.add_argument("-g", "--gcube_token", action="store", help="Tagme authentication gcube token (if missing, all documents must be in the annotation cache)")
+    parser.add_argument("-w", "--annotation_workers", default=1, type=int, action="store", help="Number of documents annotated concurrently")
+    parser.add_argument("-b", "--batch_size", default=1000, type=int, action="store", help="Number of documents written per transaction")
+    parser.add_argument("--bulk", action="store_true", help="Bulk mode: faster, but the database may be corrupted if the build is interrupted")
+    parser.add_argument("--incremental", action="store_true", help="Add to an existing DB the papers it does not contain yet (also resumes an interrupted build)")
+    parser.add_argument("--cache_backend", default="sqlite", action="store", help="Annotation cache backend", choices=["sqlite", "fs"])
+    parser.add_argument("--cache_size", default=expertfinding.DEFAULT_MAX_ENTRIES, type=int, action="store", help="Maximum number of texts in the annotation cache (sqlite backend)")
+    parser.add_argument("--shards", default=1, type=int, action="store", help="Split the DB in this many shards, built in parallel (see expertfinding.sharding)")
     args = parser.parse_args()
     
-    tagme.GCUBE_TOKEN = args.gcube_token
+    if args.gcube_token:
+        tagme.GCUBE_TOKEN = args.gcube_token
+    else:
+        # Offline build, e.g. of a synthetic dataset: texts not in the cache fail with KeyError.
+        expertfinding.entities = RecordedAnnotator()
 
-    expertfinding.set_cache(args.cache_dir)
+    cache = expertfinding.set_cache(args.cache_dir, args.cache_size, args.cache_backend)
 
-    ef = ExpertFinding(args.storage_db, erase=True)
-    ef_builder = ef.builder()
+    if args.shards > 1:
+        paths = sharding.shard_paths(args.storage_db, args.shards)
+        pool = Pool(args.shards)
+        pool.map(build_shard, [(path, args, (i, args.shards)) for i, path in enumerate(paths)])
+        sharding.merge_statistics(paths, DEFAULT_MIN_SCORE, pool.map)
+        pool.close()
+        pool.join()
+    else:
+        build(args.storage_db, args)
 
-    for input_f in glob(args.input):
-        ef_builder.add_documents(input_f, datasetreader.paper_generator(input_f, args.input_format), MIN_YEAR, MAX_YEAR)
+    if args.cache_backend == "sqlite" and args.shards == 1:
+        # Shards are built by other processes, which keep their own counts.
+        logging.info("Annotation cache: %s" % cache.stats())
 
     return 0
 
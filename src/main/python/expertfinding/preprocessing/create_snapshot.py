@@ -0,0 +1,31 @@
+# encoding: utf-8
+'''
+Exports the in-memory index, the corpus statistics and the author completion index of an EF
+database to a snapshot (see expertfinding.snapshot), which web/server.py, benchmark.py and
+latency_benchmark.py load with --snapshot instead of building the indexes at startup.
+
+The snapshot records the version of the database, and is ignored once documents are added to it:
+export it again after each update of the database.
+'''
+
+from argparse import ArgumentParser
+import logging
+import sys
+
+from expertfinding import ExpertFinding
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
+    parser.add_argument("-o", "--output_dir", required=True, action="store", help="Snapshot directory")
+    args = parser.parse_args()
+
+    exf = ExpertFinding(args.storage_db, read_only=True)
+    exf.save_snapshot(args.output_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# encoding: utf-8
+'''
+Converts an EF database built before the entity dictionary was introduced to the current schema of
+the entity occurrences (see expertfinding.schema), in place or into a copy (-o).
+
+When converting into a copy, the size of the two files and the latency of the queries on the entity
+occurrences (the candidates of a query and the profile of an author) are compared.
+'''
+
+from argparse import ArgumentParser
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+import numpy
+
+from expertfinding import DEFAULT_MIN_SCORE, entity_ids_sql, join_entities_sql
+from expertfinding import schema
+
+
+LEGACY_QUERIES = {
+    "candidates": u'''SELECT author_id, entity, COUNT(DISTINCT(document_id))
+        FROM entity_occurrences
+        WHERE entity IN ({}) AND rho > ?
+        GROUP BY author_id, entity''',
+    "profile": u'''SELECT entity, COUNT(DISTINCT(document_id)), GROUP_CONCAT(year), MAX(rho)
+        FROM entity_occurrences
+        WHERE author_id == ? AND rho > ?
+        GROUP BY entity''',
+}
+
+QUERIES = {
+    "candidates": u'''SELECT o.author_id, d.entity, COUNT(DISTINCT(o.document_id))
+        FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+        WHERE o.entity_id IN ({}) AND o.rho > ?
+        GROUP BY o.author_id, o.entity_id''',
+    "profile": u'''SELECT d.entity, COUNT(DISTINCT(o.document_id)), GROUP_CONCAT(o.year), MAX(o.rho)
+        FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+        WHERE o.author_id == ? AND o.rho > ?
+        GROUP BY o.entity_id''',
+}
+
+
+def query_latencies(db, queries, entity_groups, authors, entities_sql):
+    """
+    Returns the median latency in ms of the candidates query for each group of entities and of the
+    profile query for each author.
+    """
+    latencies = {}
+    for name, parameters in [("candidates", entity_groups), ("profile", authors)]:
+        times = []
+        for p in parameters:
+            start_time = time.time()
+            if name == "candidates":
+                db.execute(queries[name].format(entities_sql(p)), (DEFAULT_MIN_SCORE,)).fetchall()
+            else:
+                db.execute(queries[name], (p, DEFAULT_MIN_SCORE)).fetchall()
+            times.append(time.time() - start_time)
+        latencies[name] = numpy.median(times) * 1000
+    return latencies
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
+    parser.add_argument("-o", "--output_db", action="store", help="Convert into this file, leaving the storage DB as it is")
+    parser.add_argument("-n", "--samples", default=200, type=int, action="store", help="Number of queries timed when converting into a copy")
+    args = parser.parse_args()
+
+    db_path = args.storage_db
+    if args.output_db:
+        shutil.copyfile(args.storage_db, args.output_db)
+        db_path = args.output_db
+    db = sqlite3.connect(db_path, isolation_level=None)
+    if not schema.is_legacy(db):
+        logging.info("%s has the current schema already" % db_path)
+        return 0
+
+    db.execute('''BEGIN''')
+    schema.migrate(db)
+    db.execute('''COMMIT''')
+    db.execute('''VACUUM''')
+    logging.info("Size: %.1f MB before, %.1f MB after" % (os.path.getsize(args.storage_db) / 2.0**20, os.path.getsize(db_path) / 2.0**20))
+
+    if args.output_db:
+        legacy_db = sqlite3.connect(args.storage_db)
+        rnd = random.Random(0)
+        entities = [r[0] for r in db.execute('''SELECT entity FROM entity_dictionary''').fetchall()]
+        authors = [r[0] for r in db.execute('''SELECT author_id FROM authors''').fetchall()]
+        entity_groups = [rnd.sample(entities, min(len(entities), rnd.randint(1, 3))) for _ in range(args.samples)]
+        authors = [rnd.choice(authors) for _ in range(args.samples)] if authors else []
+        before = query_latencies(legacy_db, LEGACY_QUERIES, entity_groups, authors, join_entities_sql)
+        after = query_latencies(db, QUERIES, entity_groups, authors, entity_ids_sql)
+        for name in sorted(before):
+            logging.info("Median latency of the %s query: %.2f ms before, %.2f ms after" % (name, before[name], after[name]))
+
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,213 @@
+# encoding: utf-8
+'''
+Generates a synthetic dataset, to test building and querying EF databases of any size without the
+real datasets and TagMe.
+
+Papers are written in one of the datasetreader formats, and the annotations of their abstracts are
+written to the annotation cache read by create_db.py (-c), so that the database can be built
+offline. Entity mentions follow a Zipfian distribution; each author writes mostly about a few
+entities of their own, the number of papers per author is Zipfian too, and the years of the papers
+of an author start from a random year. Topics are made of the entities of an author, and their
+qrels list the authors having all of them among their own entities; the annotations of the topics
+are written as a JSON file for latency_benchmark.py (-a).
+
+Note that the tu format has no names, institutions or years (see datasetreader.paper_generator_tu).
+'''
+
+from argparse import ArgumentParser
+import codecs
+import logging
+import os
+import sys
+
+import numpy
+import unicodecsv as csv
+
+from expertfinding.annotation_cache import DEFAULT_MAX_ENTRIES, SqliteAnnotationCache
+from expertfinding.annotators import Annotation, RecordedAnnotator
+from expertfinding.preprocessing import datasetreader
+from expertfinding.preprocessing.datasetreader import Paper
+
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "ka", "le", "mi", "no", "pu", "ra", "se", "ti", "vo", "za", "bre", "cla", "dro", "fli", "gra"]
+FILLER_WORDS = ["we", "study", "the", "of", "a", "novel", "approach", "to", "in", "and", "for", "results", "show", "with", "based", "on", "analysis", "model", "this", "paper"]
+FIRST_NAMES = ["Anna", "Marco", "Giulia", "Luca", "Sara", "Paolo", "Elena", "Andrea", "Chiara", "Davide", "Laura", "Matteo", "Marta", "Simone", "Irene", "Stefano"]
+ANNOTATIONS_BATCH_SIZE = 10000
+
+
+def word(i):
+    """
+    Returns a distinct pronounceable word for each integer i >= 0.
+    """
+    syllables = []
+    i += len(SYLLABLES)
+    while i:
+        i, s = divmod(i, len(SYLLABLES))
+        syllables.append(SYLLABLES[s])
+    return u"".join(reversed(syllables)).capitalize()
+
+
+class ZipfSampler(object):
+    """
+    Samples integers in [0, n), i with probability proportional to 1 / (i + 1) ** exponent.
+    """
+
+    def __init__(self, n, exponent, rnd):
+        weights = 1.0 / numpy.arange(1, n + 1) ** exponent
+        self.cdf = numpy.cumsum(weights) / weights.sum()
+        self.rnd = rnd
+
+    def sample(self, size=None):
+        return numpy.minimum(numpy.searchsorted(self.cdf, self.rnd.random_sample(size)), len(self.cdf) - 1)
+
+
+class SyntheticDataset(object):
+
+    def __init__(self, papers, authors, entities, institutions=50, min_year=2006, max_year=2017, entity_exponent=1.0,
+                 author_exponent=1.0, author_entities=20, author_share=0.8, mentions=8, seed=0):
+        """
+        Each paper has on average mentions entity mentions, author_share of which are entities of its
+        author (author_entities entities drawn at random for each author).
+        """
+        self.papers = papers
+        self.authors = authors
+        self.entities = entities
+        self.min_year = min_year
+        self.max_year = max_year
+        self.author_share = author_share
+        self.mentions = mentions
+        self.seed = seed
+        self.rnd = numpy.random.RandomState(seed)
+        self.entity_sampler = ZipfSampler(entities, entity_exponent, self.rnd)
+        self.author_entities = self.entity_sampler.sample((authors, author_entities))
+        self.author_institutions = ZipfSampler(institutions, 1.0, self.rnd).sample(authors)
+        self.author_first_years = self.rnd.randint(min_year, max_year + 1, authors)
+        self.author_names = [u"{} {}".format(FIRST_NAMES[self.rnd.randint(len(FIRST_NAMES))], word(i)) for i in range(authors)]
+        # Authors are in random order, not by number of papers.
+        self.paper_authors = self.rnd.permutation(authors)[ZipfSampler(authors, author_exponent, self.rnd).sample(papers)]
+        self.author_papers = numpy.bincount(self.paper_authors, minlength=authors)
+
+    def entity_title(self, entity):
+        return word(entity)
+
+    def author_id(self, author):
+        return u"author-{}".format(author)
+
+    def text(self, entities):
+        """
+        Returns a text mentioning entities, with filler words in between, and its annotations.
+        """
+        words = []
+        annotations = []
+        length = 0
+        for entity in entities:
+            for _ in range(self.rnd.randint(1, 5)):
+                words.append(FILLER_WORDS[self.rnd.randint(len(FILLER_WORDS))])
+                length += len(words[-1]) + 1
+            words.append(self.entity_title(entity))
+            annotations.append(Annotation(words[-1], length, length + len(words[-1]), round(self.rnd.beta(2, 5), 3)))
+            length += len(words[-1]) + 1
+        return u" ".join(words), annotations
+
+    def paper_annotations(self):
+        """
+        Yields the papers with the annotations of their abstracts.
+        """
+        for i, author in enumerate(self.paper_authors):
+            mentions = 1 + self.rnd.poisson(self.mentions - 1)
+            own = self.rnd.random_sample(mentions) < self.author_share
+            entities = numpy.where(own, self.author_entities[author][self.rnd.randint(self.author_entities.shape[1], size=mentions)], self.entity_sampler.sample(mentions))
+            abstract, annotations = self.text(entities)
+            name = self.author_names[author]
+            yield Paper(self.author_id(author), name, u"Institution {}".format(self.author_institutions[author]),
+                        self.rnd.randint(self.author_first_years[author], self.max_year + 1), abstract, u"10.5555/synthetic.{}".format(i)), annotations
+
+    def topics(self, n):
+        """
+        Yields n (topic id, text, annotations, relevant author ids) topics. Topics do not depend on the
+        papers generated.
+        """
+        rnd = numpy.random.RandomState(self.seed + 1)
+        authors = numpy.flatnonzero(self.author_papers)
+        for topic_id in range(n):
+            author = authors[rnd.randint(len(authors))]
+            entities = rnd.permutation(numpy.unique(self.author_entities[author]))[:rnd.randint(1, 4)]
+            relevant = authors[numpy.all([(self.author_entities[authors] == e).any(axis=1) for e in entities], axis=0)]
+            titles = [self.entity_title(e) for e in entities]
+            begins = numpy.cumsum([0] + [len(t) + 1 for t in titles[:-1]])
+            annotations = [Annotation(t, int(b), int(b) + len(t), 1.0) for t, b in zip(titles, begins)]
+            yield str(topic_id), u" ".join(titles), annotations, [self.author_id(a) for a in relevant]
+
+
+def write_papers_tu(papers, path):
+    """
+    Writes the (paper, annotations) pairs of papers to path as they are consumed, yielding them.
+    """
+    with open(path, "wb") as f:
+        w = csv.writer(f, encoding=datasetreader.INPUT_ENCODING_TU)
+        for i, (p, annotations) in enumerate(papers):
+            w.writerow([u"doc-{}".format(i), p.author_id, p.abstract])
+            yield p, annotations
+
+
+def write_papers_unipi(papers, path):
+    with open(path, "wb") as f:
+        w = csv.writer(f, delimiter=';', encoding=datasetreader.INPUT_ENCODING_UNIPI)
+        for p, annotations in papers:
+            row = [u""] * 20
+            row[2], row[1] = p.name.split(u" ", 1)
+            row[0], row[4], row[6], row[11], row[13] = p.author_id, p.institution, p.year, p.doi, p.abstract
+            w.writerow(row)
+            yield p, annotations
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-o", "--output_dir", required=True, action="store", help="Output directory")
+    parser.add_argument("-f", "--output_format", default="unipi", action="store", help="Format of the papers file", choices=datasetreader.SUPPORTED_FORMATS)
+    parser.add_argument("-n", "--papers", default=100000, type=int, action="store", help="Number of papers")
+    parser.add_argument("-a", "--authors", default=10000, type=int, action="store", help="Number of authors")
+    parser.add_argument("-e", "--entities", default=50000, type=int, action="store", help="Number of entities")
+    parser.add_argument("-q", "--topics", default=100, type=int, action="store", help="Number of topics")
+    parser.add_argument("--institutions", default=50, type=int, action="store", help="Number of institutions")
+    parser.add_argument("--entity_exponent", default=1.0, type=float, action="store", help="Exponent of the Zipfian distribution of entities")
+    parser.add_argument("--author_exponent", default=1.0, type=float, action="store", help="Exponent of the Zipfian distribution of papers per author")
+    parser.add_argument("--seed", default=0, type=int, action="store", help="Random seed")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    dataset = SyntheticDataset(args.papers, args.authors, args.entities, args.institutions, entity_exponent=args.entity_exponent,
+                               author_exponent=args.author_exponent, seed=args.seed)
+
+    papers_path = os.path.join(args.output_dir, "papers.csv")
+    cache_dir = os.path.join(args.output_dir, "cache")
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cache = SqliteAnnotationCache(os.path.join(cache_dir, "annotations.db"), max(args.papers, DEFAULT_MAX_ENTRIES))
+    write_papers = write_papers_tu if args.output_format == "tu" else write_papers_unipi
+    batch = []
+    for p, annotations in write_papers(dataset.paper_annotations(), papers_path):
+        batch.append((p.abstract, annotations))
+        if len(batch) == ANNOTATIONS_BATCH_SIZE:
+            cache.put_many(batch)
+            batch = []
+    cache.put_many(batch)
+    logging.info("%d papers of %d authors written to %s" % (args.papers, numpy.count_nonzero(dataset.author_papers), papers_path))
+
+    recorded = RecordedAnnotator()
+    with codecs.open(os.path.join(args.output_dir, "topics.tsv"), "w", encoding="utf-8") as topics_f, \
+         codecs.open(os.path.join(args.output_dir, "synthetic.qrel"), "w", encoding="utf-8") as qrels_f:
+        for topic_id, text, topic_annotations, relevant in dataset.topics(args.topics):
+            topics_f.write(u"{}\t{}\n".format(topic_id, text))
+            for author_id in relevant:
+                qrels_f.write(u"topic-{}\t0\t{}\t1\n".format(topic_id, author_id))
+            recorded.annotations[text] = topic_annotations
+    recorded.save(os.path.join(args.output_dir, "topic_annotations.json"))
+
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
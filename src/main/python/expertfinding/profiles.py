@@ -0,0 +1,88 @@
+'''
+Materialized author profiles.
+
+The profile of an author has, for each entity the author cites, the number of papers citing it, the
+maximum rho of its occurrences, its EF-IAF and the histogram of the years of its occurrences. They
+are persisted by ExpertFindingBuilder once the corpus statistics are known, together with the norm
+used by cossim_efiaf_score, so that scoring and rendering an author only have to read them.
+'''
+
+from collections import Counter
+from itertools import groupby
+from math import log, sqrt
+from operator import itemgetter
+import sqlite3
+
+
+def create_tables(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS author_profiles
+         (author_id, entity, author_freq, max_rho, efiaf, years, PRIMARY KEY (author_id, entity)) WITHOUT ROWID''')
+    db.execute('''CREATE TABLE IF NOT EXISTS author_norms
+         (author_id PRIMARY KEY, efiaf_norm)''')
+    # Pages of a profile, most cited entities first (see ExpertFinding.author_entity_frequency_page).
+    db.execute('''CREATE INDEX IF NOT EXISTS author_profiles_frequency_index ON author_profiles (author_id, author_freq DESC, entity)''')
+
+
+def encode_years(years):
+    """
+    Encodes the histogram of a list of years as "year:count,...", sorted by year.
+    """
+    return u",".join(u"{}:{}".format(y, c) for y, c in sorted(Counter(years).items()))
+
+
+def decode_years(histogram):
+    """
+    Returns the list of (year, count) pairs of a histogram encoded with encode_years.
+    """
+    return [tuple(int(v) for v in item.split(":")) for item in histogram.split(",")] if histogram else []
+
+
+def invalidate(db):
+    """
+    Marks the persisted profiles as stale. Until update is called, ExpertFinding computes them from
+    the base tables.
+    """
+    db.execute('''DELETE FROM author_profiles''')
+    db.execute('''DELETE FROM author_norms''')
+
+
+def _cursor(db):
+    """
+    Returns a new cursor of the connection of db (a connection or a cursor), to write while db is
+    still being read.
+    """
+    return db.cursor() if isinstance(db, sqlite3.Connection) else db.connection.cursor()
+
+
+def update(db, statistics, min_score):
+    """
+    Recomputes the persisted profiles from the base tables, counting only entity occurrences with
+    rho > min_score. EF-IAF depends on the whole corpus, so all profiles are rewritten. Profiles are
+    written as they are read, so memory does not grow with their number.
+    """
+    invalidate(db)
+    writer = _cursor(db)
+
+    def profile_rows():
+        for author_id, entity, author_freq, max_rho, years in db.execute('''
+                SELECT o.author_id, d.entity, COUNT(DISTINCT(o.document_id)), MAX(o.rho), GROUP_CONCAT(o.year)
+                FROM entity_occurrences AS o JOIN entity_dictionary AS d USING (entity_id)
+                WHERE o.rho > ?
+                GROUP BY o.author_id, o.entity_id
+                ORDER BY o.author_id, d.entity''', (min_score,)):
+            efiaf = author_freq / float(statistics.author_papers[author_id]) \
+                * log(statistics.total_papers / float(statistics.entity_popularity[entity]))
+            yield author_id, entity, author_freq, max_rho, efiaf, encode_years(int(y) for y in years.split(","))
+
+    writer.executemany('''INSERT INTO author_profiles VALUES (?,?,?,?,?,?)''', profile_rows())
+    # The EF-IAF of each author is summed in the same order as the entities of the profile.
+    writer.executemany('''INSERT INTO author_norms VALUES (?,?)''', (
+        (author_id, sqrt(sum(efiaf for _, efiaf in rows)))
+        for author_id, rows in groupby(db.execute('''SELECT author_id, efiaf FROM author_profiles ORDER BY author_id, entity'''), itemgetter(0))))
+
+
+def has_profiles(db):
+    tables = set(r[0] for r in db.execute('''SELECT name FROM sqlite_master WHERE type='table' ''').fetchall())
+    if not tables.issuperset(["author_profiles", "author_norms"]):
+        return False
+    return db.execute('''SELECT COUNT(*) FROM author_norms''').fetchall()[0][0] > 0
@@ -0,0 +1,88 @@
+'''
+Sampling profiler, to find out where a query spends its time without the overhead of a
+deterministic profiler (cProfile).
+
+While active, a background thread samples the stack of the other threads every interval seconds.
+The samples are reported as collapsed stacks ("outer;...;inner count" lines), the input of
+flamegraph.pl and similar tools. Each frame is named after its function and the line it starts at,
+so that the samples of a function add up.
+'''
+
+from collections import Counter
+import os
+import sys
+import thread
+import threading
+import time
+
+
+DEFAULT_INTERVAL = 0.001
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, interval=DEFAULT_INTERVAL, thread_ids=None):
+        """
+        Samples the threads in thread_ids, or all threads but the sampling one if None.
+        """
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = thread.get_ident()
+        while self._running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """
+        Returns the sampled stacks in the collapsed format, most sampled first.
+        """
+        return "".join("{} {}\n".format(";".join(stack), count) for stack, count in self.stacks.most_common())
+
+    def functions(self, limit=20):
+        """
+        Returns the (function, samples) pairs of the limit functions found the most often in the
+        sampled stacks (including the time spent in the functions they call).
+        """
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack):
+                functions[function] += count
+        return functions.most_common(limit)
@@ -0,0 +1,121 @@
+'''
+Cache of query results, in front of ExpertFinding.find_expert_multi.
+
+The entities found in a query and the ranking computed by each scoring function are cached
+separately, so that a scoring function not asked for before reuses the cached query entities.
+Queries are normalized (case and whitespace) before looking them up. Rankings are keyed by the
+version of the database too, so they are not used anymore once ExpertFindingBuilder changes it; the
+statistics and indexes of ExpertFinding are refreshed first, so that the rankings computed for the
+new version are not computed from those of the old one.
+Both caches hold at most max_entries items, evicting the least recently used ones, and drop items
+older than ttl seconds.
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 24 * 3600
+
+
+def normalize_query(query):
+    return u" ".join(query.lower().split())
+
+
+class LRUCache(object):
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value cached for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or (self.ttl is not None and time.time() - item[0] > self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items[key] = item
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time(), value)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._items), "max_entries": self.max_entries}
+
+
+class QueryCache(object):
+
+    def __init__(self, ef, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.ef = ef
+        self.query_entities = LRUCache(max_entries, ttl)
+        self.rankings = LRUCache(max_entries, ttl)
+
+    def find_expert_multi(self, query, scorings, batch=True, top_k=None):
+        """
+        Same as ExpertFinding.find_expert_multi, computing only the rankings that are not cached.
+        The timings of cached rankings and annotations are 0. Missing results (None, see
+        expertfinding.pipeline) are not cached.
+        """
+        normalized_query = normalize_query(query)
+        self.ef.refresh()
+        version = self.ef.version()
+        query_entities = self.query_entities.get(normalized_query)
+        timings = {"annotation": 0.0, "candidates": 0.0}
+        if query_entities is None:
+            start_time = time.time()
+            query_entities = self.ef.query_entities(query)
+            timings["annotation"] = time.time() - start_time
+            if query_entities is None:
+                return [None] * len(scorings), timings, None
+            self.query_entities.put(normalized_query, query_entities)
+
+        keys = [(normalized_query, getattr(scoring, "__name__", str(scoring)), batch, top_k, version) for scoring in scorings]
+        rankings = [self.rankings.get(key) for key in keys]
+        missing = [scoring for scoring, ranking in zip(scorings, rankings) if ranking is None]
+        if missing:
+            missing_rankings, missing_timings, _ = self.ef.find_expert_multi(query, missing, batch, top_k, query_entities)
+            missing_timings.pop("annotation")
+            timings.update(missing_timings)
+            missing_rankings = iter(missing_rankings)
+            for i, key in enumerate(keys):
+                if rankings[i] is None:
+                    rankings[i] = next(missing_rankings)
+                    if rankings[i] is not None:
+                        self.rankings.put(key, rankings[i])
+        for key in keys:
+            timings.setdefault(key[1], 0.0)
+        return rankings, timings, query_entities
+
+    def find_expert(self, query, scoring, batch=True, top_k=None):
+        """
+        Same as ExpertFinding.find_expert.
+        """
+        start_time = time.time()
+        (results,), _, query_entities = self.find_expert_multi(query, [scoring], batch, top_k)
+        return results, time.time() - start_time, query_entities
+
+    def stats(self):
+        return {"query_entities": self.query_entities.stats(), "rankings": self.rankings.stats()}
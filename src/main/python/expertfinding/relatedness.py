@@ -0,0 +1,208 @@
+'''
+Persistent store of the semantic relatedness between pairs of entities.
+
+Entity titles are interned as integers, and each pair is stored once, keyed by the two ids (smaller
+first), in an SQLite file. An in-process LRU cache holds the most recently used pairs. Missing pairs
+are fetched from TagMe (or from any function with the same interface) in a single batch.
+'''
+
+import ast
+from collections import OrderedDict
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy
+import tagme
+
+from expertfinding import metrics
+
+
+DEFAULT_HOT_SIZE = 1000000
+
+REL_API = tagme.DEFAULT_REL_API
+
+
+def tagme_relatedness(title_pairs):
+    """
+    Returns the relatedness of each pair of titles, in the same order.
+    """
+    start_time = time.time()
+    response = tagme.relatedness_title(title_pairs, api=REL_API)
+    metrics.TAGME_SECONDS.observe(time.time() - start_time, ("rel",))
+    if response is None:
+        metrics.TAGME_ERRORS.inc(labels=("rel",))
+        raise IOError("TagMe could not compute relatedness")
+    return [rel for _, rel in response]
+
+
+class RelatednessStore(object):
+
+    def __init__(self, path=None, fetch=tagme_relatedness, hot_size=DEFAULT_HOT_SIZE):
+        """
+        Opens the store in path (in memory if None). Missing pairs are computed by fetch, which takes
+        a list of pairs of titles and returns their relatedness in the same order.
+        """
+        self.fetch = fetch
+        self.hot_size = hot_size
+        self.hits = 0
+        self.misses = 0
+        self._hot = OrderedDict()
+        self._lock = threading.RLock()
+        self.path = path
+        self._pid = None
+        self._import_sqlitedict()
+
+    @property
+    def db(self):
+        return self._connection()
+
+    def _connection(self):
+        """
+        Returns the connection to the store, shared by all threads (which hold self._lock while using
+        it) and opened again after a fork. Processes share the pairs stored in a file; an in-memory
+        store starts empty in a forked process.
+        """
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path or ":memory:", timeout=60, check_same_thread=False)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS relatedness_titles
+                (title_id INTEGER PRIMARY KEY, title TEXT UNIQUE)''')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS relatedness
+                (title_id_1 INTEGER, title_id_2 INTEGER, rel REAL, PRIMARY KEY (title_id_1, title_id_2)) WITHOUT ROWID''')
+            self._db.execute('''CREATE TEMP TABLE requested_pairs (title_id_1 INTEGER, title_id_2 INTEGER)''')
+            self._db.commit()
+            if self._pid is not None and self.path is None:
+                # Title ids are local to an in-memory store, so the cached pairs are meaningless now.
+                self._hot.clear()
+            self._title_ids = dict((t, i) for i, t in self._db.execute('''SELECT title_id, title FROM relatedness_titles'''))
+            self._pid = os.getpid()
+        return self._db
+
+    def _import_sqlitedict(self):
+        """
+        Imports the pairs of a relatedness file written with SqliteDict, as used by earlier versions.
+        """
+        tables = set(r[0] for r in self.db.execute('''SELECT name FROM sqlite_master WHERE type='table' '''))
+        if "unnamed" not in tables or self.db.execute('''SELECT COUNT(*) FROM relatedness''').fetchone()[0] > 0:
+            return
+        from sqlitedict import decode
+        pairs = []
+        for key, value in self.db.execute('''SELECT key, value FROM unnamed'''):
+            t1, t2 = ast.literal_eval(key.encode("utf-8") if isinstance(key, unicode) else key)
+            pairs.append(((t1, t2), decode(value)))
+        self._store(pairs)
+        logging.info("Imported %d relatedness pairs from SqliteDict" % len(pairs))
+
+    def _title_id(self, title):
+        title_id = self._title_ids.get(title)
+        if title_id is None:
+            # Another process sharing the store may have added the title already.
+            self.db.execute('''INSERT OR IGNORE INTO relatedness_titles (title) VALUES (?)''', (title,))
+            title_id = self.db.execute('''SELECT title_id FROM relatedness_titles WHERE title=?''', (title,)).fetchone()[0]
+            self._title_ids[title] = title_id
+        return title_id
+
+    def _key(self, t1, t2):
+        """
+        Returns the key of a pair of titles, or None if one of them was never stored.
+        """
+        i1, i2 = self._title_ids.get(t1), self._title_ids.get(t2)
+        if i1 is None or i2 is None:
+            return None
+        return (i1, i2) if i1 <= i2 else (i2, i1)
+
+    def _cache(self, key, rel):
+        self._hot[key] = rel
+        if len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def _store(self, pairs):
+        rows = []
+        for (t1, t2), rel in pairs:
+            i1, i2 = sorted((self._title_id(t1), self._title_id(t2)))
+            rows.append((i1, i2, rel if rel is not None else 0.0))
+            self._cache((i1, i2), rows[-1][2])
+        self.db.executemany('''INSERT OR REPLACE INTO relatedness VALUES (?,?,?)''', rows)
+        self.db.commit()
+
+    def prefetch(self, pairs):
+        """
+        Makes sure the relatedness of all pairs of titles is in the in-process cache, reading the
+        missing ones from the store in one query and fetching the rest in one batch.
+        """
+        with self._lock:
+            self._connection()
+            missing = set()
+            for t1, t2 in pairs:
+                key = self._key(t1, t2)
+                if key is None or key not in self._hot:
+                    missing.add((t1, t2) if t1 <= t2 else (t2, t1))
+            if not missing:
+                return
+            self.db.execute('''DELETE FROM requested_pairs''')
+            self.db.executemany('''INSERT INTO requested_pairs VALUES (?,?)''', filter(None, (self._key(*p) for p in missing)))
+            found = set()
+            for i1, i2, rel in self.db.execute('''
+                    SELECT r.title_id_1, r.title_id_2, r.rel
+                    FROM requested_pairs AS p, relatedness AS r
+                    WHERE r.title_id_1 = p.title_id_1 AND r.title_id_2 = p.title_id_2''').fetchall():
+                self._cache((i1, i2), rel)
+                found.add((i1, i2))
+            # End the read transaction, so that other processes sharing the store can write meanwhile.
+            self.db.commit()
+            # Pairs found in the store may have left the cache already, if there are more than it holds.
+            to_fetch = [p for p in missing if self._key(*p) not in found]
+            self.misses += len(to_fetch)
+            if to_fetch:
+                logging.debug("Fetching relatedness of %d pairs" % len(to_fetch))
+                self._store(zip(to_fetch, self.fetch(to_fetch)))
+
+    def relatedness(self, t1, t2):
+        with self._lock:
+            self._connection()
+            key = self._key(t1, t2)
+            if key is not None and key in self._hot:
+                self.hits += 1
+                rel = self._hot.pop(key)
+                self._hot[key] = rel
+                return rel
+            self.prefetch([(t1, t2)])
+            return self._hot[self._key(t1, t2)]
+
+    def matrix(self, titles_1, titles_2):
+        """
+        Returns the matrix of the relatedness between each title in titles_1 (rows) and each title
+        in titles_2 (columns), filled from the in-process cache once the missing pairs are fetched.
+        So that filling large matrices stays cheap, the recency of the cached pairs is only updated
+        once the cache is full.
+        """
+        matrix = numpy.zeros((len(titles_1), len(titles_2)))
+        if matrix.size == 0:
+            return matrix
+        with self._lock:
+            self.prefetch([(t1, t2) for t1 in titles_1 for t2 in titles_2])
+            hot = self._hot
+            touch = len(hot) >= self.hot_size
+            ids_2 = [self._title_ids[t2] for t2 in titles_2]
+            hits = 0
+            for i, t1 in enumerate(titles_1):
+                i1 = self._title_ids[t1]
+                row = matrix[i]
+                for j, i2 in enumerate(ids_2):
+                    key = (i1, i2) if i1 <= i2 else (i2, i1)
+                    rel = hot.pop(key, None) if touch else hot.get(key)
+                    if rel is None:
+                        # Evicted by the pairs prefetched after it, when the matrix does not fit the cache.
+                        row[j] = self.relatedness(t1, titles_2[j])
+                        continue
+                    if touch:
+                        hot[key] = rel
+                    hits += 1
+                    row[j] = rel
+            self.hits += hits
+        return matrix
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hot_pairs": len(self._hot)}
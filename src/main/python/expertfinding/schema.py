@@ -0,0 +1,60 @@
+'''
+Schema of the entity occurrences.
+
+Entity titles are interned in entity_dictionary, and each occurrence refers to its entity by id.
+Occurrences are stored WITHOUT ROWID, clustered by author, entity and document, so that the profile
+of an author is a contiguous range of the table; a secondary index on (entity_id, rho), which also
+holds the primary key columns, covers the lookup of the authors citing an entity.
+Databases built before the dictionary was introduced are converted by migrate (see
+expertfinding/preprocessing/migrate_db.py).
+'''
+
+import logging
+import time
+
+
+def create_tables(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS entity_dictionary
+         (entity_id INTEGER PRIMARY KEY, entity TEXT UNIQUE)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS entity_occurrences
+         (author_id, entity_id INTEGER, document_id INTEGER, mention INTEGER, year INTEGER, rho REAL,
+         PRIMARY KEY (author_id, entity_id, document_id, mention),
+         FOREIGN KEY(author_id) REFERENCES authors(author_id)) WITHOUT ROWID''')
+
+
+def create_indexes(db):
+    db.execute('''CREATE INDEX IF NOT EXISTS entity_occurrences_entity_index ON entity_occurrences (entity_id, rho)''')
+
+
+def is_legacy(db):
+    """
+    Whether the entity occurrences of the database hold the entity titles (schema before
+    entity_dictionary).
+    """
+    columns = [r[1] for r in db.execute('''PRAGMA table_info(entity_occurrences)''').fetchall()]
+    return "entity" in columns
+
+
+def migrate(db):
+    """
+    Converts the entity occurrences of a legacy database to the current schema. The mention of each
+    migrated occurrence is its former rowid. The caller runs it in a transaction (see migrate_db.py),
+    so that an interrupted migration leaves the database as it was.
+    """
+    start_time = time.time()
+    db.execute('''DROP INDEX IF EXISTS entities_author_id_index''')
+    db.execute('''DROP INDEX IF EXISTS entity_occurrences_entity_index''')
+    db.execute('''ALTER TABLE entity_occurrences RENAME TO legacy_entity_occurrences''')
+    create_tables(db)
+    db.execute('''INSERT INTO entity_dictionary (entity)
+        SELECT DISTINCT(entity) FROM legacy_entity_occurrences ORDER BY entity''')
+    db.execute('''INSERT INTO entity_occurrences
+        SELECT o.author_id, d.entity_id, o.document_id, o.rowid, o.year, o.rho
+        FROM legacy_entity_occurrences AS o JOIN entity_dictionary AS d ON d.entity IS o.entity
+        ORDER BY o.author_id, d.entity_id, o.document_id, o.rowid''')
+    db.execute('''DROP TABLE legacy_entity_occurrences''')
+    create_indexes(db)
+    logging.info("Migrated %d entity occurrences of %d entities in %.1f sec" % (
+        db.execute('''SELECT COUNT(*) FROM entity_occurrences''').fetchone()[0],
+        db.execute('''SELECT COUNT(*) FROM entity_dictionary''').fetchone()[0],
+        time.time() - start_time))
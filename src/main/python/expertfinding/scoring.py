@@ -0,0 +1,50 @@
+'''
+Batch implementations of the EF-IAF family of scoring functions.
+
+Each function takes the matrix of entity counts of the candidate authors (one row per author, one
+column per query entity), the number of papers of each author and the IAF of each query entity, and
+returns the matrix of the contributions of each entity to the score of each author. The score of an
+author is the sum of its row, computed with sum_columns. Contributions are never negative.
+
+relatedness_geom_scores is the batch implementation of ExpertFinding.relatedness_geom, which scores
+authors by the relatedness between the query entities and all the entities they cite.
+'''
+
+import numpy
+
+
+def sum_columns(matrix):
+    """
+    Sums the columns of a matrix left to right, so that each row is added up in the same order a
+    scalar loop over the columns would.
+    """
+    total = numpy.zeros(matrix.shape[0])
+    for column in matrix.T:
+        total += column
+    return total
+
+
+def efiaf_contributions(ec, papers, iaf):
+    return ec / papers[:, None] * iaf
+
+
+def eciaf_contributions(ec, papers, iaf):
+    return ec * iaf
+
+
+def log_ec_ef_iaf_contributions(ec, papers, iaf):
+    with numpy.errstate(divide="ignore"):
+        log_ec = numpy.where(ec > 0, numpy.log(ec), 0.0)
+    return numpy.where(ec > 0, (log_ec + ec / papers[:, None]) * iaf, 0.0)
+
+
+def relatedness_geom_scores(relatedness, weights, offsets, alpha=10.0**-5, x=10.0):
+    """
+    Returns the relatedness_geom score of each author. relatedness has one row per query entity and
+    one column per entity cited by each author, the columns of each author being contiguous and
+    starting at the positions in offsets; weights has the weight of each column.
+    The weighted geometric means of all authors and query entities are computed at once in log space.
+    """
+    log_values = numpy.log(1.0 - relatedness ** x + alpha) * weights
+    geom_means = numpy.exp(numpy.add.reduceat(log_values, offsets, axis=1) / numpy.add.reduceat(weights, offsets))
+    return numpy.mean(numpy.clip(1 - geom_means + alpha, 0.0, 1.0) ** (1.0/x), axis=0)
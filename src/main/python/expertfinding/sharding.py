@@ -0,0 +1,213 @@
+'''
+Sharded EF databases, to build and query large corpora on several cores.
+
+Authors are partitioned in n shards by the CRC-32 of their id, and each shard is a complete EF
+database (e.g. tu-0-of-4.db for tu.db) holding the authors of the partition with their documents
+and entity occurrences; documents have a single author, so none is split across shards. Shard i
+numbers its documents i, i + n, i + 2n, ..., so that document ids are unique across shards.
+
+IAF depends on the whole corpus: once the shards are built, merge_statistics replaces the number of
+papers and the entity popularity of each shard with those of all shards and recomputes the author
+profiles, so that each shard scores its authors exactly as the unsharded database would.
+
+ShardedExpertFinding answers queries with a process per shard: the query is annotated once, its
+entities are sent to all shards, which retrieve and score their candidates in parallel, and the
+rankings of the shards (their top k, if top_k is set) are merged.
+'''
+
+from collections import Counter, Mapping
+from itertools import chain
+import heapq
+import logging
+from multiprocessing import Pool
+import os
+import sqlite3
+import time
+import zlib
+
+import expertfinding
+from expertfinding import profiles
+from expertfinding import statistics
+from expertfinding.statistics import CorpusStatistics
+
+
+def shard_of(author_id, shards):
+    """
+    Returns the shard (in [0, shards)) of an author.
+    """
+    return (zlib.crc32(unicode(author_id).encode("utf-8")) & 0xffffffff) % shards
+
+
+def shard_paths(storage_db, shards):
+    """
+    Returns the paths of the shards of storage_db.
+    """
+    base, extension = os.path.splitext(storage_db)
+    return ["{}-{}-of-{}{}".format(base, i, shards, extension) for i in range(shards)]
+
+
+def _local_statistics(path):
+    db = sqlite3.connect(path)
+    statistics.update(db)
+    db.commit()
+    local = CorpusStatistics.load(db)
+    db.close()
+    return local.total_papers, local.entity_popularity
+
+
+def _replace_statistics(data):
+    path, total_papers, entity_popularity, min_score = data
+    db = sqlite3.connect(path)
+    statistics.replace(db, total_papers, entity_popularity)
+    profiles.update(db, CorpusStatistics.load(db), min_score)
+    statistics.bump_version(db)
+    db.commit()
+    db.close()
+
+
+def merge_statistics(paths, min_score, map_function=map):
+    """
+    Makes the corpus statistics and the author profiles of the shards in paths those of all shards.
+    Local statistics are recomputed first, so merging twice is harmless. The shards are updated with
+    map_function (e.g. Pool.map, to update them in parallel).
+    """
+    start_time = time.time()
+    total_papers = 0
+    entity_popularity = Counter()
+    for shard_papers, shard_popularity in map_function(_local_statistics, paths):
+        total_papers += shard_papers
+        entity_popularity.update(shard_popularity)
+    map_function(_replace_statistics, [(path, total_papers, entity_popularity, min_score) for path in paths])
+    logging.info("Statistics of %d shards merged in %.1f sec" % (len(paths), time.time() - start_time))
+
+
+class ShardedAuthorPapers(Mapping):
+    """
+    Read-only dictionary of the number of papers of the authors of all shards, each looked up in the
+    statistics of its shard.
+    """
+
+    def __init__(self, shards):
+        self._shards = shards
+
+    def __getitem__(self, author_id):
+        return self._shards[shard_of(author_id, len(self._shards))].statistics.author_papers[author_id]
+
+    def __iter__(self):
+        return chain.from_iterable(shard.statistics.author_papers for shard in self._shards)
+
+    def __len__(self):
+        return sum(len(shard.statistics.author_papers) for shard in self._shards)
+
+
+# ExpertFinding of the shard served by the current worker process of a ShardedExpertFinding.
+_shard = None
+
+
+def _open_shard(path, relatedness_dict_file, in_memory_index, relatedness_fetch):
+    global _shard
+    _shard = expertfinding.ExpertFinding(path, relatedness_dict_file=relatedness_dict_file, in_memory_index=in_memory_index, read_only=True)
+    if relatedness_fetch is not None:
+        _shard.relatedness_store.fetch = relatedness_fetch
+
+
+def _scoring_key(scoring):
+    # Methods of ExpertFinding cannot be pickled, so they are sent to the shards by name.
+    return scoring.__name__ if hasattr(scoring, "im_func") else scoring
+
+
+def _scoring(key):
+    return getattr(expertfinding.ExpertFinding, key) if isinstance(key, basestring) else key
+
+
+def _find_expert_multi(data):
+    query, scoring_keys, batch, top_k, query_entities = data
+    rankings, timings, _ = _shard.find_expert_multi(query, [_scoring(k) for k in scoring_keys], batch, top_k, query_entities)
+    return rankings, timings
+
+
+class ShardedExpertFinding(object):
+
+    def __init__(self, storage_db, shards, relatedness_dict_file=None, in_memory_index=False, relatedness_fetch=None):
+        """
+        Opens the shards of storage_db, starting a worker process for each. Missing relatedness is
+        computed by relatedness_fetch, if given (see RelatednessStore).
+        """
+        self.paths = shard_paths(storage_db, shards)
+        for path in self.paths:
+            if not os.path.isfile(path):
+                raise IOError("Shard {} not found".format(path))
+        self.shards = [expertfinding.ExpertFinding(path, relatedness_dict_file=relatedness_dict_file, read_only=True) for path in self.paths]
+        self.pools = [Pool(1, initializer=_open_shard, initargs=(path, relatedness_dict_file, in_memory_index, relatedness_fetch))
+                      for path in self.paths]
+
+    def close(self):
+        for pool in self.pools:
+            pool.terminate()
+            pool.join()
+
+    def shard(self, author_id):
+        """
+        Returns the ExpertFinding of the shard of an author, for the queries about the author.
+        """
+        return self.shards[shard_of(author_id, len(self.shards))]
+
+    @property
+    def statistics(self):
+        """
+        The statistics of all shards. The number of papers and the entity popularity, merged by
+        merge_statistics, are the same in all shards, while each shard knows its authors only.
+        """
+        merged = self.shards[0].statistics
+        return CorpusStatistics(merged.total_papers, merged.entity_popularity, ShardedAuthorPapers(self.shards))
+
+    def author_entity_frequency(self, author_id):
+        return self.shard(author_id).author_entity_frequency(author_id)
+
+    def ef_iaf_author(self, author_id):
+        return self.shard(author_id).ef_iaf_author(author_id)
+
+    def author_entity_frequency_page(self, author_id, limit=None, after=None):
+        return self.shard(author_id).author_entity_frequency_page(author_id, limit, after)
+
+    def documents(self, author_id, entities, limit=None, after=None):
+        return self.shard(author_id).documents(author_id, entities, limit, after)
+
+    def find_expert_multi(self, query, scorings, batch=True, top_k=None, query_entities=None):
+        """
+        Same as ExpertFinding.find_expert_multi, scoring the shards in parallel. The timings of each
+        stage are those of the slowest shard, plus the time spent merging the rankings ("merge").
+        Authors with the same score are ranked by id, as in ExpertFinding.
+        """
+        timings = {}
+        start_time = time.time()
+        if query_entities is None:
+            query_entities = self.shards[0].query_entities(query)
+        timings["annotation"] = time.time() - start_time
+
+        scoring_keys = [_scoring_key(scoring) for scoring in scorings]
+        pending = [pool.apply_async(_find_expert_multi, ((query, scoring_keys, batch, top_k, query_entities),)) for pool in self.pools]
+        shard_results = [p.get() for p in pending]
+
+        start_time = time.time()
+        rankings = []
+        for i in range(len(scorings)):
+            results = sorted(chain.from_iterable(shard_rankings[i] for shard_rankings, _ in shard_results), key=lambda t: t["author_id"])
+            if top_k is not None:
+                rankings.append(heapq.nlargest(top_k, results, key=lambda t: t["score"]))
+            else:
+                rankings.append(sorted(results, key=lambda t: t["score"], reverse=True))
+        for _, shard_timings in shard_results:
+            for name, value in shard_timings.iteritems():
+                if name != "annotation":
+                    timings[name] = max(timings.get(name, 0.0), value)
+        timings["merge"] = time.time() - start_time
+        return rankings, timings, query_entities
+
+    def find_expert(self, query, scoring, batch=True, top_k=None):
+        """
+        Same as ExpertFinding.find_expert.
+        """
+        start_time = time.time()
+        (results,), _, query_entities = self.find_expert_multi(query, [scoring], batch, top_k)
+        return results, time.time() - start_time, query_entities
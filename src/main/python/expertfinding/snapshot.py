@@ -0,0 +1,230 @@
+'''
+Binary snapshot of the in-memory indexes, so that a server can start without building them.
+
+A snapshot is a directory holding the arrays of the inverted index (expertfinding.index), of the
+author completion index (expertfinding.completion) and the corpus statistics, one .npy file each,
+and a manifest (manifest.json) with the format version, the version of the database it was exported
+from and the scalar statistics. Strings (entity titles, author ids, names and institutions) are
+stored as string tables: their UTF-8 encodings concatenated in a .bin file, the offset of each
+string and a mask of the None values.
+
+Loading memory-maps all files read-only instead of reading them, so it takes milliseconds whatever
+the size of the corpus, pages are read from disk only when a query touches them, and the processes
+serving the same snapshot share them through the page cache. Strings are decoded when accessed, and
+sorted string tables are searched by bisection instead of being loaded in dictionaries.
+'''
+
+from bisect import bisect_left
+from collections import Mapping
+import json
+import mmap
+import os
+
+import numpy
+
+from expertfinding.completion import AuthorCompletionIndex
+from expertfinding.index import InvertedIndex
+from expertfinding.statistics import CorpusStatistics
+
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+def _save_array(path, name, a):
+    numpy.save(os.path.join(path, name + ".npy"), a)
+
+
+def _load_array(path, name):
+    try:
+        # A plain ndarray view of the memory map, which is faster to index than a numpy.memmap.
+        return numpy.asarray(numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+    except ValueError:
+        # Empty arrays cannot be memory-mapped.
+        return numpy.load(os.path.join(path, name + ".npy"))
+
+
+class StringTable(object):
+    """
+    Read-only sequence of unicode strings (or None) stored in a string table.
+    """
+
+    def __init__(self, data, offsets, nulls):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def take(self, indexes):
+        """
+        Returns the strings at some indexes (a NumPy array), as a list. They are decoded at once,
+        which is faster than one by one.
+        """
+        if not len(indexes):
+            return []
+        data = self.data
+        encoded = b"\0".join([data[begin:end] for begin, end in zip(self.offsets[indexes].tolist(), self.offsets[indexes + 1].tolist())])
+        strings = encoded.decode("utf-8").split(u"\0")
+        if len(strings) != len(indexes):
+            # Some string contains the separator.
+            return [self[i] for i in indexes]
+        nulls = self.nulls[indexes]
+        if nulls.any():
+            for i in numpy.flatnonzero(nulls):
+                strings[i] = None
+        return strings
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.nbytes + self.nulls.nbytes
+
+    @staticmethod
+    def save(path, name, strings):
+        encoded = [s.encode("utf-8") if s is not None else b"" for s in strings]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(s) for s in encoded], out=offsets[1:])
+        with open(os.path.join(path, name + ".bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        _save_array(path, name + ".offsets", offsets)
+        _save_array(path, name + ".nulls", numpy.array([s is None for s in strings], dtype=numpy.bool_))
+
+    @classmethod
+    def load(cls, path, name):
+        with open(os.path.join(path, name + ".bin"), "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        return cls(data, _load_array(path, name + ".offsets"), _load_array(path, name + ".nulls"))
+
+
+class SortedMapping(Mapping):
+    """
+    Read-only dictionary from the strings of a sorted string table to the values of an array. The
+    keys looked up are remembered, as scoring functions look up the same entities and authors over
+    and over.
+    """
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+        self._found = {}
+
+    def __getitem__(self, key):
+        value = self._found.get(key)
+        if value is None:
+            i = bisect_left(self._keys, key)
+            value = self._values[i].item() if i < len(self._keys) and self._keys[i] == key else KeyError
+            self._found[key] = value
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class CompletionAuthors(object):
+    """
+    The (author_id, name, institution) of the authors of the completion index, stored as the
+    positions (in the order of the completion index) of the authors of the inverted index.
+    """
+
+    def __init__(self, order, author_ids, author_names, author_institutions):
+        self.order = order
+        self.author_ids = author_ids
+        self.author_names = author_names
+        self.author_institutions = author_institutions
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        j = self.order[i]
+        return self.author_ids[j], self.author_names[j], self.author_institutions[j]
+
+
+def save(path, index, completion_index, version, min_score):
+    """
+    Writes a snapshot of the inverted index, built with min_score from the database at version, and
+    of the completion index of the same database. The manifest is written last, so that an
+    interrupted export leaves no valid snapshot.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+    author_index = dict((a, i) for i, a in enumerate(index.author_ids))
+    author_institutions = [None] * len(index.author_ids)
+    for author_id, _, institution in completion_index.authors:
+        author_institutions[author_index[author_id]] = institution
+
+    for name in ("entities", "author_ids", "author_names"):
+        StringTable.save(path, name, getattr(index, name))
+    StringTable.save(path, "author_institutions", author_institutions)
+    StringTable.save(path, "completion_tokens", completion_index.tokens)
+    for name in ("entity_popularity", "entity_offsets", "posting_authors", "posting_counts", "posting_max_rho", "author_papers"):
+        _save_array(path, name, getattr(index, name))
+    _save_array(path, "completion_authors", numpy.array([author_index[a[0]] for a in completion_index.authors], dtype=numpy.int32))
+    _save_array(path, "completion_token_offsets", completion_index.token_offsets)
+    _save_array(path, "completion_token_authors", completion_index.token_authors)
+
+    with open(manifest_path, "w") as f:
+        json.dump({"format": FORMAT_VERSION, "version": version, "min_score": min_score, "total_papers": index.total_papers}, f)
+
+
+def manifest(path):
+    """
+    Returns the manifest of the snapshot in path, or None if there is no complete snapshot there.
+    """
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load(path):
+    """
+    Memory-maps the snapshot in path, returning the inverted index, the corpus statistics and the
+    completion index. Raises IOError if there is no snapshot in path or it has another format.
+    """
+    m = manifest(path)
+    if m is None:
+        raise IOError("No snapshot found in {}".format(path))
+    if m["format"] != FORMAT_VERSION:
+        raise IOError("Snapshot {} has format {}, expected {}".format(path, m["format"], FORMAT_VERSION))
+
+    entities, author_ids, author_names, author_institutions, completion_tokens = [
+        StringTable.load(path, name) for name in ("entities", "author_ids", "author_names", "author_institutions", "completion_tokens")]
+    entity_popularity, author_papers = _load_array(path, "entity_popularity"), _load_array(path, "author_papers")
+    index = InvertedIndex(entities,
+                          entity_popularity,
+                          _load_array(path, "entity_offsets"),
+                          _load_array(path, "posting_authors"),
+                          _load_array(path, "posting_counts"),
+                          _load_array(path, "posting_max_rho"),
+                          author_ids,
+                          author_names,
+                          author_papers,
+                          m["total_papers"])
+    # Authors without papers have 0 papers, as with author_papers.get(author_id, 0).
+    statistics = CorpusStatistics(m["total_papers"], SortedMapping(entities, entity_popularity), SortedMapping(author_ids, author_papers))
+    completion_index = AuthorCompletionIndex(CompletionAuthors(_load_array(path, "completion_authors"), author_ids, author_names, author_institutions),
+                                             completion_tokens,
+                                             _load_array(path, "completion_token_offsets"),
+                                             _load_array(path, "completion_token_authors"))
+    return index, statistics, completion_index
@@ -0,0 +1,106 @@
+'''
+Corpus statistics used as IAF and EF denominators by the scoring functions.
+
+They are persisted by ExpertFindingBuilder in summary tables and loaded in memory by ExpertFinding,
+so that scoring never has to count documents or entity occurrences at query time.
+'''
+
+import logging
+import sqlite3
+
+
+def create_tables(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS corpus_statistics
+         (name PRIMARY KEY, value)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS entity_statistics
+         (entity PRIMARY KEY, popularity)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS author_statistics
+         (author_id PRIMARY KEY, papers_count)''')
+
+
+def invalidate(db):
+    """
+    Marks the persisted statistics as stale. Until update is called, CorpusStatistics.load computes
+    them from the base tables.
+    """
+    db.execute('''DELETE FROM corpus_statistics WHERE name='total_papers' ''')
+    db.execute('''DELETE FROM entity_statistics''')
+    db.execute('''DELETE FROM author_statistics''')
+
+
+def update(db):
+    """
+    Recomputes the persisted statistics from the base tables.
+    """
+    invalidate(db)
+    db.execute('''INSERT INTO entity_statistics
+        SELECT entity, SUM(frequency) FROM entities GROUP BY entity''')
+    db.execute('''INSERT INTO author_statistics
+        SELECT author_id, COUNT(DISTINCT(document_id)) FROM entity_occurrences GROUP BY author_id''')
+    db.execute('''INSERT INTO corpus_statistics
+        SELECT 'total_papers', COUNT(*) FROM documents''')
+
+
+def replace(db, total_papers, entity_popularity):
+    """
+    Replaces the number of papers and the entity popularity persisted by update with those of a
+    larger corpus the database is part of (see expertfinding.sharding).
+    """
+    db.execute('''DELETE FROM entity_statistics''')
+    db.executemany('''INSERT INTO entity_statistics VALUES (?,?)''', entity_popularity.iteritems())
+    db.execute('''INSERT OR REPLACE INTO corpus_statistics VALUES ('total_papers', ?)''', (total_papers,))
+
+
+def bump_version(db):
+    """
+    Increments the version of the database, which changes whenever documents are added to it.
+    """
+    db.execute('''INSERT OR REPLACE INTO corpus_statistics
+        SELECT 'version', IFNULL((SELECT value FROM corpus_statistics WHERE name='version'), 0) + 1''')
+
+
+def version(db):
+    """
+    Returns the version of the database (0 for databases built before versioning was introduced).
+    """
+    try:
+        row = db.execute('''SELECT value FROM corpus_statistics WHERE name='version' ''').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def _has_statistics(db):
+    tables = set(r[0] for r in db.execute('''SELECT name FROM sqlite_master WHERE type='table' ''').fetchall())
+    if not tables.issuperset(["corpus_statistics", "entity_statistics", "author_statistics"]):
+        return False
+    return db.execute('''SELECT COUNT(*) FROM corpus_statistics WHERE name='total_papers' ''').fetchall()[0][0] > 0
+
+
+class CorpusStatistics(object):
+    """
+    Memory-resident corpus statistics: the number of papers, the number of papers citing each entity
+    (its popularity) and the number of papers of each author.
+    """
+
+    def __init__(self, total_papers, entity_popularity, author_papers):
+        self.total_papers = total_papers
+        self.entity_popularity = entity_popularity
+        self.author_papers = author_papers
+
+    @classmethod
+    def load(cls, db):
+        """
+        Loads the statistics persisted by the builder, or computes them from the base tables if they
+        are missing or stale.
+        """
+        if _has_statistics(db):
+            return cls(
+                db.execute('''SELECT value FROM corpus_statistics WHERE name='total_papers' ''').fetchall()[0][0],
+                dict(db.execute('''SELECT entity, popularity FROM entity_statistics''')),
+                dict(db.execute('''SELECT author_id, papers_count FROM author_statistics''')))
+        logging.warning("Corpus statistics not found in the database, computing them from scratch.")
+        return cls(
+            db.execute('''SELECT COUNT(*) FROM documents''').fetchall()[0][0],
+            dict(db.execute('''SELECT entity, SUM(frequency) FROM entities GROUP BY entity''')),
+            dict(db.execute('''SELECT author_id, COUNT(DISTINCT(document_id)) FROM entity_occurrences GROUP BY author_id''')))
@@ -5,19 +5,43 @@ Created on Feb 21, 2017
 '''
 
 from argparse import ArgumentParser
-from collections import Counter
-from flask import Flask, jsonify, request, redirect
+import base64
+from flask import Flask, Response, jsonify, request, redirect
 import flask
+from itertools import groupby
 import logging
 import os
-import re
+import signal
+import socket
 import sys
 import tagme
+import thread
+import time
+from werkzeug.serving import make_server
 
+import expertfinding
 from expertfinding import ExpertFinding
+from expertfinding import metrics
+from expertfinding import query_cache
+from expertfinding.pipeline import DEFAULT_ANNOTATION_WORKERS, DEFAULT_SCORING_WORKERS, QueryPipeline
+from expertfinding.profiling import SamplingProfiler
 
 
-app = Flask(__name__, static_folder=os.path.join("..", "..", "..", "resources", "web"), static_path="/static")
+app = Flask(__name__, static_folder=os.path.join("..", "..", "..", "resources", "web"), static_url_path="/static")
+
+# Items fetched from the database at a time by streaming responses.
+STREAM_PAGE_SIZE = 500
+
+REQUEST_SECONDS = metrics.REGISTRY.histogram("expertfinding_http_request_seconds", "Time spent answering requests to each endpoint", ("endpoint",))
+
+@app.before_request
+def start_request_timer():
+    flask.g.start_time = time.time()
+
+@app.after_request
+def record_request_time(response):
+    REQUEST_SECONDS.observe(time.time() - flask.g.start_time, (request.endpoint or "unknown",))
+    return response
 
 @app.route('/')
 def index():
@@ -31,93 +55,270 @@ def get_document():
     author_id, ret_doc_id, year, body = exf.document(docid)
     return jsonify(author_id = author_id, ret_doc_id = ret_doc_id, year = year, body = body)
 
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(flask.json.dumps(values))
+
+def is_integer(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def is_document_cursor(values):
+    '''
+    Whether values are those of a cursor of /documents: the id of the last document of a page.
+    '''
+    return is_integer(values)
+
+def is_author_cursor(values):
+    '''
+    Whether values are those of a cursor of /author: the [frequency, entity] of the last entity of a
+    page.
+    '''
+    return isinstance(values, list) and len(values) == 2 and is_integer(values[0]) and isinstance(values[1], unicode)
+
+def page_arguments(is_cursor):
+    '''
+    Returns the limit of a paginated request and the values encoded in its cursor by encode_cursor,
+    answering 400 if they are not valid or is_cursor(values) is false.
+    '''
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is not None and limit <= 0:
+        flask.abort(400)
+    if not cursor:
+        return limit, None
+    try:
+        values = flask.json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, ValueError):
+        flask.abort(400)
+    if not is_cursor(values):
+        flask.abort(400)
+    return limit, values
+
+def stream_json(fields, list_name, items):
+    '''
+    Streams the JSON object with fields and the list_name list of items, one item at a time.
+    '''
+    return Response(flask.stream_with_context(_json_chunks(fields, list_name, items)), mimetype="application/json")
+
+def _json_chunks(fields, list_name, items):
+    yield flask.json.dumps(fields)[:-1] + (u", " if fields else u"") + flask.json.dumps(list_name) + u": ["
+    for i, item in enumerate(items):
+        yield (u", " if i else u"") + flask.json.dumps(item)
+    yield u"]}"
+
+def document_entities(rows):
+    '''
+    Yields the (document_id, year, entities) of the rows returned by ExpertFinding.documents.
+    '''
+    for document_id, document_rows in groupby(rows, lambda r: r[0]):
+        document_rows = list(document_rows)
+        yield document_id, document_rows[0][1], [{"entity": entity, "count": entity_count} for _, _, entity, entity_count in document_rows]
+
+def all_documents(author_id, entities, after):
+    while True:
+        page = list(document_entities(exf.documents(author_id, entities, STREAM_PAGE_SIZE, after)))
+        for document_id, year, document_entities_json in page:
+            yield {"id": document_id, "year": year, "entities": document_entities_json}
+        if len(page) < STREAM_PAGE_SIZE:
+            return
+        after = page[-1][0]
+
 @app.route('/documents')
 def get_documents():
+    '''
+    The documents of author a citing the entities in e (a JSON list), as an object keyed by document
+    id. With limit, the documents are a list of at most limit documents sorted by id, followed by
+    the cursor (next_cursor, null on the last page) to pass as cursor to get the next ones. With
+    stream=1, the list of all documents is streamed.
+    '''
     global exf
     author_id = request.args.get('a')
     entities = flask.json.loads(request.args.get("e"))
-    docid_to_year = dict()
-    docid_to_entities = dict()
-    for document_id, year, entity, entity_count in exf.documents(author_id, entities):
-        docid_to_year[document_id] = year
-        if document_id not in docid_to_entities:
-            docid_to_entities[document_id] = []
-        docid_to_entities[document_id].append({"entity": entity, "count": entity_count})
-    
-    return jsonify(dict((docid, {
-                                    "year": docid_to_year[docid],
-                                    "entities": docid_to_entities[docid]
-                               }
-                       ) 
-                       for docid in docid_to_year
-                      )
-                 )
+    limit, after = page_arguments(is_document_cursor)
+    if request.args.get('stream'):
+        return stream_json({}, "documents", all_documents(author_id, entities, after))
+    documents = document_entities(exf.documents(author_id, entities, limit, after))
+    if limit is None:
+        return jsonify(dict((document_id, {"year": year, "entities": document_entities_json})
+                            for document_id, year, document_entities_json in documents))
+    documents = [{"id": document_id, "year": year, "entities": document_entities_json} for document_id, year, document_entities_json in documents]
+    return jsonify(documents=documents,
+                   next_cursor=encode_cursor(documents[-1]["id"]) if len(documents) == limit else None)
 
 @app.route('/query')
 def find_expert():
-    global exf
+    global results_cache, pipeline
     query = request.args.get('q')
-    scoring_functions = {
-        scoring_foo.func_name.replace("_score", ""): scoring_foo
-        for scoring_foo in [
-            ExpertFinding.efiaf_score,
-            ExpertFinding.eciaf_score,
-            ExpertFinding.log_ec_ef_iaf_score,
-            ExpertFinding.cossim_efiaf_score,
-            ExpertFinding.relatedness_geom
-            ]}
-    
+    scoring_functions = [
+        ExpertFinding.efiaf_score,
+        ExpertFinding.eciaf_score,
+        ExpertFinding.log_ec_ef_iaf_score,
+        ExpertFinding.cossim_efiaf_score,
+        ExpertFinding.relatedness_geom
+        ]
+
+    start_time = time.time()
+    profiler = None
+    if app.config.get("PROFILING") and request.args.get("profile"):
+        profiler = SamplingProfiler(thread_ids=pipeline.thread_ids() | set([thread.get_ident()]))
+        profiler.start()
+    try:
+        rankings, timings, query_entities = results_cache.find_expert_multi(query, scoring_functions)
+    finally:
+        if profiler is not None:
+            profiler.stop()
     result = dict()
-    for scoring_f_name in scoring_functions.keys():
-        res, time, query_entities = exf.find_expert(query, scoring_functions[scoring_f_name])
-        result["experts_" + scoring_f_name] = res
-        result["time_" + scoring_f_name] = time
-        result["query_entities"] = list(query_entities)
-        
+    result["timed_out"] = []
+    for scoring_foo, res in zip(scoring_functions, rankings):
+        scoring_f_name = scoring_foo.func_name.replace("_score", "")
+        if res is None:
+            result["timed_out"].append(scoring_f_name)
+        result["experts_" + scoring_f_name] = res or []
+        result["time_" + scoring_f_name] = timings.get(scoring_foo.func_name, 0.0)
+    result["time_annotation"] = timings["annotation"]
+    result["time_candidates"] = timings.get("candidates", 0.0)
+    result["time_total"] = time.time() - start_time
+    result["query_entities"] = list(query_entities or [])
+    if profiler is not None:
+        result["profile"] = profiler.collapsed()
+
     return jsonify(result)
 
+@app.route('/cache_stats')
+def cache_stats():
+    global results_cache, annotation_cache
+    stats = results_cache.stats()
+    if annotation_cache is not None and hasattr(annotation_cache, "stats"):
+        stats["annotations"] = annotation_cache.stats()
+    return jsonify(stats)
+
+def cache_counts(stat):
+    """
+    Returns the hits or misses (stat) of each cache, keyed by the cache name.
+    """
+    global exf, results_cache, annotation_cache
+    caches = [("query_entities", results_cache.query_entities), ("rankings", results_cache.rankings), ("relatedness", exf.relatedness_store)]
+    if annotation_cache is not None and hasattr(annotation_cache, "stats"):
+        caches.append(("annotations", annotation_cache))
+    return dict(((name,), cache.stats()[stat]) for name, cache in caches)
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route('/completion')
 def complete_name():
     global exf
-    query = re.sub(r"[%\s]+", "%", request.args.get('q'))
+    query = request.args.get('q')
+    limit = request.args.get('limit', 50, type=int)
     return jsonify(authors=[{"id": author_id,
                              "name": name,
                              "institution": institution,
                             }
-                            for author_id, name, institution in exf.authors_completion(query)])
+                            for author_id, name, institution in exf.authors_completion(query, limit)])
+
+def author_entities(author_id, limit, after):
+    return [{"entity": entity,
+             "frequency": author_freq,
+             "years": years
+            }
+            for entity, author_freq, years, _ in exf.author_entity_frequency_page(author_id, limit, after)]
+
+def all_author_entities(author_id, after):
+    while True:
+        page = author_entities(author_id, STREAM_PAGE_SIZE, after)
+        for e in page:
+            yield e
+        if len(page) < STREAM_PAGE_SIZE:
+            return
+        after = (page[-1]["frequency"], page[-1]["entity"])
 
 @app.route('/author')
 def author_info():
+    '''
+    The entities cited by an author, the most cited first. With limit, at most limit entities are
+    returned, followed by the cursor (next_cursor, null on the last page) to pass as cursor to get
+    the next ones. With stream=1, all entities are streamed.
+    '''
     global exf
     author_id = request.args.get('id')
-    entity_freq = [{"entity": entity,
-      "frequency": author_freq,
-      "years": sorted(Counter([int(y) for y in years.split(",")]).items())
-      }
-    for entity, author_freq, years, _ in exf.author_entity_frequency(author_id)]
-    
-    entity_freq.sort(key=lambda e: e["frequency"], reverse=True)
-    
-    return jsonify(
+    limit, after = page_arguments(is_author_cursor)
+    author = dict(
         id=author_id,
         name=exf.name(author_id),
         papers_count=exf.author_papers_count(author_id),
-        entities=entity_freq,
         )
+    if request.args.get('stream'):
+        return stream_json(author, "entities", all_author_entities(author_id, after))
+    entity_freq = author_entities(author_id, limit, after)
+    if limit is not None:
+        author["next_cursor"] = encode_cursor([entity_freq[-1]["frequency"], entity_freq[-1]["entity"]]) if len(entity_freq) == limit else None
+    return jsonify(entities=entity_freq, **author)
+
+def serve(host, port, workers):
+    '''
+    Serves the API with a thread per request. With more than one worker, the workers are forked
+    processes accepting connections from the same socket, each with its own database connections.
+    '''
+    if workers <= 1:
+        return app.run(host=host, port=port, threaded=True)
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((host, port))
+    listening_socket.listen(128)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            make_server(host, port, app, threaded=True, fd=listening_socket.fileno()).serve_forever()
+            os._exit(0)
+        children.append(pid)
+    logging.info("Serving on %s:%d with %d workers" % (host, port, workers))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+    return 0
 
 def main():
-    global exf
+    global exf, results_cache, annotation_cache, pipeline
     '''Command line options.'''
     parser = ArgumentParser()
     parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
     parser.add_argument("-r", "--relatedness_dict", required=True, action="store", help="Relatedness persistent dictionary file")
     parser.add_argument("-g", "--gcube_token", required=True, action="store", help="Tagme authentication gcube token")
+    parser.add_argument("-c", "--cache_dir", action="store", help="Annotation cache directory (shared with create_db.py)")
+    parser.add_argument("-m", "--in_memory_index", action="store_true", help="Answer queries with an in-memory index instead of the DB")
+    parser.add_argument("--snapshot", action="store", help="Load the in-memory index from this snapshot (see expertfinding/preprocessing/create_snapshot.py)")
+    parser.add_argument("--query_cache_size", action="store", type=int, default=query_cache.DEFAULT_MAX_ENTRIES, help="Maximum number of cached queries")
+    parser.add_argument("--query_cache_ttl", action="store", type=int, default=query_cache.DEFAULT_TTL, help="Seconds after which cached queries expire")
+    parser.add_argument("--annotation_timeout", action="store", type=float, help="Seconds to wait for the annotation of a query")
+    parser.add_argument("--scoring_timeout", action="store", type=float, help="Seconds to wait for the scoring functions computed concurrently (e.g. relatedness_geom)")
+    parser.add_argument("--annotation_threads", action="store", type=int, default=DEFAULT_ANNOTATION_WORKERS, help="Threads annotating queries, per worker process")
+    parser.add_argument("--scoring_threads", action="store", type=int, default=DEFAULT_SCORING_WORKERS, help="Threads computing the scoring functions run concurrently, per worker process")
+    parser.add_argument("--tagme_api", action="store", help="Base URL of the TagMe API (e.g. of fake_tagme.py)")
+    parser.add_argument("-p", "--port", action="store", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--profiling", action="store_true", help="Allow sampling the stacks of a query with /query?profile=1 (see expertfinding.profiling)")
     args = parser.parse_args()
 
     tagme.GCUBE_TOKEN = args.gcube_token
+    if args.tagme_api:
+        expertfinding.set_tagme_api(args.tagme_api)
+    annotation_cache = expertfinding.set_cache(args.cache_dir) if args.cache_dir else None
 
-    exf = ExpertFinding(args.storage_db, relatedness_dict_file=args.relatedness_dict)
-    return app.run(host="0.0.0.0")
+    exf = ExpertFinding(args.storage_db, relatedness_dict_file=args.relatedness_dict, in_memory_index=args.in_memory_index, read_only=True, snapshot_path=args.snapshot)
+    pipeline = QueryPipeline(exf, annotation_workers=args.annotation_threads, scoring_workers=args.scoring_threads,
+                             annotation_timeout=args.annotation_timeout, scoring_timeout=args.scoring_timeout)
+    results_cache = query_cache.QueryCache(pipeline, args.query_cache_size, args.query_cache_ttl)
+    metrics.REGISTRY.collector("expertfinding_cache_hits_total", "counter", "Cache hits", lambda: cache_counts("hits"), ("cache",))
+    metrics.REGISTRY.collector("expertfinding_cache_misses_total", "counter", "Cache misses", lambda: cache_counts("misses"), ("cache",))
+    app.config["PROFILING"] = args.profiling
+    # Build the completion index before forking the workers, so that they share it.
+    exf.completion_index
+    return serve("0.0.0.0", args.port, args.workers)
     
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+# encoding: utf-8
+
+'''
+A local stand-in for the TagMe API, for testing. The /tag endpoint annotates the occurrences of the
+entities of an EF database (see expertfinding.annotators.DictionaryAnnotator) and the /rel endpoint
+returns a relatedness derived from a hash of the two titles. Both wait a configurable latency.
+Point the web server to it with --tagme_api http://localhost:<port>.
+'''
+
+from argparse import ArgumentParser
+from datetime import datetime
+import hashlib
+import logging
+import sqlite3
+import sys
+import time
+
+from flask import Flask, jsonify, request
+
+from expertfinding.annotators import DictionaryAnnotator
+
+
+app = Flask(__name__)
+
+
+def title_relatedness(title_1, title_2):
+    titles = u"|".join(sorted([title_1, title_2])).encode("utf-8")
+    return int(hashlib.md5(titles).hexdigest()[:8], 16) / float(16**8)
+
+
+def response(**kwargs):
+    return jsonify(lang=request.values.get("lang", "en"), timestamp=datetime.utcnow().isoformat(), **kwargs)
+
+
+@app.route('/tag', methods=["GET", "POST"])
+def tag():
+    time.sleep(app.config["TAG_LATENCY"])
+    text = request.values.get("text", u"")
+    annotations = [{"start": a.begin,
+                    "end": a.end,
+                    "id": int(hashlib.md5(a.entity_title.encode("utf-8")).hexdigest()[:7], 16),
+                    "title": a.entity_title,
+                    "spot": text[a.begin:a.end],
+                    "rho": a.score,
+                   }
+                   for a in app.config["ANNOTATOR"](text)]
+    return response(annotations=annotations, time=0)
+
+
+@app.route('/rel', methods=["GET", "POST"])
+def rel():
+    time.sleep(app.config["REL_LATENCY"])
+    result = []
+    for couple in request.values.getlist("tt"):
+        title_1, title_2 = (t.replace("_", " ") for t in couple.split(" "))
+        result.append({"couple": couple, "rel": title_relatedness(title_1, title_2)})
+    return response(result=result)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--storage_db", required=True, action="store", help="EF database whose entities are annotated")
+    parser.add_argument("-p", "--port", action="store", type=int, default=5001, help="Port to listen on")
+    parser.add_argument("--rho", action="store", type=float, default=0.5, help="Score of all annotations")
+    parser.add_argument("--tag_latency", action="store", type=float, default=0.0, help="Seconds to wait before answering /tag")
+    parser.add_argument("--rel_latency", action="store", type=float, default=0.0, help="Seconds to wait before answering /rel")
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.storage_db)
+    titles = [r[0] for r in db.execute('''SELECT DISTINCT(entity) FROM entities''')]
+    logging.info("Annotating %d entities" % len(titles))
+    app.config["ANNOTATOR"] = DictionaryAnnotator(dict((t, args.rho) for t in titles))
+    app.config["TAG_LATENCY"] = args.tag_latency
+    app.config["REL_LATENCY"] = args.rel_latency
+    return app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
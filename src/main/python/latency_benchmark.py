@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+'''
+Latency benchmark: runs the topics through each scoring function and reports, per function, the
+queries per second, the peak memory and the 50th/95th/99th percentiles of the time spent in each
+stage of find_expert_multi (annotation, candidate retrieval, profile fetch, scoring, sort).
+
+Query annotations are replayed from a JSON fixture, so the benchmark runs offline; with a TagMe token
+(-g), topics missing from the fixture are annotated and recorded first. Relatedness is read from the
+relatedness file, and fetched from TagMe only with a token.
+
+Results can be saved as a baseline (--save_baseline) and compared with a later run (--baseline):
+the benchmark fails if the latency percentiles or the peak memory grow, or the queries per second
+drop, by more than the threshold.
+
+With --shards, queries run on a sharded database (see expertfinding.sharding) in the benchmark
+process itself, and the peak memory is that of the process merging the rankings, not of the shards.
+'''
+
+from argparse import ArgumentParser
+import json
+import logging
+from multiprocessing import Pool
+import resource
+import sys
+import time
+import tagme
+
+import numpy
+
+import expertfinding
+from expertfinding import ExpertFinding as EF
+from expertfinding.annotators import RecordedAnnotator
+from expertfinding.sharding import ShardedExpertFinding
+from benchmark import SCORING_FUNCTIONS, topics_generator
+
+
+STAGES = ["annotation", "candidates", "profiles", "scoring", "sort", "total"]
+PERCENTILES = [50, 95, 99]
+
+
+def no_relatedness(title_pairs):
+    raise IOError("Relatedness of {} pairs not recorded (pass a TagMe token to fetch it)".format(len(title_pairs)))
+
+
+def run_scoring_function(data):
+    """
+    Runs all topics through a scoring function, in a process of its own so that its peak memory is
+    measured alone.
+    """
+    storage_db, relatedness_dict, in_memory_index, snapshot_path, shards, offline, scoring_f_name, queries, repetitions = data
+    if shards > 1:
+        exf = ShardedExpertFinding(storage_db, shards, relatedness_dict, in_memory_index, no_relatedness if offline else None)
+    else:
+        exf = EF(storage_db, relatedness_dict_file=relatedness_dict, in_memory_index=in_memory_index, read_only=True, snapshot_path=snapshot_path)
+        if offline:
+            exf.relatedness_store.fetch = no_relatedness
+    scoring_foo = SCORING_FUNCTIONS[scoring_f_name]
+    stages = dict((stage, []) for stage in STAGES)
+    start_time = time.time()
+    for _ in range(repetitions):
+        for query in queries:
+            query_start_time = time.time()
+            _, timings, _ = exf.find_expert_multi(query, [scoring_foo])
+            stages["total"].append(time.time() - query_start_time)
+            stages["annotation"].append(timings["annotation"])
+            stages["candidates"].append(timings["candidates"])
+            for stage in ["profiles", "scoring", "sort"]:
+                stages[stage].append(timings[scoring_f_name + "." + stage])
+    elapsed = time.time() - start_time
+    if shards > 1:
+        exf.close()
+    return scoring_f_name, {
+        "qps": len(stages["total"]) / elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "stages": dict((stage, dict(("p{}".format(p), v * 1000) for p, v in zip(PERCENTILES, numpy.percentile(values, PERCENTILES))))
+                       for stage, values in stages.items()),
+        }
+
+
+def regressions(baseline, results, threshold):
+    """
+    Returns the descriptions of the measures of results worse than in baseline by more than threshold.
+    """
+    worse = []
+    for scoring_f_name, result in sorted(results.items()):
+        if scoring_f_name not in baseline:
+            continue
+        base = baseline[scoring_f_name]
+        if result["qps"] < base["qps"] * (1 - threshold):
+            worse.append("{} qps: {:.1f} -> {:.1f}".format(scoring_f_name, base["qps"], result["qps"]))
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            worse.append("{} peak RSS: {:.1f} -> {:.1f} MB".format(scoring_f_name, base["peak_rss_mb"], result["peak_rss_mb"]))
+        for p in ["p{}".format(p) for p in PERCENTILES]:
+            if result["stages"]["total"][p] > base["stages"]["total"][p] * (1 + threshold):
+                worse.append("{} total {}: {:.2f} -> {:.2f} ms".format(scoring_f_name, p, base["stages"]["total"][p], result["stages"]["total"][p]))
+    return worse
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--storage_db", required=True, action="store", help="Storage DB file")
+    parser.add_argument("-r", "--relatedness_dict", action="store", help="Relatedness persistent dictionary file")
+    parser.add_argument("-t", "--topics", required=True, action="store", help="Topic id-description mapping file")
+    parser.add_argument("-a", "--annotations", required=True, action="store", help="JSON file with the recorded annotations of the topics")
+    parser.add_argument("-g", "--gcube_token", action="store", help="Tagme authentication gcube token, to record missing annotations and relatedness")
+    parser.add_argument("-f", "--scoring", action="store", nargs="+", help="Name of scoring functions to test (default: all)", choices=SCORING_FUNCTIONS.keys())
+    parser.add_argument("-n", "--repetitions", action="store", type=int, default=3, help="Times each topic is run")
+    parser.add_argument("-m", "--in_memory_index", action="store_true", help="Answer queries with an in-memory index instead of the DB")
+    parser.add_argument("--snapshot", action="store", help="Load the in-memory index from this snapshot (see expertfinding/preprocessing/create_snapshot.py)")
+    parser.add_argument("--shards", action="store", type=int, default=1, help="Number of shards of the DB (built with create_db.py --shards)")
+    parser.add_argument("--baseline", action="store", help="JSON baseline to compare the results with")
+    parser.add_argument("--save_baseline", action="store", help="Save the results as a JSON baseline")
+    parser.add_argument("--threshold", action="store", type=float, default=0.2, help="Relative change over which a measure is a regression")
+    args = parser.parse_args()
+    if args.shards > 1 and args.snapshot:
+        parser.error("--snapshot cannot be used with --shards")
+
+    queries = [query for _, query in sorted(topics_generator(args.topics))]
+    offline = args.gcube_token is None
+    if offline:
+        annotator = RecordedAnnotator.load(args.annotations)
+    else:
+        tagme.GCUBE_TOKEN = args.gcube_token
+        try:
+            annotator = RecordedAnnotator.load(args.annotations, expertfinding.entities)
+        except IOError:
+            annotator = RecordedAnnotator(annotator=expertfinding.entities)
+        for query in queries:
+            annotator(query)
+        annotator.save(args.annotations)
+    expertfinding.entities = annotator
+
+    scoring_f_names = args.scoring or sorted(name for name in SCORING_FUNCTIONS if name != "random_score")
+    results = {}
+    for scoring_f_name in scoring_f_names:
+        data = (args.storage_db, args.relatedness_dict, args.in_memory_index, args.snapshot, args.shards, offline, scoring_f_name, queries, args.repetitions)
+        if args.shards > 1:
+            # The shards run in worker processes, which a pool worker cannot start.
+            name, results[scoring_f_name] = run_scoring_function(data)
+            continue
+        pool = Pool(1)
+        name, results[scoring_f_name] = pool.apply(run_scoring_function, (data,))
+        pool.close()
+        pool.join()
+
+    print "{:24} {:>8} {:>9}  {}".format("scoring function", "qps", "RSS (MB)", "  ".join("{:>21}".format(stage + " p50/95/99") for stage in STAGES))
+    for scoring_f_name in scoring_f_names:
+        result = results[scoring_f_name]
+        print "{:24} {:8.1f} {:9.1f}  {}".format(scoring_f_name, result["qps"], result["peak_rss_mb"], "  ".join(
+            "{:>21}".format("/".join("{:.1f}".format(result["stages"][stage]["p{}".format(p)]) for p in PERCENTILES)) for stage in STAGES))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_f:
+            json.dump(results, baseline_f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_f:
+            worse = regressions(json.load(baseline_f), results, args.threshold)
+        for regression in worse:
+            print "REGRESSION", regression
+        if worse:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# encoding: utf-8
+
+'''
+Load test of the web server: sends the topics as queries from an increasing number of concurrent
+clients and reports throughput and latency for each level of concurrency. Start the server with
+--query_cache_size 0, otherwise repeated queries are answered from the cache.
+'''
+
+from argparse import ArgumentParser
+import logging
+from multiprocessing.pool import ThreadPool
+import sys
+import time
+import urllib
+import urllib2
+
+import numpy
+
+from benchmark import topics_generator
+
+
+def timed_request(url):
+    start_time = time.time()
+    urllib2.urlopen(url).read()
+    return time.time() - start_time
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-u", "--url", action="store", default="http://localhost:5000", help="Base URL of the server")
+    parser.add_argument("-t", "--topics", required=True, action="store", help="Topic id-description mapping file")
+    parser.add_argument("-e", "--endpoint", action="store", default="query", choices=["query", "completion"], help="Endpoint to query with the topics")
+    parser.add_argument("-c", "--concurrency", action="store", type=int, nargs="+", default=[1, 2, 4, 8], help="Numbers of concurrent clients to test")
+    parser.add_argument("-n", "--requests", action="store", type=int, default=200, help="Requests sent for each number of clients")
+    args = parser.parse_args()
+
+    queries = [query for _, query in topics_generator(args.topics)]
+    urls = ["{}/{}?{}".format(args.url, args.endpoint, urllib.urlencode({"q": queries[i % len(queries)].encode("utf-8")}))
+            for i in range(args.requests)]
+
+    print "clients  requests/s  p50 (ms)  p95 (ms)  p99 (ms)"
+    for clients in args.concurrency:
+        pool = ThreadPool(clients)
+        start_time = time.time()
+        latencies = numpy.array(pool.map(timed_request, urls, chunksize=1))
+        elapsed = time.time() - start_time
+        pool.close()
+        pool.join()
+        p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99]) * 1000
+        print "{:7d}  {:10.1f}  {:8.1f}  {:8.1f}  {:8.1f}".format(clients, len(urls) / elapsed, p50, p95, p99)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
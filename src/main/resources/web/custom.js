@@ -138,32 +138,50 @@ function updateAndShowDocumentModal(author_id, author_name, query_entities) {
 	$("#annotations-modal").modal()
 }
 
-function updateAndShowAuthorModal(author_id) {
-	$("#author-modal-doc-list").empty()
+var AUTHOR_PAGE_SIZE = 100;
+
+function appendAuthorEntities(author_id, cursor) {
 	var queryAPI = "/author";
-	$.getJSON(queryAPI, {
+	var params = {
 		"id" : author_id,
-	}).done(function(data) {
-		$("#author-modal-entity-table").empty()
+		"limit" : AUTHOR_PAGE_SIZE
+	}
+	if (cursor)
+		params["cursor"] = cursor
+	$.getJSON(queryAPI, params).done(function(data) {
+		$("#author-modal-more").remove()
 
 		$(".author-modal-author-name").text(data.name)
 		$("#author-modal-author-id").text(data.id)
 		$("#author-modal-author-doc-count").text(data.papers_count)
 
 		$.each(data.entities, function(i, e) {
-			row = $("<tr>")
+			var row = $("<tr>")
 			$("#author-modal-entity-table").append(row)
 			row.append($("<td>").append($("<span>").text(e.entity).append($("<span>").addClass("badge").text(e.frequency))))
-			left_td = $("<td>")
+			var left_td = $("<td>")
 			$.each(e.years, function(i, e_y) {
 				left_td.append($("<span>").text(" " + e_y[0] + " ").append($("<span>").addClass("badge").text(e_y[1])))
 			})
 			row.append(left_td)
 		})
 
+		if (data.next_cursor) {
+			var more = $("<a>").attr("href", "#").text("Show more").click(function(event) {
+				event.preventDefault()
+				appendAuthorEntities(author_id, data.next_cursor)
+			})
+			$("#author-modal-entity-table").append($("<tr>").attr("id", "author-modal-more").append($("<td>").attr("colspan", 2).append(more)))
+		}
 	}).fail(function(data) {
 		alert("Author request failed.")
 	})
+}
+
+function updateAndShowAuthorModal(author_id) {
+	$("#author-modal-doc-list").empty()
+	$("#author-modal-entity-table").empty()
+	appendAuthorEntities(author_id, null)
 
 	$("#author-modal").modal()
 }
@@ -0,0 +1,77 @@
+'''
+Tests of expertfinding.annotation_cache.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding.annotation_cache import SqliteAnnotationCache, text_key
+from expertfinding.annotators import Annotation
+
+
+def annotations(i):
+    return [Annotation(u"Entity {}".format(i), 0, 5, 0.5)]
+
+
+class SqliteAnnotationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "annotations.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def entries(self, cache):
+        return cache._db().execute('''SELECT COUNT(*) FROM annotations''').fetchone()[0]
+
+    def test_round_trip(self):
+        cache = SqliteAnnotationCache(self.path)
+        cache.put(u"text 1", annotations(1))
+        cache.put_many([(u"text 2", annotations(2)), (u"text 3", [])])
+        self.assertEqual(annotations(1), cache.get(u"text 1"))
+        self.assertEqual(annotations(2), cache.get(u"text 2"))
+        self.assertEqual([], cache.get(u"text 3"))
+        self.assertIsNone(cache.get(u"text 4"))
+        self.assertEqual(annotations(2), SqliteAnnotationCache(self.path).get(u"text 2"))
+
+    def test_bounded_entries(self):
+        cache = SqliteAnnotationCache(self.path, max_entries=10)
+        for i in range(10):
+            cache.put(u"text {}".format(i), annotations(i))
+        # Read the oldest entries, so that they are the most recently used.
+        for i in range(3):
+            self.assertEqual(annotations(i), cache.get(u"text {}".format(i)))
+        for i in range(10, 30):
+            cache.put(u"text {}".format(i), annotations(i))
+            self.assertLessEqual(self.entries(cache), 10)
+            self.assertLessEqual(cache.stats()["entries"], 10)
+        self.assertEqual(annotations(29), cache.get(u"text 29"))
+        self.assertIsNone(cache.get(u"text 3"))
+
+    def test_recently_read_entries_survive(self):
+        cache = SqliteAnnotationCache(self.path, max_entries=10)
+        cache.put_many((u"text {}".format(i), annotations(i)) for i in range(10))
+        self.assertEqual(annotations(0), cache.get(u"text 0"))
+        cache.put(u"text 10", annotations(10))
+        self.assertEqual(9, self.entries(cache))
+        self.assertEqual(annotations(0), cache.get(u"text 0"))
+        self.assertIsNone(cache.get(u"text 1"))
+
+    def test_recency_is_monotonic_across_instances(self):
+        cache = SqliteAnnotationCache(self.path)
+        for i in range(3):
+            cache.put(u"text {}".format(i), annotations(i))
+        cache.get(u"text 0")
+        cache.flush()
+        other = SqliteAnnotationCache(self.path)
+        other.put(u"text 3", annotations(3))
+        last_used = other._db().execute('''SELECT key, last_used FROM annotations ORDER BY last_used''').fetchall()
+        self.assertEqual([text_key(u"text {}".format(i)) for i in (1, 2, 0, 3)], [key for key, _ in last_used])
+        self.assertEqual([2, 3, 4, 5], [value for _, value in last_used])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+'''
+Tests of expertfinding.ExpertFindingBuilder.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8, u"Compilers": 0.7})
+
+
+class BuildInterrupted(Exception):
+    pass
+
+
+def papers(count, fail_after=None):
+    for i in range(count):
+        if i == fail_after:
+            raise BuildInterrupted()
+        yield Paper("a{}".format(i % 3), u"Name", u"Institution", 2010, u"Paper {} on Graph Theory and Databases".format(i), None)
+
+
+def summary(ef):
+    return [ef.db.execute('''SELECT * FROM {} ORDER BY 1, 2'''.format(table)).fetchall()
+            for table in ("author_profiles", "author_norms", "entity_statistics", "author_statistics")] + [ef.total_papers()]
+
+
+class BulkBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def indexes(self, ef):
+        return set(r[0] for r in ef.db.execute('''SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL''').fetchall())
+
+    def test_interrupted_bulk_build_keeps_indexes(self):
+        expected = ExpertFinding(os.path.join(self.tmp_dir, "expected.db"))
+        expected_builder = expected.builder(annotator=ANNOTATOR)
+        expected_builder.add_documents("papers", papers(10))
+        expected_builder.finish()
+
+        ef = ExpertFinding(os.path.join(self.tmp_dir, "ef.db"))
+        builder = ef.builder(annotator=ANNOTATOR, bulk=True)
+        self.assertRaises(BuildInterrupted, builder.add_documents, "papers", papers(10, fail_after=5), batch_size=2)
+
+        self.assertEqual(self.indexes(expected), self.indexes(ef))
+        self.assertTrue(self.indexes(ef))
+        self.assertEqual(2, ef.db.execute('''PRAGMA synchronous''').fetchone()[0])
+        self.assertEqual("delete", ef.db.execute('''PRAGMA journal_mode''').fetchone()[0])
+        # The last committed batch is kept.
+        self.assertEqual(4, ef.db.execute('''SELECT COUNT(*) FROM documents''').fetchone()[0])
+
+
+class StatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_several_files(self):
+        one_file = ExpertFinding(os.path.join(self.tmp_dir, "one.db"))
+        builder = one_file.builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers(10))
+        builder.finish()
+
+        two_files = ExpertFinding(os.path.join(self.tmp_dir, "two.db"))
+        builder = two_files.builder(annotator=ANNOTATOR)
+        all_papers = list(papers(10))
+        builder.add_documents("first", all_papers[:4])
+        # Statistics and profiles are computed once, by finish.
+        self.assertFalse(two_files.has_profiles())
+        version = two_files.version()
+        builder.add_documents("second", all_papers[4:])
+        self.assertEqual(version, two_files.version())
+        builder.finish()
+        self.assertEqual(version + 1, two_files.version())
+        builder.finish()
+        self.assertEqual(version + 1, two_files.version())
+
+        self.assertTrue(two_files.has_profiles())
+        self.assertEqual(summary(one_file), summary(two_files))
+
+
+
+class IncrementalBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def contents(self, ef):
+        return summary(ef) + [ef.db.execute('''SELECT * FROM {} ORDER BY 1, 2'''.format(table)).fetchall()
+                              for table in ("documents", "entities", "institutions", "ingested_papers")]
+
+    def check_resumed_build(self, bulk):
+        expected = ExpertFinding(os.path.join(self.tmp_dir, "expected.db"))
+        builder = expected.builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers(10))
+        builder.finish()
+
+        ef = ExpertFinding(os.path.join(self.tmp_dir, "ef-{}.db".format(bulk)))
+        builder = ef.builder(annotator=ANNOTATOR, bulk=bulk, incremental=True)
+        self.assertRaises(BuildInterrupted, builder.add_documents, "papers", papers(10, fail_after=7), batch_size=3)
+        self.assertEqual(6, ef.db.execute('''SELECT COUNT(*) FROM ingested_papers''').fetchone()[0])
+        builder = ef.builder(annotator=ANNOTATOR, bulk=bulk, incremental=True)
+        builder.add_documents("papers", papers(10), batch_size=3)
+        builder.finish()
+        self.assertEqual(self.contents(expected), self.contents(ef))
+
+        # Nothing is added again.
+        builder = ef.builder(annotator=ANNOTATOR, bulk=bulk, incremental=True)
+        builder.add_documents("papers", papers(10), batch_size=3)
+        builder.finish()
+        self.assertEqual(self.contents(expected), self.contents(ef))
+
+    def test_resumed_build(self):
+        self.check_resumed_build(False)
+
+    def test_resumed_bulk_build(self):
+        self.check_resumed_build(True)
+
+
+if __name__ == "__main__":
+    unittest.main()
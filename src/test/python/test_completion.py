@@ -0,0 +1,60 @@
+'''
+Tests of the author completion of expertfinding.ExpertFinding.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8})
+
+
+def papers(authors):
+    for author_id, name in authors:
+        yield Paper(author_id, name, u"Institution", 2010, u"A paper of {} on Graph Theory and Databases".format(author_id), None)
+
+
+class CompletionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage_db = os.path.join(self.tmp_dir, "ef.db")
+        self.build("first", [("a1", u"Anna Rossi")])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, input_f, authors, incremental=False):
+        builder = ExpertFinding(self.storage_db).builder(annotator=ANNOTATOR, incremental=incremental)
+        builder.add_documents(input_f, papers(authors))
+        builder.finish()
+
+    def check_authors_added_later(self, in_memory_index=False, snapshot_path=None):
+        ef = ExpertFinding(self.storage_db, read_only=True, in_memory_index=in_memory_index, snapshot_path=snapshot_path)
+        self.assertEqual([u"a1"], [a[0] for a in ef.authors_completion(u"ross")])
+        self.assertEqual([], ef.authors_completion(u"bianchi"))
+
+        self.build("second", [("a2", u"Marco Bianchi")], incremental=True)
+        self.assertEqual([u"a2"], [a[0] for a in ef.authors_completion(u"bianchi")])
+        self.assertEqual([u"a1"], [a[0] for a in ef.authors_completion(u"ross")])
+
+    def test_authors_added_later(self):
+        self.check_authors_added_later()
+
+    def test_authors_added_later_in_memory_index(self):
+        self.check_authors_added_later(in_memory_index=True)
+
+    def test_authors_added_later_snapshot(self):
+        snapshot_path = os.path.join(self.tmp_dir, "snapshot")
+        ExpertFinding(self.storage_db).save_snapshot(snapshot_path)
+        self.check_authors_added_later(snapshot_path=snapshot_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests of expertfinding.index.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+
+
+TOPICS = [u"Graph Theory", u"Databases", u"Compilers", u"Cryptography", u"Networks"]
+ANNOTATOR = DictionaryAnnotator(dict((topic, 0.9) for topic in TOPICS))
+SCORINGS = [ExpertFinding.efiaf_score, ExpertFinding.eciaf_score, ExpertFinding.log_ec_ef_iaf_score]
+
+
+def papers():
+    # Topic j is cited by the authors whose number is a multiple of j + 1, so popularity decreases.
+    for i in range(40):
+        for year in range(1 + i % 4):
+            topics = [topic for j, topic in enumerate(TOPICS) if i % (j + 1) == 0 and (year + j) % 3 != 2]
+            yield Paper("a{}".format(i), u"Name {}".format(i), u"Institution", 2010 + year,
+                        u"Paper {} of {} on {}".format(year, i, u" and ".join(topics or TOPICS[:1])), None)
+
+
+class TopKTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_db = os.path.join(self.tmp_dir, "ef.db")
+        builder = ExpertFinding(storage_db).builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers())
+        builder.finish()
+        self.ef = ExpertFinding(storage_db, read_only=True, in_memory_index=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def ranking(self, query_entities, scoring, top_k):
+        (ranking,), _, _ = self.ef.find_expert_multi(None, [scoring], top_k=top_k, query_entities=query_entities)
+        return [(r["author_id"], r["score"]) for r in ranking]
+
+    def test_top_k_equals_full_ranking(self):
+        for query_entities in (set(TOPICS), set(TOPICS[:2]), set(TOPICS[3:]), set([TOPICS[4]])):
+            for scoring in SCORINGS:
+                full = self.ranking(query_entities, scoring, None)
+                scores = dict(full)
+                for top_k in (1, 3, 10, 100):
+                    ranking = self.ranking(query_entities, scoring, top_k)
+                    self.assertEqual(min(top_k, len(full)), len(ranking))
+                    # Authors with the same score may be ranked differently.
+                    self.assertEqual([round(s, 9) for _, s in full[:top_k]], [round(s, 9) for _, s in ranking])
+                    for author_id, score in ranking:
+                        self.assertAlmostEqual(scores[author_id], score)
+
+    def test_authors_pruned(self):
+        query_entities = set(TOPICS)
+        contributions = self.ef.batch_scoring_function(ExpertFinding.efiaf_score)
+        efiaf = self.ef.index.ef_iaf_entities(query_entities)
+        all_authors = self.ef.index.candidates_matrix(query_entities)[0]
+        authors = self.ef.index.top_k_candidates_matrix(query_entities, efiaf, contributions, 3)[0]
+        self.assertLess(len(authors), len(all_authors))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+'''
+Tests of expertfinding.pipeline.
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding import metrics
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.pipeline import QueryPipeline
+from expertfinding.preprocessing.datasetreader import Paper
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8, u"Compilers": 0.7})
+QUERY = u"Graph Theory and Databases"
+
+
+def papers():
+    topics = [u"Graph Theory", u"Databases", u"Compilers"]
+    for i in range(12):
+        yield Paper("a{}".format(i % 4), u"Name", u"Institution", 2010 + i % 3,
+                    u"Paper {} on {} and {}".format(i, topics[i % 3], topics[i % 2]), None)
+
+
+class OfflineExpertFinding(ExpertFinding):
+
+    def __init__(self, *args, **kwargs):
+        super(OfflineExpertFinding, self).__init__(*args, **kwargs)
+        self.candidates_calls = 0
+
+    def query_entities(self, query):
+        return set(a.entity_title for a in ANNOTATOR(query))
+
+    def _candidates(self, query_entities):
+        self.candidates_calls += 1
+        return super(OfflineExpertFinding, self)._candidates(query_entities)
+
+
+release = threading.Event()
+
+
+def blocking_score(ef, query_entities, author_id):
+    release.wait()
+    return 0.0
+
+
+class QueryPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage_db = os.path.join(self.tmp_dir, "ef.db")
+        builder = ExpertFinding(self.storage_db).builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers())
+        builder.finish()
+        self.ef = OfflineExpertFinding(self.storage_db, read_only=True)
+        release.clear()
+
+    def tearDown(self):
+        release.set()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_candidates_retrieved_once(self):
+        scorings = [ExpertFinding.efiaf_score, ExpertFinding.cossim_efiaf_score, ExpertFinding.eciaf_score]
+        expected, _, _ = self.ef.find_expert_multi(QUERY, scorings)
+        self.ef.candidates_calls = 0
+        rankings, timings, _ = QueryPipeline(self.ef).find_expert_multi(QUERY, scorings)
+        self.assertEqual(expected, rankings)
+        self.assertEqual(1, self.ef.candidates_calls)
+        self.assertIn("cossim_efiaf_score.profiles", timings)
+
+    def test_saturated_scoring_pool(self):
+        pipeline = QueryPipeline(self.ef, scoring_workers=1, scoring_timeout=0.05)
+        skipped = metrics.SCORINGS_SKIPPED.value(("blocking_score",))
+        timeouts = metrics.TIMEOUTS.value(("blocking_score",))
+        rankings, _, _ = pipeline.find_expert_multi(QUERY, [ExpertFinding.efiaf_score, blocking_score])
+        self.assertIsNotNone(rankings[0])
+        self.assertIsNone(rankings[1])
+        self.assertEqual(timeouts + 1, metrics.TIMEOUTS.value(("blocking_score",)))
+
+        # The only scoring thread is still busy: the ranking is not started, annotation goes on.
+        rankings, _, query_entities = pipeline.find_expert_multi(u"Compilers", [ExpertFinding.efiaf_score, blocking_score])
+        self.assertEqual(set([u"Compilers"]), query_entities)
+        self.assertIsNotNone(rankings[0])
+        self.assertIsNone(rankings[1])
+        self.assertEqual(skipped + 1, metrics.SCORINGS_SKIPPED.value(("blocking_score",)))
+        self.assertEqual(timeouts + 1, metrics.TIMEOUTS.value(("blocking_score",)))
+
+        release.set()
+        pipeline.scoring_timeout = None
+        # The scoring thread is released once the ranking that timed out completes.
+        while pipeline._scoring_tasks:
+            time.sleep(0.01)
+        rankings, _, _ = pipeline.find_expert_multi(QUERY, [blocking_score])
+        self.assertEqual(4, len(rankings[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+'''
+Tests of expertfinding.query_cache.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+from expertfinding.query_cache import QueryCache
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8, u"Compilers": 0.7, u"Cryptography": 0.6})
+
+
+def papers(authors, topics):
+    for i, author_id in enumerate(authors):
+        for j, topic in enumerate(topics):
+            yield Paper(author_id, u"Name of " + author_id, u"Institution", 2010 + j,
+                        u"A paper {} about {} and {}".format(i, topic, topics[(i + j) % len(topics)]), None)
+
+
+class OfflineExpertFinding(ExpertFinding):
+
+    def query_entities(self, query):
+        return set(a.entity_title for a in ANNOTATOR(query))
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage_db = os.path.join(self.tmp_dir, "ef.db")
+        self.build("first", papers(["a1", "a2", "a3"], [u"Graph Theory", u"Databases"]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, input_f, papers, incremental=False):
+        builder = ExpertFinding(self.storage_db).builder(annotator=ANNOTATOR, incremental=incremental)
+        builder.add_documents(input_f, papers)
+        builder.finish()
+
+    def ranking(self, cache, query):
+        (ranking,), _, _ = cache.find_expert_multi(query, [ExpertFinding.efiaf_score])
+        return [(r["author_id"], r["score"]) for r in ranking]
+
+    def check_rankings_after_incremental_build(self, in_memory_index):
+        cache = QueryCache(OfflineExpertFinding(self.storage_db, read_only=True, in_memory_index=in_memory_index))
+        query = u"Graph Theory and Databases"
+        before = self.ranking(cache, query)
+        self.assertEqual(before, self.ranking(cache, query))
+
+        self.build("second", papers(["b1", "b2", "a1"], [u"Databases", u"Compilers", u"Cryptography"]), incremental=True)
+        after = self.ranking(cache, query)
+        fresh = self.ranking(QueryCache(OfflineExpertFinding(self.storage_db, read_only=True)), query)
+        self.assertNotEqual(sorted(before), sorted(after))
+        self.assertEqual(sorted(fresh), sorted(after))
+
+    def test_rankings_after_incremental_build(self):
+        self.check_rankings_after_incremental_build(False)
+
+    def test_rankings_after_incremental_build_in_memory_index(self):
+        self.check_rankings_after_incremental_build(True)
+
+
+if __name__ == "__main__":
+    unittest.main()
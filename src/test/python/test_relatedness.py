@@ -0,0 +1,81 @@
+'''
+Tests of expertfinding.relatedness.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding.relatedness import RelatednessStore
+
+
+def relatedness(t1, t2):
+    return sum(ord(c) for c in t1 + t2) % 97 / 97.0
+
+
+class CountingFetch(object):
+
+    def __init__(self):
+        self.pairs = []
+
+    def __call__(self, title_pairs):
+        self.pairs += title_pairs
+        return [relatedness(t1, t2) for t1, t2 in title_pairs]
+
+
+def no_fetch(title_pairs):
+    raise IOError("Relatedness should not be fetched")
+
+
+class RelatednessStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "relatedness.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_symmetric_keys(self):
+        fetch = CountingFetch()
+        store = RelatednessStore(self.path, fetch)
+        self.assertEqual(relatedness(u"Graph", u"Databases"), store.relatedness(u"Graph", u"Databases"))
+        self.assertEqual(relatedness(u"Graph", u"Databases"), store.relatedness(u"Databases", u"Graph"))
+        self.assertEqual(1, len(fetch.pairs))
+        self.assertEqual(1, store.hits)
+        self.assertEqual(1, store.misses)
+
+    def test_matrix(self):
+        titles_1, titles_2 = [u"Graph", u"Databases", u"Compilers"], [u"Databases", u"Cryptography"]
+        fetch = CountingFetch()
+        store = RelatednessStore(self.path, fetch)
+        matrix = store.matrix(titles_1, titles_2)
+        self.assertEqual([[relatedness(t1, t2) for t2 in titles_2] for t1 in titles_1], matrix.tolist())
+        self.assertEqual([[store.relatedness(t1, t2) for t2 in titles_2] for t1 in titles_1], matrix.tolist())
+        # (Databases, Databases) is fetched once, and so is each unordered pair.
+        self.assertEqual(6, len(fetch.pairs))
+        self.assertEqual((0, 2), store.matrix([], titles_2).shape)
+
+    def test_eviction(self):
+        titles_1, titles_2 = [u"Graph", u"Databases", u"Compilers"], [u"Cryptography", u"Networks"]
+        fetch = CountingFetch()
+        store = RelatednessStore(self.path, fetch, hot_size=2)
+        expected = [[relatedness(t1, t2) for t2 in titles_2] for t1 in titles_1]
+        self.assertEqual(expected, store.matrix(titles_1, titles_2).tolist())
+        self.assertEqual(2, store.stats()["hot_pairs"])
+        # Evicted pairs are read from the store, not fetched again.
+        self.assertEqual(expected, store.matrix(titles_1, titles_2).tolist())
+        self.assertEqual(6, len(fetch.pairs))
+        self.assertEqual(2, store.stats()["hot_pairs"])
+
+    def test_persistence(self):
+        store = RelatednessStore(self.path, CountingFetch())
+        store.matrix([u"Graph", u"Databases"], [u"Compilers"])
+        store = RelatednessStore(self.path, no_fetch)
+        self.assertEqual(relatedness(u"Compilers", u"Databases"), store.relatedness(u"Compilers", u"Databases"))
+        self.assertEqual([[relatedness(u"Graph", u"Compilers")]], store.matrix([u"Graph"], [u"Compilers"]).tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+Tests of the paginated endpoints of expertfinding.web.server.
+'''
+
+import base64
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+from expertfinding.web import server
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8, u"Compilers": 0.7})
+ENTITIES = json.dumps([u"Graph Theory", u"Databases", u"Compilers"])
+
+
+def papers():
+    topics = [u"Graph Theory", u"Databases", u"Compilers"]
+    for i in range(6):
+        yield Paper("a1", u"Name", u"Institution", 2010 + i, u"Paper {} on {} and {}".format(i, topics[i % 3], topics[i % 2]), None)
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+class PaginationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_db = os.path.join(self.tmp_dir, "ef.db")
+        builder = ExpertFinding(storage_db).builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers())
+        builder.finish()
+        server.exf = ExpertFinding(storage_db, read_only=True)
+        self.client = server.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get(self, path, **args):
+        return self.client.get(path, query_string=args)
+
+    def test_author_pages(self):
+        entities = json.loads(self.get("/author", id="a1").data)["entities"]
+        pages = []
+        next_cursor = None
+        while True:
+            page = json.loads(self.get("/author", id="a1", limit=1, **({"cursor": next_cursor} if next_cursor else {})).data)
+            pages += page["entities"]
+            next_cursor = page["next_cursor"]
+            if next_cursor is None:
+                break
+        self.assertEqual(entities, pages)
+
+    def test_author_invalid_cursors(self):
+        for values in [5, u"Databases", [2], [u"Databases", 2], [2, 3], [True, u"Databases"], {"frequency": 2}]:
+            self.assertEqual(400, self.get("/author", id="a1", limit=1, cursor=cursor(values)).status_code, values)
+        self.assertEqual(400, self.get("/author", id="a1", limit=1, cursor="not a cursor").status_code)
+        self.assertEqual(200, self.get("/author", id="a1", limit=1, cursor=cursor([2, u"Databases"])).status_code)
+
+    def test_documents_invalid_cursors(self):
+        for values in [u"5", [5], [2, u"Databases"], 2.5, True, None]:
+            self.assertEqual(400, self.get("/documents", a="a1", e=ENTITIES, limit=1, cursor=cursor(values)).status_code, values)
+        self.assertEqual(400, self.get("/documents", a="a1", e=ENTITIES, limit=1, cursor="not a cursor").status_code)
+        self.assertEqual(200, self.get("/documents", a="a1", e=ENTITIES, limit=1, cursor=cursor(0)).status_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+'''
+Tests of expertfinding.sharding.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from expertfinding import ExpertFinding, DEFAULT_MIN_SCORE
+from expertfinding import sharding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+from expertfinding.sharding import ShardedExpertFinding
+
+
+ANNOTATOR = DictionaryAnnotator({u"Graph Theory": 0.9, u"Databases": 0.8, u"Compilers": 0.7, u"Cryptography": 0.6})
+QUERY_ENTITIES = set([u"Graph Theory", u"Databases", u"Cryptography"])
+SHARDS = 3
+
+
+def papers():
+    topics = [u"Graph Theory", u"Databases", u"Compilers", u"Cryptography"]
+    for i in range(60):
+        yield Paper("a{}".format(i % 13), u"Name {}".format(i % 13), u"Institution", 2010 + i % 5,
+                    u"Paper {} on {} and {}".format(i, topics[i % 4], topics[i % 3]), None)
+
+
+class ShardedExpertFindingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_db = os.path.join(self.tmp_dir, "ef.db")
+        builder = ExpertFinding(storage_db).builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers())
+        builder.finish()
+        self.ef = ExpertFinding(storage_db, read_only=True)
+
+        sharded_db = os.path.join(self.tmp_dir, "sharded.db")
+        paths = sharding.shard_paths(sharded_db, SHARDS)
+        for i, path in enumerate(paths):
+            ExpertFinding(path).builder(annotator=ANNOTATOR, shard=(i, SHARDS)).add_documents("papers", papers())
+        sharding.merge_statistics(paths, DEFAULT_MIN_SCORE)
+        self.sharded = ShardedExpertFinding(sharded_db, SHARDS)
+
+    def tearDown(self):
+        self.sharded.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def rankings(self, ef, scorings, top_k):
+        rankings, _, _ = ef.find_expert_multi(None, scorings, top_k=top_k, query_entities=QUERY_ENTITIES)
+        return [[(r["author_id"], round(r["score"], 9)) for r in ranking] for ranking in rankings]
+
+    def test_rankings(self):
+        scorings = [ExpertFinding.efiaf_score, ExpertFinding.eciaf_score, ExpertFinding.cossim_efiaf_score]
+        for top_k in (None, 5):
+            self.assertEqual(self.rankings(self.ef, scorings, top_k), self.rankings(self.sharded, scorings, top_k))
+
+    def test_statistics(self):
+        expected, statistics = self.ef.statistics, self.sharded.statistics
+        self.assertEqual(expected.total_papers, statistics.total_papers)
+        self.assertEqual(expected.entity_popularity, statistics.entity_popularity)
+        self.assertEqual(dict(expected.author_papers), dict(statistics.author_papers))
+        self.assertEqual(0, statistics.author_papers.get("unknown", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+Tests of expertfinding.snapshot.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from expertfinding import ExpertFinding
+from expertfinding.annotators import DictionaryAnnotator
+from expertfinding.preprocessing.datasetreader import Paper
+from expertfinding.snapshot import StringTable
+
+
+TOPICS = [u"Graph Theory", u"Databases", u"Compilers", u"Caf\xe9 Society"]
+ANNOTATOR = DictionaryAnnotator(dict((topic, 0.9) for topic in TOPICS))
+AUTHORS = [("a1", u"Anna Rossi", u"Universit\xe0 di Pisa"), ("a2", u"J\xfcrgen M\xfcller", None),
+           ("a3", u"Marco Rossini", u"ISTI"), ("a4", u"Zo\xeb Bianchi", u"Universit\xe0 di Pisa")]
+
+
+def papers():
+    for i, (author_id, name, institution) in enumerate(AUTHORS):
+        for j in range(i + 2):
+            yield Paper(author_id, name, institution, 2010 + j,
+                        u"Paper {} on {} and {}".format(j, TOPICS[(i + j) % 4], TOPICS[j % 3]), None)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage_db = os.path.join(self.tmp_dir, "ef.db")
+        self.snapshot_path = os.path.join(self.tmp_dir, "snapshot")
+        builder = ExpertFinding(self.storage_db).builder(annotator=ANNOTATOR)
+        builder.add_documents("papers", papers())
+        builder.finish()
+        self.built = ExpertFinding(self.storage_db, read_only=True, in_memory_index=True)
+        self.built.save_snapshot(self.snapshot_path)
+        self.loaded = ExpertFinding(self.storage_db, read_only=True, snapshot_path=self.snapshot_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_index(self):
+        built, loaded = self.built.index, self.loaded.index
+        self.assertIsInstance(loaded.entities, StringTable)
+        for name in ("entities", "author_ids", "author_names"):
+            self.assertEqual(list(getattr(built, name)), list(getattr(loaded, name)))
+        for name in ("entity_popularity", "entity_offsets", "posting_authors", "posting_counts", "posting_max_rho", "author_papers"):
+            self.assertTrue(numpy.array_equal(getattr(built, name), getattr(loaded, name)), name)
+        self.assertEqual(built.total_papers, loaded.total_papers)
+
+    def test_statistics(self):
+        built, loaded = self.built.statistics, self.loaded.statistics
+        self.assertEqual(built.total_papers, loaded.total_papers)
+        self.assertEqual(built.entity_popularity, dict(loaded.entity_popularity))
+        self.assertEqual(built.author_papers, dict(loaded.author_papers))
+        self.assertEqual(0, loaded.author_papers.get("unknown", 0))
+
+    def test_rankings(self):
+        scorings = [ExpertFinding.efiaf_score, ExpertFinding.eciaf_score, ExpertFinding.log_ec_ef_iaf_score, ExpertFinding.cossim_efiaf_score]
+        for query_entities in (set(TOPICS), set(TOPICS[:1]), set(TOPICS[2:])):
+            for top_k in (None, 2):
+                built, _, _ = self.built.find_expert_multi(None, scorings, top_k=top_k, query_entities=query_entities)
+                loaded, _, _ = self.loaded.find_expert_multi(None, scorings, top_k=top_k, query_entities=query_entities)
+                self.assertEqual(built, loaded)
+
+    def test_completion(self):
+        self.assertEqual([u"a1", u"a3"], sorted(a[0] for a in self.loaded.authors_completion(u"ross")))
+        for terms in (u"ross", u"m\xfcl", u"z", u"nobody"):
+            self.assertEqual(self.built.authors_completion(terms), self.loaded.authors_completion(terms))
+
+    def test_stale_snapshot(self):
+        builder = ExpertFinding(self.storage_db).builder(annotator=ANNOTATOR, incremental=True)
+        builder.add_documents("more", [Paper("a5", u"New Author", None, 2015, u"A paper on Databases", None)])
+        builder.finish()
+        self.assertFalse(ExpertFinding(self.storage_db, read_only=True).load_snapshot(self.snapshot_path))
+
+
+if __name__ == "__main__":
+    unittest.main()